@@ -2,6 +2,9 @@
 ASGI config for alx_backend_graphql_crm project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with any ASGI server, e.g. ``uvicorn alx_backend_graphql.asgi:application``;
+/graphql/async then runs queries on the event loop with the async ORM, and
+/graphql/ws serves subscriptions over graphql-ws.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -11,6 +14,10 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql_crm.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from crm.subscriptions import websocket_application  # noqa: E402, needs the apps loaded
+
+application = websocket_application(django_application)
@@ -16,11 +16,24 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
+from crm.views import (
+    AsyncCRMGraphQLView,
+    CRMGraphQLView,
+    document_cache_stats,
+    export_orders_view,
+    import_view,
+    schema_view,
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-     path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True))),
+     path("graphql", csrf_exempt(CRMGraphQLView.as_view(graphiql=True))),
+    # Same schema on the async ORM, serve it with an ASGI server (see asgi.py)
+    path("graphql/async", csrf_exempt(AsyncCRMGraphQLView.as_view(graphiql=True))),
+    path("graphql/cache", document_cache_stats),
+    path("graphql/schema", schema_view),
+    path("import/<str:kind>", import_view),
+    path("export/orders", export_orders_view),
 
 ]
@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+
+from .models import Customer, CustomerImport
+from .response_cache import invalidate
+from .validators import clean_customer
+
+
+def get_batch_size(batch_size=None):
+    """Rows per INSERT, from the argument or the CRM_BULK_CREATE_BATCH_SIZE setting."""
+    return batch_size or getattr(settings, "CRM_BULK_CREATE_BATCH_SIZE", 1000)
+
+
+def existing_emails(emails):
+    """Return the subset of ``emails`` already stored, using one ``email__in`` lookup.
+
+    The lookup is only split when the backend caps the number of query
+    parameters (SQLite), never per row.
+    """
+    emails = list(emails)
+    chunk_size = connection.features.max_query_params or len(emails) or 1
+    found = set()
+    for start in range(0, len(emails), chunk_size):
+        chunk = emails[start:start + chunk_size]
+        found.update(Customer.objects.filter(email__in=chunk).values_list("email", flat=True))
+    return found
+
+
+def validate_customers(rows):
+    """Validate a batch of customer rows in memory.
+
+    Returns ``(valid, errors)`` where ``valid`` is a list of ``(index, Customer)``
+    ready to insert and ``errors`` a list of ``(index, message)``. Duplicate emails
+    are reported both against the database and inside the batch itself.
+    """
+    valid = []
+    errors = []
+    seen = set()
+    for index, data in enumerate(rows):
+        try:
+            cleaned = clean_customer(data)
+        except ValueError as e:
+            errors.append((index, str(e)))
+            continue
+        email = cleaned["email"]
+        # No row number: the stream importer numbers rows across batches, an
+        # index of this batch would point at the wrong one
+        if email in seen:
+            errors.append((index, f"Email '{email}' is repeated in this batch."))
+            continue
+        seen.add(email)
+        valid.append((index, Customer(**cleaned)))
+
+    taken = existing_emails(seen)
+    if taken:
+        for index, customer in valid:
+            if customer.email in taken:
+                errors.append((index, f"Email '{customer.email}' already exists."))
+        valid = [(index, customer) for index, customer in valid if customer.email not in taken]
+        errors.sort(key=lambda error: error[0])
+    return valid, errors
+
+
+def create_customers(customers, batch_size=None):
+    """Insert ``customers`` with ``bulk_create`` in chunks of ``batch_size``."""
+    invalidate(Customer)
+    return Customer.objects.bulk_create(customers, batch_size=get_batch_size(batch_size))
+
+
+def create_customers_partial(valid, batch_size=None, progress=None):
+    """Insert ``(index, Customer)`` pairs chunk by chunk, each in its own savepoint.
+
+    A chunk that fails (e.g. an email taken concurrently) is retried row by row
+    so only the offending rows are rejected. ``progress`` is called with the
+    number of rows handled after every chunk. Returns ``(created, errors)``.
+    """
+    batch_size = get_batch_size(batch_size)
+    created = []
+    errors = []
+    invalidate(Customer)
+    for start in range(0, len(valid), batch_size):
+        chunk = valid[start:start + batch_size]
+        try:
+            with transaction.atomic():
+                created.extend(Customer.objects.bulk_create([customer for _, customer in chunk]))
+        except IntegrityError:
+            for index, customer in chunk:
+                customer.pk = None
+                try:
+                    with transaction.atomic():
+                        customer.save(force_insert=True)
+                    created.append(customer)
+                except IntegrityError:
+                    errors.append((index, f"Email '{customer.email}' already exists."))
+        if progress:
+            progress(start + len(chunk))
+    return created, errors
+
+
+def import_customers_partial(rows, batch_size=None, import_token=None, progress=None):
+    """Commit the valid rows of a batch and remember the failed ones.
+
+    With ``import_token`` the rows are the ones that failed in that import,
+    re-sent in the same order, and their errors are reported with their index
+    in the original batch. Returns ``(created, errors, customer_import)``;
+    ``customer_import`` is None when a first pass had no failures.
+    ``progress`` is called with the number of rows handled so far, the
+    rows rejected by validation counting as handled.
+    """
+    customer_import = None
+    positions = list(range(len(rows)))
+    if import_token:
+        try:
+            customer_import = CustomerImport.objects.get(token=import_token)
+        except (CustomerImport.DoesNotExist, ValueError, ValidationError):
+            raise ValueError(f"Unknown import token: {import_token}")
+        if len(rows) != len(customer_import.failed_rows):
+            raise ValueError(
+                f"Import {import_token} expects the {len(customer_import.failed_rows)} failed rows to be re-sent, got {len(rows)}."
+            )
+        positions = customer_import.failed_rows
+
+    valid, errors = validate_customers(rows)
+    rejected = len(rows) - len(valid)
+    created, insert_errors = create_customers_partial(
+        valid, batch_size, progress and (lambda done: progress(rejected + done))
+    )
+    errors = sorted(
+        ((positions[index], message) for index, message in errors + insert_errors),
+        key=lambda error: error[0],
+    )
+
+    if customer_import is None and errors:
+        customer_import = CustomerImport(total_rows=len(rows))
+    if customer_import is not None:
+        customer_import.created_count += len(created)
+        customer_import.failed_rows = sorted({index for index, _ in errors})
+        customer_import.save()
+    return created, errors, customer_import
@@ -0,0 +1,221 @@
+import threading
+from inspect import isawaitable
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+from graphql import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLList,
+    GraphQLNonNull,
+    IntValueNode,
+    get_named_type,
+    is_leaf_type,
+)
+from graphene_django.utils import maybe_queryset
+from graphql.validation import ValidationRule
+
+# Static query cost: every object a query can return costs its field's weight
+# (1 unless CRM_QUERY_FIELD_WEIGHTS says otherwise), multiplied by how many of
+# its parents there can be. A page holds ``first``/``last`` rows, or a full
+# page when the argument is missing or a variable (validation doesn't see
+# variables). A plain list (e.g. Customer.orders) has no size limit, so it is
+# only assumed to hold CRM_QUERY_LIST_SIZE items: the estimate rejects the
+# obvious fan-outs before anything runs, and ``CostLimit`` stops the others
+# once what they actually return goes over the same budget. Scalars are free.
+
+
+def get_limits():
+    return (
+        getattr(settings, "CRM_QUERY_MAX_COST", 20000),
+        getattr(settings, "CRM_QUERY_MAX_DEPTH", 10),
+    )
+
+
+def field_weight(type_name, field_name):
+    return getattr(settings, "CRM_QUERY_FIELD_WEIGHTS", {}).get(f"{type_name}.{field_name}", 1)
+
+
+def is_list(type_):
+    if isinstance(type_, GraphQLNonNull):
+        type_ = type_.of_type
+    return isinstance(type_, GraphQLList)
+
+
+def page_size(node, field):
+    """Rows a paginated field can return, None for a field that isn't paginated."""
+    if "first" not in field.args and "last" not in field.args:
+        return None
+    arguments = {argument.name.value: argument.value for argument in node.arguments or ()}
+    sizes = [int(arguments[name].value) for name in ("first", "last")
+             if isinstance(arguments.get(name), IntValueNode)]
+    return min(sizes + [getattr(settings, "CRM_QUERY_PAGE_SIZE", 100)])
+
+
+def collect_fields(selection_set, parent_type, schema, fragments, seen=frozenset()):
+    """``(FieldNode, parent type, fragments)`` of a selection set, fragments
+    expanded. ``fragments`` names the fragments each field is nested in,
+    ``seen`` those of the selection set; pass them down to the field's own
+    selection set so a fragment spread inside itself is not expanded again."""
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection, parent_type, seen
+            continue
+        inner = seen
+        if isinstance(selection, FragmentSpreadNode):
+            name = selection.name.value
+            fragment = fragments.get(name)
+            # Fragment cycles are reported by the standard rules, just stop here
+            if fragment is None or name in seen:
+                continue
+            inner = seen | {name}
+        else:
+            fragment = selection
+        type_ = parent_type
+        if fragment.type_condition is not None:
+            type_ = schema.get_type(fragment.type_condition.name.value) or parent_type
+        yield from collect_fields(fragment.selection_set, type_, schema, fragments, inner)
+
+
+def selection_cost(selection_set, parent_type, schema, fragments, multiplier=1, depth=1, seen=frozenset()):
+    """``(cost, depth)`` of a selection set on ``parent_type``."""
+    cost, max_depth = 0, depth - 1
+    for node, type_, nested_seen in collect_fields(selection_set, parent_type, schema, fragments, seen):
+        name = node.name.value
+        field = getattr(type_, "fields", {}).get(name)
+        if name.startswith("__") or field is None or node.selection_set is None:
+            continue
+        field_multiplier = multiplier
+        if is_list(field.type) and not (name == "edges" and type_.name.endswith("Connection")):
+            field_multiplier *= getattr(settings, "CRM_QUERY_LIST_SIZE", 10)
+        cost += field_weight(type_.name, name) * field_multiplier
+        # The connection itself is one object, what's under it is per row
+        page = page_size(node, field)
+        if page is not None:
+            field_multiplier *= page
+        nested_cost, nested_depth = selection_cost(
+            node.selection_set, get_named_type(field.type), schema, fragments, field_multiplier, depth + 1,
+            nested_seen,
+        )
+        cost += nested_cost
+        max_depth = max(max_depth, nested_depth)
+    return cost, max_depth
+
+
+def get_fragments(document):
+    return {
+        definition.name.value: definition
+        for definition in document.definitions
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+
+
+def estimate(schema, document, operation):
+    """``(cost, depth)`` of one operation of ``document``."""
+    root = schema.get_root_type(operation.operation)
+    return selection_cost(operation.selection_set, root, schema, get_fragments(document))
+
+
+estimates = WeakKeyDictionary()
+estimates_lock = threading.Lock()
+
+
+def get_estimate(schema, document, operation):
+    """``estimate()`` worked out once per document and operation."""
+    with estimates_lock:
+        cached = estimates.get(document, {}).get(operation)
+    if cached is None:
+        cached = estimate(schema, document, operation)
+        with estimates_lock:
+            estimates.setdefault(document, {})[operation] = cached
+    return cached
+
+
+def actual_cost(schema, document, operation, data):
+    """The cost of what an operation returned, priced like ``estimate()``."""
+    root = schema.get_root_type(operation.operation)
+    return data_cost(data, operation.selection_set, root, schema, get_fragments(document))
+
+
+def data_cost(data, selection_set, parent_type, schema, fragments, seen=frozenset()):
+    cost = 0
+    for node, type_, nested_seen in collect_fields(selection_set, parent_type, schema, fragments, seen):
+        name = node.name.value
+        field = getattr(type_, "fields", {}).get(name)
+        value = data.get(node.alias.value if node.alias else name) if isinstance(data, dict) else None
+        if value is None or name.startswith("__") or field is None or node.selection_set is None:
+            continue
+        items = value if isinstance(value, list) else [value]
+        cost += field_weight(type_.name, name) * len(items)
+        for item in items:
+            cost += data_cost(item, node.selection_set, get_named_type(field.type), schema, fragments, nested_seen)
+    return cost
+
+
+class QueryCostRule(ValidationRule):
+    """Reject operations above the CRM_QUERY_MAX_COST / CRM_QUERY_MAX_DEPTH budget."""
+
+    def enter_operation_definition(self, node, *args):
+        schema = self.context.schema
+        if schema.get_root_type(node.operation) is None:
+            return
+        cost, depth = get_estimate(schema, self.context.document, node)
+        max_cost, max_depth = get_limits()
+        name = f"'{node.name.value}' " if node.name else ""
+        if depth > max_depth:
+            self.report_error(GraphQLError(
+                f"Operation {name}is {depth} levels deep, the limit is {max_depth}.",
+                node, extensions={"code": "QUERY_TOO_DEEP", "depth": depth, "maxDepth": max_depth},
+            ))
+        if cost > max_cost:
+            self.report_error(GraphQLError(
+                f"Operation {name}has an estimated cost of {cost}, the limit is {max_cost}.",
+                node, extensions={"code": "QUERY_TOO_COSTLY", "cost": cost, "maxCost": max_cost},
+            ))
+
+
+class CostLimit:
+    """Graphene middleware charging what an operation actually returns, priced
+    like ``actual_cost()``, against CRM_QUERY_MAX_COST as it resolves.
+
+    The field that goes over the budget fails with QUERY_TOO_COSTLY and the
+    fields resolved after it come back empty, so a fan-out of plain lists
+    larger than the estimate assumed is cut short instead of loaded.
+    """
+
+    def __init__(self):
+        self.cost = 0
+        self.max_cost = get_limits()[0]
+        self.exceeded = False
+
+    def resolve(self, next, root, info, **args):
+        if info.field_name.startswith("__") or is_leaf_type(get_named_type(info.return_type)):
+            return next(root, info, **args)
+        if self.exceeded:
+            return [] if is_list(info.return_type) else None
+        result = next(root, info, **args)
+        if isawaitable(result):
+            return self.charge_async(result, info)
+        return self.charge(result, info)
+
+    async def charge_async(self, result, info):
+        return self.charge(await result, info)
+
+    def charge(self, result, info):
+        if result is None:
+            return result
+        count = 1
+        if is_list(info.return_type):
+            # Evaluated here to be counted, graphql-core would iterate it anyway
+            result = list(maybe_queryset(result))
+            count = len(result)
+        self.cost += field_weight(info.parent_type.name, info.field_name) * count
+        if self.cost > self.max_cost:
+            self.exceeded = True
+            raise GraphQLError(
+                f"Operation went over the cost limit of {self.max_cost} while executing.",
+                extensions={"code": "QUERY_TOO_COSTLY", "maxCost": self.max_cost},
+            )
+        return result
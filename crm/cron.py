@@ -1,6 +1,29 @@
 from datetime import datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+
+from .graphql_client import execute
+
+# Both jobs run inside the Django process, so they execute their operation
+# against the schema directly instead of calling back into the app over HTTP
+
+HELLO_QUERY = """
+query {
+  hello
+}
+"""
+
+UPDATE_LOW_STOCK_MUTATION = """
+mutation {
+  updateLowStockProducts {
+    success
+    updatedCount
+    updatedProducts {
+      id
+      stock
+    }
+  }
+}
+"""
+
 
 def log_crm_heartbeat():
     """Logs heartbeat message and queries GraphQL hello field to verify health."""
@@ -13,21 +36,7 @@ def log_crm_heartbeat():
 
     # GraphQL hello query
     try:
-        transport = RequestsHTTPTransport(
-            url="http://localhost:8000/graphql",
-            verify=True,
-            retries=3,
-        )
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-
-        query = gql(
-            """
-            query {
-              hello
-            }
-            """
-        )
-        response = client.execute(query)
+        response = execute(HELLO_QUERY)
 
         hello_value = response.get("hello", "No response")
         with open(log_file, "a") as f:
@@ -43,38 +52,15 @@ def update_low_stock():
     timestamp = datetime.now().strftime("%d/%m/%Y-%H:%M:%S")
 
     try:
-        # Configure GraphQL client
-        transport = RequestsHTTPTransport(
-            url="http://localhost:8000/graphql",
-            verify=True,
-            retries=3,
-        )
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-
-        # Define mutation
-        mutation = gql(
-            """
-            mutation {
-              updateLowStockProducts {
-                success
-                updatedProducts {
-                  name
-                  stock
-                }
-              }
-            }
-            """
-        )
-
         # Execute mutation
-        response = client.execute(mutation)
+        response = execute(UPDATE_LOW_STOCK_MUTATION)
         result = response.get("updateLowStockProducts", {})
         updated = result.get("updatedProducts", [])
 
         with open(log_file, "a") as f:
-            f.write(f"{timestamp} - {result.get('success')}\n")
+            f.write(f"{timestamp} - {result.get('success')} ({result.get('updatedCount')} products)\n")
             for product in updated:
-                f.write(f"{timestamp} - {product['name']} restocked to {product['stock']}\n")
+                f.write(f"{timestamp} - Product {product['id']} restocked to {product['stock']}\n")
 
     except Exception as e:
         with open(log_file, "a") as f:
@@ -18,24 +18,9 @@ source "$PATH_ENV"
 # Path to Django's manage.py
 PATH_MANGE="/home/momentum49/alx-backend-graphql_crm/manage.py"
 
-# Run the cleanup logic inside Django shell
-python3 "$PATH_MANGE" shell -c "
-from crm.models import Customer
-from datetime import timedelta, date
-
 # Log file to store cleanup results
-LOG_FILE = '/home/momentum49/alx-backend-graphql_crm/crm/cron_jobs/tmp/customer_cleanup_log.txt'
-
-# Calculate the cutoff date: one year ago from today
-one_year_ago = date.today() - timedelta(days=365)
-
-# Query all customers who have NOT placed orders in the last year
-cust_without_orders = Customer.objects.exclude(orders__order_date__date__gte=one_year_ago)
+LOG_FILE="/home/momentum49/alx-backend-graphql_crm/crm/cron_jobs/tmp/customer_cleanup_log.txt"
 
-# Delete those customers and capture the number deleted
-deleted_cus_count, _ = cust_without_orders.delete()
-print(deleted_cus_count)
-# Append the result with timestamp to the log file
-with open(LOG_FILE, 'a') as f:
-    f.write(f'{date.today()} - Deleted {deleted_cus_count} customers\n')
-"
\ No newline at end of file
+# Delete customers without an order in the last year, in small batches,
+# appending the progress (rows/s) and the final count to the log file
+python3 "$PATH_MANGE" prune_inactive_customers --days 365 >> "$LOG_FILE" 2>&1
@@ -0,0 +1,77 @@
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from graphql import GraphQLError, parse, print_schema, validate
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "size", "maxsize"])
+
+
+class DocumentCache:
+    """Thread-safe LRU of parsed documents, counting hits and misses."""
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            document = self.documents.get(key)
+            if document is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.documents.move_to_end(key)
+            return document
+
+    def set(self, key, document):
+        with self.lock:
+            self.documents[key] = document
+            self.documents.move_to_end(key)
+            if len(self.documents) > self.maxsize:
+                self.documents.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.documents.clear()
+            self.hits = self.misses = 0
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, len(self.documents), self.maxsize)
+
+    def __len__(self):
+        return len(self.documents)
+
+
+documents = DocumentCache(getattr(settings, "CRM_DOCUMENT_CACHE_SIZE", 1000))
+
+
+@lru_cache(maxsize=None)
+def schema_version(schema):
+    """Digest of the schema SDL, so a changed schema never reuses old validations."""
+    return hashlib.sha256(print_schema(schema).encode("utf-8")).hexdigest()[:16]
+
+
+def parse_and_validate(schema, query, rules=None, max_errors=None):
+    """``(document, errors)`` for ``query``, parsed and validated at most once.
+
+    Results are cached on the query text, the schema version and the validation
+    rules, so byte-identical queries skip graphql-core's parser and validator.
+    Syntax errors come back as ``(None, [error])`` and are cached as well.
+    """
+    key = (schema_version(schema), tuple(rules or ()), query)
+    cached = documents.get(key)
+    if cached is not None:
+        return cached
+    try:
+        document = parse(query)
+    except GraphQLError as e:
+        result = (None, [e])
+    else:
+        result = (document, validate(schema, document, rules, max_errors))
+    documents.set(key, result)
+    return result
@@ -0,0 +1,118 @@
+import csv
+import json
+import zlib
+from io import StringIO
+
+from django.db.models import Prefetch
+
+from .models import Order, OrderItem
+from .reports import order_range_filter
+
+FORMATS = ("ndjson", "csv")
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# One CSV line per order line, orders without lines get one with empty product columns
+CSV_FIELDS = (
+    "order_id", "order_date", "total_amount",
+    "customer_id", "customer_name", "customer_email",
+    "product_id", "product_name", "quantity", "unit_price",
+)
+
+# Bytes gathered before a chunk is handed to the response or file
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+def export_orders(start_date=None, end_date=None, chunk_size=2000):
+    """Yield one dict per order in ``[start_date, end_date]``, with its customer
+    and its lines.
+
+    Orders are read with ``.iterator(chunk_size=...)``: each chunk of orders
+    comes with its lines and their products in one prefetch query, and is
+    dropped before the next is read, so memory doesn't grow with the table.
+    """
+    items = OrderItem.objects.select_related("product").only(
+        "order", "quantity", "unit_price", "product__id", "product__name"
+    ).order_by("pk")
+    orders = (
+        Order.objects.filter(order_range_filter(start_date, end_date))
+        .select_related("customer")
+        .only("id", "order_date", "total_amount", "customer__id", "customer__name", "customer__email")
+        .prefetch_related(Prefetch("items", queryset=items))
+        .order_by("order_date", "id")
+    )
+    for order in orders.iterator(chunk_size=chunk_size):
+        yield {
+            "id": order.pk,
+            "order_date": order.order_date.isoformat(),
+            "total_amount": str(order.total_amount),
+            "customer": {"id": order.customer.pk, "name": order.customer.name, "email": order.customer.email},
+            "items": [
+                {
+                    "product_id": item.product.pk,
+                    "product_name": item.product.name,
+                    "quantity": item.quantity,
+                    "unit_price": str(item.unit_price),
+                }
+                for item in order.items.all()
+            ],
+        }
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def csv_lines(rows):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(CSV_FIELDS)
+    for row in rows:
+        order = [row["id"], row["order_date"], row["total_amount"],
+                 row["customer"]["id"], row["customer"]["name"], row["customer"]["email"]]
+        for item in row["items"] or [None]:
+            product = [item["product_id"], item["product_name"], item["quantity"], item["unit_price"]] if item else [""] * 4
+            yield line(order + product)
+
+
+def buffered(lines, size=WRITE_BUFFER_SIZE):
+    """Join small text lines into UTF-8 chunks of about ``size`` bytes."""
+    chunk, length = [], 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield "".join(chunk).encode("utf-8")
+            chunk, length = [], 0
+    if chunk:
+        yield "".join(chunk).encode("utf-8")
+
+
+def gzipped(chunks):
+    """Compress a stream of byte chunks into one gzip stream, as it goes."""
+    compressor = zlib.compressobj(wbits=31)  # 16 + MAX_WBITS: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(rows, fmt, compress=False):
+    """Render ``rows`` as NDJSON or CSV byte chunks, gzip-compressed on request."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    chunks = buffered(ndjson_lines(rows) if fmt == "ndjson" else csv_lines(rows))
+    return gzipped(chunks) if compress else chunks
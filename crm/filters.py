@@ -5,16 +5,15 @@ import django_filters
 class CustomerFilter(django_filters.FilterSet):
     name = django_filters.CharFilter(field_name='name', lookup_expr='icontains')
     email = django_filters.CharFilter(field_name='email', lookup_expr='icontains')
-    created_at__gte = django_filters.DateFilter(field_name='created_at', lookup_expr='gte')
-    created_at__lte = django_filters.DateFilter(field_name='created_at', lookup_expr='lte')
-    phone_pattern = django_filters.CharFilter(method='phone_pattern')
+    # Prefix match so the phone prefix index can be used (e.g. "+1")
+    phone_pattern = django_filters.CharFilter(method='filter_phone_pattern')
    
 
     class Meta:
         model = Customer
-        fields = ['name', 'email', 'phone', 'created_at']
+        fields = ['name', 'email', 'phone']
     
-    def phone_pattern(self, queryset, name, value):
+    def filter_phone_pattern(self, queryset, name, value):
         return queryset.filter(phone__startswith=value)
     
 class ProductFilter(django_filters.FilterSet):
@@ -30,11 +29,13 @@ class ProductFilter(django_filters.FilterSet):
 
 class OrderFilter(django_filters.FilterSet):
     customer__name = django_filters.CharFilter(field_name='customer__name', lookup_expr='icontains')
-    total_amount__gte = django_filters.NumberFilter(field_name='total_amount', lookup_expr='gt')
-    total_amount__lte = django_filters.NumberFilter(field_name='total_amount', lookup_expr='lt')
-    product_name = django_filters.CharFilter(field_name='products__name', lookup_expr='icontains')
+    total_amount__gte = django_filters.NumberFilter(field_name='total_amount', lookup_expr='gte')
+    total_amount__lte = django_filters.NumberFilter(field_name='total_amount', lookup_expr='lte')
+    product_name = django_filters.CharFilter(field_name='products__name', lookup_expr='icontains', distinct=True)
     order_date_gt = django_filters.DateFilter(field_name="order_date", lookup_expr='gt')
     order_date_lt = django_filters.DateFilter(field_name="order_date", lookup_expr='lt')
+    order_date__gte = django_filters.DateTimeFilter(field_name="order_date", lookup_expr='gte')
+    order_date__lte = django_filters.DateTimeFilter(field_name="order_date", lookup_expr='lte')
 
     class Meta:
         model = Order
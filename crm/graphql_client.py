@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import tempfile
+from functools import lru_cache
+from types import SimpleNamespace
+
+import requests
+from gql import Client, GraphQLRequest
+from gql.transport.requests import RequestsHTTPTransport
+from graphene_django.settings import graphene_settings
+from graphql import execute as execute_document
+
+from .documents import parse_and_validate
+
+GRAPHQL_ENDPOINT = os.environ.get("CRM_GRAPHQL_ENDPOINT", "http://localhost:8000/graphql")
+SCHEMA_CACHE_DIR = os.environ.get("CRM_GRAPHQL_SCHEMA_CACHE", tempfile.gettempdir())
+
+
+class OperationError(Exception):
+    """Raised when an operation comes back with GraphQL errors."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(error.message for error in errors))
+
+
+def get_schema():
+    return graphene_settings.SCHEMA.graphql_schema
+
+
+def execute(source, variables=None, context=None):
+    """Run an operation against the project schema inside this process.
+
+    No HTTP round trip and no introspection: the document is parsed and
+    validated once per process and executed directly, with its own loaders.
+    Returns ``data`` or raises ``OperationError``.
+    """
+    document, errors = parse_and_validate(get_schema(), source)
+    if not errors:
+        context = context if context is not None else SimpleNamespace()
+        result = execute_document(get_schema(), document, context_value=context, variable_values=variables)
+        errors, data = result.errors, result.data
+    if errors:
+        raise OperationError(errors)
+    return data
+
+
+def load_schema(url=GRAPHQL_ENDPOINT, cache_dir=None):
+    """The SDL of the schema served at ``url``, from a local copy when current.
+
+    The copy is stored with the schema version the server sent as its ETag and
+    revalidated with one conditional GET of ``<url>/schema``: a 304 keeps it,
+    a new version after a deploy replaces it. Never an introspection query.
+    """
+    name = f"crm-schema-{hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]}.json"
+    path = os.path.join(cache_dir or SCHEMA_CACHE_DIR, name)
+    try:
+        with open(path, encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        cached = None
+    headers = {"If-None-Match": cached["etag"]} if cached else {}
+    response = requests.get(url.rstrip("/") + "/schema", headers=headers, timeout=10)
+    if response.status_code == 304 and cached:
+        return cached["sdl"]
+    response.raise_for_status()
+    cached = {"etag": response.headers.get("ETag", ""), "sdl": response.text}
+    tmp = f"{path}.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cached, f)
+    os.replace(tmp, path)
+    return cached["sdl"]
+
+
+@lru_cache(maxsize=None)
+def get_client(url=GRAPHQL_ENDPOINT):
+    """A shared, connected client session for an out-of-process caller.
+
+    The session keeps one pooled HTTP connection for the life of the process
+    and validates documents against a local copy of the schema, loaded once
+    per process by ``load_schema``: no call pays for an introspection query,
+    and the copy is revalidated against the server's schema version.
+    """
+    client = Client(transport=RequestsHTTPTransport(url=url, retries=3), schema=load_schema(url))
+    return client.connect_sync()
+
+
+def execute_batch(operations, url=GRAPHQL_ENDPOINT):
+    """Send ``[(source, variables), ...]`` to ``url`` as one batched request.
+
+    The server runs them in order with shared loaders, so back-to-back calls
+    cost one round trip. Returns the ``data`` of each operation.
+    """
+    batch = [GraphQLRequest(source, variable_values=variables) for source, variables in operations]
+    return get_client(url).execute_batch(batch)
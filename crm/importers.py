@@ -0,0 +1,161 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+
+from .bulk import create_customers_partial, get_batch_size, validate_customers
+from .inventory import OutOfStock, reserve_stock
+from .models import Customer, Order, OrderItem, Product, line_total
+from .response_cache import invalidate
+from .rollups import record_orders
+from .validators import clean_order, clean_product
+
+FORMATS = ("csv", "ndjson")
+
+
+def read_rows(stream, fmt):
+    """Yield one dict per record of a CSV or NDJSON byte stream.
+
+    ``stream`` is anything that yields lines of bytes (an open file, an
+    ``HttpRequest``), so nothing but the current line is held in memory. A line
+    that cannot be parsed is yielded as a ``ValueError`` so it is reported as a
+    failed row instead of aborting the import.
+    """
+    lines = (line.decode("utf-8-sig") if isinstance(line, bytes) else line for line in stream)
+    if fmt == "csv":
+        yield from csv.DictReader(lines)
+    elif fmt == "ndjson":
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield ValueError(f"Invalid JSON: {e}")
+                continue
+            yield row if isinstance(row, dict) else ValueError("Expected a JSON object")
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def import_customers(rows):
+    """Validate and insert one batch of customer rows. Returns ``(created, errors)``."""
+    valid, errors = validate_customers(rows)
+    created, insert_errors = create_customers_partial(valid)
+    return len(created), errors + insert_errors
+
+
+def import_products(rows):
+    products = []
+    errors = []
+    for index, data in enumerate(rows):
+        try:
+            products.append(Product(**clean_product(data)))
+        except ValueError as e:
+            errors.append((index, str(e)))
+    Product.objects.bulk_create(products)
+    invalidate(Product)
+    return len(products), errors
+
+
+def import_orders(rows):
+    """Validate and insert one batch of order rows. Returns ``(created, errors)``.
+
+    Same rules as CreateOrder: the customer and products must exist and the
+    stock of each order is reserved, an order that is short is a failed row.
+    """
+    cleaned = []
+    errors = []
+    for index, data in enumerate(rows):
+        try:
+            cleaned.append((index, clean_order(data)))
+        except ValueError as e:
+            errors.append((index, str(e)))
+    customer_ids = {row["customer_id"] for _, row in cleaned}
+    product_ids = {pid for _, row in cleaned for pid in row["quantities"]}
+
+    with transaction.atomic():
+        # Load the referenced customers and products once per batch, the
+        # customers locked so they can't be deleted before the orders commit
+        customers = set(
+            Customer.objects.select_for_update().filter(pk__in=customer_ids).order_by("pk").values_list("pk", flat=True)
+        )
+        prices = dict(Product.objects.filter(pk__in=product_ids).values_list("pk", "price"))
+
+        orders = []
+        order_quantities = []
+        for index, row in cleaned:
+            if row["customer_id"] not in customers:
+                errors.append((index, "Sorry Invalid customer Id"))
+                continue
+            if any(pid not in prices for pid in row["quantities"]):
+                errors.append((index, "No valid products found for the given IDs"))
+                continue
+            try:
+                reserve_stock(row["quantities"])
+            except OutOfStock as e:
+                errors.append((index, str(e)))
+                continue
+            orders.append(Order(customer_id=row["customer_id"], order_date=row["order_date"]))
+            order_quantities.append(row["quantities"])
+
+        Order.objects.bulk_create(orders)
+        OrderItem.objects.bulk_create(
+            OrderItem(order_id=order.pk, product_id=pid, quantity=qty, unit_price=prices[pid])
+            for order, quantities in zip(orders, order_quantities)
+            for pid, qty in quantities.items()
+        )
+        # Totals for the whole batch in one UPDATE summing the lines in SQL
+        totals = (
+            OrderItem.objects.filter(order=OuterRef("pk"))
+            .values("order")
+            .annotate(total=Sum(line_total()))
+            .values("total")
+        )
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(total_amount=Subquery(totals))
+        record_orders(orders)
+        invalidate(Order, OrderItem)
+    return len(orders), errors
+
+
+IMPORTERS = {
+    "customers": import_customers,
+    "products": import_products,
+    "orders": import_orders,
+}
+
+
+def stream_import(kind, rows, batch_size=None):
+    """Import ``rows`` in bounded batches, yielding a progress report per batch.
+
+    Every report carries the running totals, the throughput in rows per second
+    and the errors of that batch only (row numbers are 1-based across the whole
+    stream), so memory stays flat whatever the input size.
+    """
+    importer = IMPORTERS[kind]
+    batch_size = get_batch_size(batch_size)
+    rows = iter(rows)
+    started = time.monotonic()
+    processed = created = failed = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        parsed = [index for index, row in enumerate(batch) if not isinstance(row, ValueError)]
+        batch_created, errors = importer([batch[index] for index in parsed])
+        errors = [(parsed[index], message) for index, message in errors]
+        errors += [(index, str(row)) for index, row in enumerate(batch) if isinstance(row, ValueError)]
+        elapsed = time.monotonic() - started
+        report = {
+            "rows": processed + len(batch),
+            "created": created + batch_created,
+            "failed": failed + len(errors),
+            "elapsed": round(elapsed, 3),
+            "rows_per_second": round((processed + len(batch)) / elapsed, 1) if elapsed else None,
+            "errors": [f"Row {processed + index + 1}: {message}" for index, message in sorted(errors)],
+        }
+        processed, created, failed = report["rows"], report["created"], report["failed"]
+        yield report
@@ -0,0 +1,107 @@
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from .models import Product
+from .pubsub import STOCK_CHANGED, publish
+from .response_cache import invalidate
+
+
+def supports_update_returning():
+    """PostgreSQL and SQLite >= 3.35 accept ``UPDATE ... RETURNING``."""
+    return connection.vendor == "postgresql" or (
+        connection.vendor == "sqlite" and connection.features.can_return_columns_from_insert
+    )
+
+
+def restock_low_stock(threshold=10, increment=10, keep=100, chunk_size=500):
+    """Add ``increment`` to the stock of every product below ``threshold``.
+
+    The restock is one set-based ``UPDATE ... SET stock = stock + n``, so it never
+    overwrites a concurrent stock change with a stale value. The updated rows are
+    read from the cursor ``chunk_size`` at a time and only the first ``keep``
+    ``(id, new_stock)`` pairs are kept. Returns ``(updated_count, rows)``.
+    Every chunk is also published as a ``stock_changed`` event.
+    """
+    count = 0
+    kept = []
+
+    def collect(rows):
+        nonlocal count
+        count += len(rows)
+        if len(kept) < keep:
+            kept.extend(rows[:keep - len(kept)])
+        publish(STOCK_CHANGED, [{"id": pk, "change": increment} for pk, _ in rows])
+
+    with transaction.atomic():
+        if supports_update_returning():
+            quote = connection.ops.quote_name
+            table, pk, stock = quote(Product._meta.db_table), quote("id"), quote("stock")
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {table} SET {stock} = {stock} + %s WHERE {stock} < %s RETURNING {pk}, {stock}",
+                    [increment, threshold],
+                )
+                while rows := cursor.fetchmany(chunk_size):
+                    collect(rows)
+        else:
+            # No RETURNING: lock the rows, update them in one statement, then
+            # read the new levels of the kept rows back by primary key
+            ids = list(
+                Product.objects.select_for_update().filter(stock__lt=threshold).values_list("pk", flat=True)
+            )
+            Product.objects.filter(pk__in=ids).update(stock=F("stock") + increment)
+            count = len(ids)
+            for start in range(0, count, chunk_size):
+                publish(STOCK_CHANGED, [{"id": pk, "change": increment} for pk in ids[start:start + chunk_size]])
+            kept = list(Product.objects.filter(pk__in=ids[:keep]).order_by("pk").values_list("pk", "stock"))
+        if count:
+            invalidate(Product)
+    return count, kept
+
+
+class OutOfStock(Exception):
+    """Raised when an order asks for more units than a product has left."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        details = ", ".join(
+            f"product {pk} (requested {requested}, available {available})"
+            for pk, requested, available in shortages
+        )
+        super().__init__(f"Out of stock: {details}")
+
+
+def reserve_stock(quantities):
+    """Take ``{product_id: quantity}`` out of stock, all or nothing.
+
+    A single conditional ``UPDATE ... SET stock = stock - qty WHERE stock >= qty``
+    row-locks only the products being ordered, so concurrent checkouts can't
+    oversell and don't serialize on the whole table. Products with no tracked
+    stock (NULL) are left untouched. Raises ``OutOfStock`` if any product is
+    short, without decrementing anything.
+    """
+    if not quantities:
+        return
+    quantity = Case(
+        *[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()],
+        output_field=IntegerField(),
+    )
+    try:
+        with transaction.atomic():
+            updated = (
+                Product.objects.filter(pk__in=quantities)
+                .filter(Q(stock__isnull=True) | Q(stock__gte=quantity))
+                .update(stock=F("stock") - quantity)
+            )
+            if updated != len(quantities):
+                raise OutOfStock([])
+            invalidate(Product)
+            publish(STOCK_CHANGED, [{"id": pk, "change": -qty} for pk, qty in quantities.items()])
+    except OutOfStock:
+        # The savepoint is rolled back, so these are the levels that were short
+        stock = Product.objects.filter(pk__in=quantities).values_list("pk", "stock")
+        raise OutOfStock(sorted(
+            (pk, quantities[pk], available)
+            for pk, available in stock
+            if available is not None and available < quantities[pk]
+        ))
@@ -0,0 +1,144 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .bulk import create_customers, import_customers_partial, validate_customers
+from .inventory import restock_low_stock
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Job kinds, one per mutation that can run with ``async: true``
+BULK_CREATE_CUSTOMERS = "bulk_create_customers"
+UPDATE_LOW_STOCK_PRODUCTS = "update_low_stock_products"
+
+
+def enqueue(kind, arguments, total=None):
+    """Store a pending job and hand its id to a Celery worker.
+
+    The task is sent once the current transaction commits, so the worker
+    always finds the row. Returns the ``Job``.
+    """
+    from .tasks import run_job
+
+    job = Job.objects.create(kind=kind, arguments=arguments, total=total)
+    transaction.on_commit(lambda: run_job.delay(str(job.pk)))
+    return job
+
+
+def row_errors(errors):
+    return [{"index": index, "message": message} for index, message in errors]
+
+
+def bulk_create_customers(job):
+    arguments = job.arguments
+    rows, batch_size = arguments["input"], arguments.get("batch_size")
+
+    def progress(processed):
+        Job.objects.filter(pk=job.pk).update(processed=processed)
+
+    if arguments.get("partial") or arguments.get("import_token"):
+        created, errors, customer_import = import_customers_partial(
+            rows, batch_size, arguments.get("import_token"), progress
+        )
+        token = str(customer_import.token) if customer_import and customer_import.failed_rows else None
+        return {"created_count": len(created), "import_token": token}, row_errors(errors)
+
+    # All or nothing, as the synchronous mutation
+    valid, errors = validate_customers(rows)
+    if errors:
+        return {"created_count": 0}, row_errors(errors)
+    try:
+        with transaction.atomic():
+            created = create_customers([customer for _, customer in valid], batch_size)
+    except IntegrityError as e:
+        return {"created_count": 0}, [{"index": None, "message": f"Some records failed, rolling back: {e}"}]
+    return {"created_count": len(created)}, []
+
+
+def update_low_stock_products(job):
+    arguments = job.arguments
+    # The restock is a single transaction, its progress only shows once done
+    updated_count, rows = restock_low_stock(arguments["threshold"], arguments["increment"], keep=arguments["first"])
+    return {
+        "updated_count": updated_count,
+        "updated_products": [{"id": pk, "stock": stock} for pk, stock in rows],
+        "has_more": updated_count > len(rows),
+    }, []
+
+
+RUNNERS = {
+    BULK_CREATE_CUSTOMERS: bulk_create_customers,
+    UPDATE_LOW_STOCK_PRODUCTS: update_low_stock_products,
+}
+
+
+def get_job_timeout():
+    """Seconds a job may run; the task is killed after that (see crm.tasks)."""
+    return getattr(settings, "CRM_JOB_TIMEOUT", 60 * 60)
+
+
+def run(job_id):
+    """Run a pending job and store its outcome on it.
+
+    Returns the job, or None when it was already picked up (a redelivered
+    task). An exception fails the job and is recorded in its errors.
+    """
+    claimed = Job.objects.filter(pk=job_id, status=Job.Status.PENDING).update(
+        status=Job.Status.RUNNING, started_at=timezone.now(), attempts=F("attempts") + 1
+    )
+    if not claimed:
+        return None
+    job = Job.objects.get(pk=job_id)
+    try:
+        result, errors = RUNNERS[job.kind](job)
+    except Exception as e:
+        logger.exception("Job %s (%s) failed", job.pk, job.kind)
+        job.status = Job.Status.FAILED
+        job.errors = [{"index": None, "message": str(e)}]
+    else:
+        job.status = Job.Status.SUCCEEDED
+        job.result = result
+        job.errors = errors
+        # A restock only learns how many rows it had once they are updated
+        if job.total is None:
+            job.total = result.get("updated_count", 0)
+        job.processed = job.total
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "result", "errors", "total", "processed", "finished_at"])
+    return job
+
+
+def sweep_stale_jobs():
+    """Recover the jobs no worker is going to finish.
+
+    A job still running after ``get_job_timeout()`` lost its worker, since the
+    task is killed at that limit: it is queued again from the start, or failed
+    after CRM_JOB_MAX_ATTEMPTS runs. Rows a partial import committed before
+    are then reported as taken. A new job pending that long never reached a
+    worker and is sent again. Returns ``(requeued, failed)``.
+    """
+    from .tasks import run_job
+
+    stale = timezone.now() - timedelta(seconds=get_job_timeout())
+    max_attempts = getattr(settings, "CRM_JOB_MAX_ATTEMPTS", 3)
+    requeued = failed = 0
+    for job in Job.objects.filter(
+        Q(status=Job.Status.RUNNING, started_at__lt=stale)
+        | Q(status=Job.Status.PENDING, attempts=0, created_at__lt=stale)
+    ):
+        # Only touch the job if no worker claimed it meanwhile
+        jobs = Job.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts)
+        if job.attempts >= max_attempts:
+            failed += jobs.update(status=Job.Status.FAILED, finished_at=timezone.now(), errors=[{
+                "index": None,
+                "message": f"The job did not finish within {get_job_timeout()} seconds in {job.attempts} attempts.",
+            }])
+        elif jobs.update(status=Job.Status.PENDING, processed=0):
+            requeued += 1
+            run_job.delay(str(job.pk))
+    return requeued, failed
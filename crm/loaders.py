@@ -0,0 +1,191 @@
+import asyncio
+from collections import defaultdict
+
+from .models import Customer, Order, OrderItem, Product
+
+
+class BatchLoader:
+    """Per-request loader that resolves every queued key with a single query.
+
+    Parent resolvers queue the keys of all the objects they return, so the first
+    ``load()`` made by any child field fetches the whole batch at once instead of
+    running one query per parent row.
+
+    ``query(keys)`` returns the QuerySet of the batch and ``key_of(row)`` /
+    ``value_of(row)`` map its rows to results; ``loaded(values)`` is called with
+    the objects of each batch so they can queue their own children. In async mode
+    ``load()`` returns a coroutine, the batch is read with the async ORM and keys
+    asked for by sibling fields in the same event loop tick share one query.
+    """
+
+    def __init__(self, query, key_of, value_of=None, loaded=None, many=False, is_async=False):
+        self.query = query
+        self.key_of = key_of
+        self.value_of = value_of or (lambda row: row)
+        self.loaded = loaded
+        self.many = many
+        self.is_async = is_async
+        self._pending = set()
+        self._cache = {}
+        self._batch = None
+
+    def queue(self, keys):
+        for key in keys:
+            if key not in self._cache:
+                self._pending.add(key)
+
+    def load(self, key):
+        if self.is_async:
+            return self.aload(key)
+        if key not in self._cache:
+            self._pending.add(key)
+            self.flush()
+        return self._cache[key]
+
+    async def aload(self, key):
+        while key not in self._cache:
+            self._pending.add(key)
+            if self._batch is None:
+                self._batch = asyncio.ensure_future(self.aflush())
+            await self._batch
+        return self._cache[key]
+
+    def flush(self):
+        if not self._pending:
+            return
+        keys = list(self._pending)
+        self._pending.clear()
+        self.store(keys, self.query(keys))
+
+    async def aflush(self):
+        # Let the other fields resolving in this tick add their keys first
+        await asyncio.sleep(0)
+        keys = list(self._pending)
+        self._pending.clear()
+        self._batch = None
+        if keys:
+            self.store(keys, [row async for row in self.query(keys)])
+
+    def store(self, keys, rows):
+        results = defaultdict(list) if self.many else {}
+        for row in rows:
+            if self.many:
+                results[self.key_of(row)].append(self.value_of(row))
+            else:
+                results[self.key_of(row)] = self.value_of(row)
+        for key in keys:
+            self._cache[key] = results.get(key, [] if self.many else None)
+        if self.loaded is not None:
+            values = (value for key in keys for value in (self._cache[key] if self.many else [self._cache[key]]))
+            self.loaded(list({value.pk: value for value in values if value is not None}.values()))
+
+    def clear(self):
+        self._pending.clear()
+        self._cache.clear()
+
+
+class CRMLoaders:
+    """The loaders shared by every resolver of one GraphQL request.
+
+    Related lists come in primary key order of the related rows, the order
+    crm.optimizer prefetches them in, so both paths return the same lists. With
+    ``is_async`` (the ASGI view) every ``load()`` returns a coroutine.
+    """
+
+    def __init__(self, is_async=False):
+        self.is_async = is_async
+        self.customer_by_id = BatchLoader(
+            lambda keys: Customer.objects.filter(pk__in=keys),
+            key_of=lambda customer: customer.pk,
+            loaded=self.queue_customers,
+            is_async=is_async,
+        )
+        self.product_by_id = BatchLoader(
+            lambda keys: Product.objects.filter(pk__in=keys),
+            key_of=lambda product: product.pk,
+            loaded=self.queue_products,
+            is_async=is_async,
+        )
+        self.products_by_order = BatchLoader(
+            lambda keys: OrderItem.objects.filter(order_id__in=keys).select_related("product").order_by("product_id"),
+            key_of=lambda link: link.order_id,
+            value_of=lambda link: link.product,
+            loaded=self.queue_products,
+            many=True,
+            is_async=is_async,
+        )
+        self.items_by_order = BatchLoader(
+            lambda keys: OrderItem.objects.filter(order_id__in=keys).order_by("pk"),
+            key_of=lambda item: item.order_id,
+            loaded=self.queue_items,
+            many=True,
+            is_async=is_async,
+        )
+        self.orders_by_customer = BatchLoader(
+            lambda keys: Order.objects.filter(customer_id__in=keys).order_by("pk"),
+            key_of=lambda order: order.customer_id,
+            loaded=self.queue_orders,
+            many=True,
+            is_async=is_async,
+        )
+        self.orders_by_product = BatchLoader(
+            lambda keys: OrderItem.objects.filter(product_id__in=keys).select_related("order").order_by("order_id"),
+            key_of=lambda link: link.product_id,
+            value_of=lambda link: link.order,
+            loaded=self.queue_orders,
+            many=True,
+            is_async=is_async,
+        )
+
+    # Queue the keys the children of these objects will ask for
+    def queue_customers(self, customers):
+        self.orders_by_customer.queue(customer.pk for customer in customers)
+
+    def queue_products(self, products):
+        self.orders_by_product.queue(product.pk for product in products)
+
+    def queue_orders(self, orders):
+        orders = list(orders)
+        # Skip rows where only() deferred the FK, reading it would cost a query per row
+        self.customer_by_id.queue(order.customer_id for order in orders if "customer_id" in order.__dict__)
+        self.products_by_order.queue(order.pk for order in orders)
+        self.items_by_order.queue(order.pk for order in orders)
+
+    def queue_items(self, items):
+        self.product_by_id.queue(item.product_id for item in items)
+
+    def queue(self, instances):
+        """Queue children keys for a homogeneous list of model instances."""
+        instances = list(instances)
+        if not instances:
+            return
+        queue_for = {
+            Customer: self.queue_customers,
+            Product: self.queue_products,
+            Order: self.queue_orders,
+            OrderItem: self.queue_items,
+        }.get(type(instances[0]))
+        if queue_for is not None:
+            queue_for(instances)
+
+    def clear(self):
+        for loader in (
+            self.customer_by_id,
+            self.product_by_id,
+            self.products_by_order,
+            self.items_by_order,
+            self.orders_by_customer,
+            self.orders_by_product,
+        ):
+            loader.clear()
+
+
+def get_loaders(info):
+    """Return the loaders attached to the request, creating them on first use."""
+    context = info.context
+    loaders = getattr(context, "loaders", None)
+    if loaders is None:
+        loaders = CRMLoaders()
+        if context is not None:
+            context.loaders = loaders
+    return loaders
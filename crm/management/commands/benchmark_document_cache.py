@@ -0,0 +1,64 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from graphene_django.settings import graphene_settings
+from graphql import parse, validate
+
+from crm.documents import documents, parse_and_validate
+from crm.views import CRMGraphQLView
+
+ORDERS_QUERY = """
+query RecentOrders {
+  orders(first: 20) {
+    edges {
+      node {
+        id
+        customer {
+          email
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class Command(BaseCommand):
+    help = "Compare uncached and cached parse/validate latency for the orders { customer { email } } query."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=500)
+
+    def timed(self, iterations, fn):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        return (time.perf_counter() - started) / iterations * 1000
+
+    def handle(self, iterations, **options):
+        schema = graphene_settings.SCHEMA.graphql_schema
+        view = CRMGraphQLView.as_view()
+        factory = RequestFactory()
+
+        def request():
+            response = view(factory.post("/graphql", json.dumps({"query": ORDERS_QUERY}), content_type="application/json"))
+            assert response.status_code == 200, response.content
+
+        def cold_request():
+            documents.clear()
+            request()
+
+        rows = [
+            ("parse + validate", self.timed(iterations, lambda: validate(schema, parse(ORDERS_QUERY)))),
+            ("cached lookup", self.timed(iterations, lambda: parse_and_validate(schema, ORDERS_QUERY))),
+            ("request, cold cache", self.timed(iterations, cold_request)),
+            ("request, warm cache", self.timed(iterations, request)),
+        ]
+        for label, ms in rows:
+            self.stdout.write(f"{label:<22}{ms:8.3f} ms")
+        saved = rows[2][1] - rows[3][1]
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {saved:.3f} ms per request ({saved / rows[2][1]:.0%}), cache {documents.cache_info()}"
+        ))
@@ -0,0 +1,45 @@
+import sys
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from crm.exporters import FORMATS, export_orders, stream_export
+
+
+class Command(BaseCommand):
+    help = "Stream orders with their customer and lines to an NDJSON or CSV file, optionally gzipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="-", help="File to write, '-' (default) writes standard output")
+        parser.add_argument("--format", choices=FORMATS, default="ndjson")
+        parser.add_argument("--start-date", type=date.fromisoformat, help="First order day, YYYY-MM-DD")
+        parser.add_argument("--end-date", type=date.fromisoformat, help="Last order day, YYYY-MM-DD")
+        parser.add_argument("--gzip", action="store_true", help="Compress the output")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Orders read per query")
+
+    def handle(self, path, format, start_date=None, end_date=None, gzip=False, chunk_size=2000, **options):
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        started = time.perf_counter()
+        rows = counted(export_orders(start_date, end_date, chunk_size))
+        output = sys.stdout.buffer if path == "-" else open(path, "wb")
+        try:
+            for chunk in stream_export(rows, format, compress=gzip):
+                output.write(chunk)
+        finally:
+            if output is sys.stdout.buffer:
+                output.flush()
+            else:
+                output.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(self.style.SUCCESS(
+            f"Exported {count} orders in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} orders/s)"
+        ))
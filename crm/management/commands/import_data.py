@@ -0,0 +1,43 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.importers import FORMATS, IMPORTERS, read_rows, stream_import
+
+
+class Command(BaseCommand):
+    help = "Stream customers, products or orders from a CSV or NDJSON file into the CRM."
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=sorted(IMPORTERS))
+        parser.add_argument("path", help="File to import, '-' reads standard input")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, help="Rows per batch (CRM_BULK_CREATE_BATCH_SIZE)")
+
+    def handle(self, kind, path, format=None, batch_size=None, **options):
+        fmt = format or path.rsplit(".", 1)[-1].lower()
+        if fmt not in FORMATS:
+            raise CommandError(f"Cannot guess the format of {path}, use --format {'|'.join(FORMATS)}")
+
+        stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+        report = None
+        try:
+            for report in stream_import(kind, read_rows(stream, fmt), batch_size):
+                for error in report["errors"]:
+                    self.stderr.write(error)
+                self.stdout.write(
+                    f"{report['rows']} rows, {report['created']} created, {report['failed']} failed "
+                    f"({report['rows_per_second']} rows/s)"
+                )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+        if report is None:
+            self.stdout.write("Nothing to import")
+        else:
+            report.pop("errors")
+            self.stdout.write(self.style.SUCCESS(json.dumps(report)))
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+
+# In-process requests need a host ALLOWED_HOSTS accepts, localhost is the one
+# Django allows by default with DEBUG on
+IN_PROCESS_URL = "http://localhost"
+
+# Sibling root fields, each with nested relations, so the async view has
+# something to overlap
+DASHBOARD_QUERY = """
+query Dashboard {
+  crmStats {
+    customerCount
+    orderCount
+    revenue
+  }
+  orders(first: 20) {
+    totalCount
+    edges {
+      node {
+        id
+        totalAmount
+        customer {
+          name
+        }
+        items {
+          quantity
+          product {
+            name
+          }
+        }
+      }
+    }
+  }
+  products(first: 20) {
+    edges {
+      node {
+        name
+        stock
+      }
+    }
+  }
+}
+"""
+
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def is_ok(response):
+    return response.status_code == 200 and not response.json().get("errors")
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test /graphql (WSGI, sync ORM) against /graphql/async (ASGI, async ORM) "
+        "and report requests/s and latency percentiles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=20)
+        parser.add_argument("--query", help="Query to send, defaults to a dashboard with sibling root fields")
+        parser.add_argument(
+            "--wsgi-url",
+            help="Sync endpoint of a running server (e.g. gunicorn), tested in-process when omitted",
+        )
+        parser.add_argument(
+            "--asgi-url",
+            help="Async endpoint of a running server (e.g. uvicorn), tested in-process when omitted",
+        )
+
+    def run_sync(self, client, url, body, requests, concurrency):
+        def request(_):
+            started = time.perf_counter()
+            response = client.post(url, json=body)
+            return time.perf_counter() - started, is_ok(response)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(request, range(requests)))
+        return time.perf_counter() - started, results
+
+    async def run_async(self, client, url, body, requests, concurrency):
+        queue = asyncio.Queue()
+        for _ in range(requests):
+            queue.put_nowait(None)
+        results = []
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                started = time.perf_counter()
+                response = await client.post(url, json=body)
+                results.append((time.perf_counter() - started, is_ok(response)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started, results
+
+    def test_wsgi(self, url, body, requests, concurrency, warmup):
+        if url:
+            client = httpx.Client(timeout=60)
+        else:
+            client = httpx.Client(transport=httpx.WSGITransport(app=get_wsgi_application()), base_url=IN_PROCESS_URL)
+            url = "/graphql"
+        with client:
+            self.run_sync(client, url, body, warmup, concurrency)
+            return self.run_sync(client, url, body, requests, concurrency)
+
+    async def test_asgi(self, url, body, requests, concurrency, warmup):
+        if url:
+            client = httpx.AsyncClient(timeout=60)
+        else:
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=get_asgi_application()), base_url=IN_PROCESS_URL)
+            url = "/graphql/async"
+        async with client:
+            await self.run_async(client, url, body, warmup, concurrency)
+            return await self.run_async(client, url, body, requests, concurrency)
+
+    def report(self, label, elapsed, results):
+        # Timings of failed requests say nothing about the endpoint
+        failed = sum(1 for _, ok in results if not ok)
+        if failed:
+            raise CommandError(f"{label}: {failed} of {len(results)} requests failed or returned errors")
+        latencies = [latency for latency, _ in results]
+        self.stdout.write(
+            f"{label:<6}{len(results) / elapsed:10.1f} req/s"
+            f"{percentile(latencies, 0.5) * 1000:10.2f} ms p50"
+            f"{percentile(latencies, 0.99) * 1000:10.2f} ms p99"
+        )
+        return len(results) / elapsed, percentile(latencies, 0.99)
+
+    def handle(self, requests, concurrency, warmup, query, wsgi_url, asgi_url, **options):
+        body = {"query": query or DASHBOARD_QUERY}
+        self.stdout.write(f"{requests} requests, {concurrency} concurrent")
+        wsgi_rate, wsgi_p99 = self.report("WSGI", *self.test_wsgi(wsgi_url, body, requests, concurrency, warmup))
+        asgi_rate, asgi_p99 = self.report(
+            "ASGI", *asyncio.run(self.test_asgi(asgi_url, body, requests, concurrency, warmup))
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"ASGI/WSGI: {asgi_rate / wsgi_rate:.2f}x requests/s, {asgi_p99 / wsgi_p99:.2f}x p99"
+        ))
@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from crm.models import Customer, CustomerActivity, Order, OrderItem
+from crm.response_cache import invalidate
+from crm.rollups import refresh_days
+
+
+class Command(BaseCommand):
+    help = "Delete customers who have not placed an order in the last --days days, in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=365, help="Inactivity period (default 365)")
+        parser.add_argument("--batch-size", type=int, default=500, help="Customers deleted per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the customers that would go")
+
+    def handle(self, days, batch_size, dry_run, **options):
+        cutoff = timezone.now() - timedelta(days=days)
+        # The CustomerActivity rollup holds each customer's last order date, a
+        # customer without a row never ordered
+        inactive = Customer.objects.filter(
+            Q(activity__isnull=True) | Q(activity__last_order_date__lt=cutoff)
+        ).order_by("pk")
+
+        if dry_run:
+            self.stdout.write(f"{inactive.count()} customers have not ordered since {cutoff:%Y-%m-%d}")
+            return
+
+        deleted = last_pk = 0
+        started = time.monotonic()
+        while True:
+            # One short transaction per batch so the write lock is never held long;
+            # each batch starts after the last one, customers are read only once
+            with transaction.atomic():
+                ids = list(inactive.filter(pk__gt=last_pk).values_list("pk", flat=True)[:batch_size])
+                if not ids:
+                    break
+                last_pk = ids[-1]
+                # Their (old) orders go with them, refresh those days' rollups
+                days_touched = set(
+                    Order.objects.filter(customer_id__in=ids)
+                    .annotate(day=TruncDate("order_date"))
+                    .values_list("day", flat=True)
+                    .distinct()
+                )
+                Customer.objects.filter(pk__in=ids).delete()
+                invalidate(Customer, CustomerActivity, Order, OrderItem)
+                refresh_days(days_touched)
+            deleted += len(ids)
+            elapsed = time.monotonic() - started
+            rate = deleted / elapsed if elapsed else deleted
+            self.stdout.write(f"Deleted {deleted} customers ({rate:.1f} rows/s)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{timezone.now():%Y-%m-%d %H:%M:%S} - Deleted {deleted} customers inactive since {cutoff:%Y-%m-%d}"
+        ))
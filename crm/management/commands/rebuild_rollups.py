@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from crm.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily order rollups and per-customer activity from every order."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rollup rows written per INSERT")
+
+    def handle(self, batch_size, **options):
+        days, customers = rebuild(batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {days} daily rollups and {customers} customer activity rows"))
@@ -0,0 +1,24 @@
+import asyncio
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from crm.reminders import send_reminders
+
+
+class Command(BaseCommand):
+    help = "Send a reminder for every recent order that has not had one yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Only orders placed in the last N days")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Orders read per page")
+        parser.add_argument("--concurrency", type=int, help="Sends in flight (CRM_REMINDER_CONCURRENCY)")
+
+    def handle(self, days, batch_size, concurrency, **options):
+        sent, failed, elapsed = asyncio.run(
+            send_reminders(window=timedelta(days=days), batch_size=batch_size, concurrency=concurrency)
+        )
+        rate = sent / elapsed if elapsed else sent
+        self.stdout.write(self.style.SUCCESS(
+            f"Order reminders processed! {sent} sent, {failed} failed ({rate:.0f} reminders/s)"
+        ))
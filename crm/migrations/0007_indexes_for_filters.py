@@ -0,0 +1,55 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+# SQLite's LIKE is case-insensitive, so phone__startswith can only use an index
+# built with the NOCASE collation. PostgreSQL gets its varchar_pattern_ops
+# "_like" index from db_index=True already.
+def create_phone_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "crm_customer_phone_prefix_idx" '
+            'ON "crm_customer" ("phone" COLLATE NOCASE)'
+        )
+
+
+def drop_phone_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute('DROP INDEX IF EXISTS "crm_customer_phone_prefix_idx"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_order_total_amount'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='phone',
+            field=models.CharField(blank=True, db_index=True, max_length=15, null=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0.0, max_digits=1000),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(db_index=True, decimal_places=2, max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='stock',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(create_phone_prefix_index, drop_phone_prefix_index),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Exists, ExpressionWrapper, F, OuterRef, Subquery, Sum
+
+
+# Move the rows of the auto-created order/product table into OrderItem. The
+# old table has no quantity or price, so every line becomes quantity 1 at the
+# product's current price, and the total of each order with lines is summed
+# from them.
+def copy_order_products(apps, schema_editor):
+    Order = apps.get_model("crm", "Order")
+    OrderItem = apps.get_model("crm", "OrderItem")
+    OrderProducts = Order.products.through
+
+    links = OrderProducts.objects.values_list("order_id", "product_id", "product__price").order_by("pk")
+    batch = []
+    for order_id, product_id, price in links.iterator(chunk_size=2000):
+        batch.append(OrderItem(order_id=order_id, product_id=product_id, quantity=1, unit_price=price))
+        if len(batch) >= 2000:
+            OrderItem.objects.bulk_create(batch)
+            batch = []
+    OrderItem.objects.bulk_create(batch)
+
+    line_total = ExpressionWrapper(
+        F("quantity") * F("unit_price"), output_field=models.DecimalField(max_digits=1000, decimal_places=2)
+    )
+    totals = OrderItem.objects.filter(order=OuterRef("pk")).values("order").annotate(total=Sum(line_total)).values("total")
+    Order.objects.filter(Exists(OrderItem.objects.filter(order=OuterRef("pk")))).update(total_amount=Subquery(totals))
+
+
+def copy_order_items_back(apps, schema_editor):
+    Order = apps.get_model("crm", "Order")
+    OrderItem = apps.get_model("crm", "OrderItem")
+    OrderProducts = Order.products.through
+
+    links = OrderItem.objects.values_list("order_id", "product_id").order_by("pk")
+    batch = []
+    for order_id, product_id in links.iterator(chunk_size=2000):
+        batch.append(OrderProducts(order_id=order_id, product_id=product_id))
+        if len(batch) >= 2000:
+            OrderProducts.objects.bulk_create(batch)
+            batch = []
+    OrderProducts.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_order_date_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='crm.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='crm.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='crm_orderitem_order_product_uniq'),
+        ),
+        migrations.RunPython(copy_order_products, copy_order_items_back),
+        # A plain M2M can't be altered to use a through model, so drop the old
+        # table and add the field back on top of OrderItem
+        migrations.RemoveField(
+            model_name='order',
+            name='products',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='products',
+            field=models.ManyToManyField(related_name='orders', through='crm.OrderItem', to='crm.product'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import TruncDate
+
+
+# Fill the rollups from the orders already there, later writes keep them current
+def backfill_rollups(apps, schema_editor):
+    Customer = apps.get_model("crm", "Customer")
+    Order = apps.get_model("crm", "Order")
+    DailyOrderStats = apps.get_model("crm", "DailyOrderStats")
+    CustomerActivity = apps.get_model("crm", "CustomerActivity")
+
+    days = (
+        Order.objects.annotate(day=TruncDate("order_date"))
+        .values("day")
+        .annotate(order_count=Count("pk"), customer_count=Count("customer", distinct=True), revenue=Sum("total_amount"))
+        .order_by()
+    )
+    DailyOrderStats.objects.bulk_create(
+        (DailyOrderStats(**{**row, "revenue": row["revenue"] or 0}) for row in days.iterator()),
+        batch_size=1000,
+    )
+    activity = (
+        Customer.objects.annotate(order_count=Count("orders"), last_order_date=Max("orders__order_date"))
+        .filter(order_count__gt=0)
+        .values_list("pk", "order_count", "last_order_date")
+    )
+    CustomerActivity.objects.bulk_create(
+        (CustomerActivity(customer_id=pk, order_count=count, last_order_date=last)
+         for pk, count, last in activity.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0010_orderitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerActivity',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='activity', serialize=False, to='crm.customer')),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('last_order_date', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyOrderStats',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('customer_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=1000)),
+            ],
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,22 @@
+import uuid
+
 from django.db import models
+from django.db.models import ExpressionWrapper, F
+from django.utils import timezone
 
 # Create your models here.
 class Customer(models.Model):
     name = models.CharField(max_length=100, null=False, blank=False)
     email = models.EmailField(max_length=255, unique=True, null=False, blank=False)
-    phone = models.CharField(max_length=15, null=True, blank=True)
+    phone = models.CharField(max_length=15, null=True, blank=True, db_index=True)
 
     def __str__(self):
         return f"{self.name}"
     
 class Product(models.Model):
     name = models.CharField(max_length=100, null=False, blank=False)
-    stock = models.IntegerField(blank=True, null=True)
-    price = models.DecimalField(max_digits=10, decimal_places=2)
+    stock = models.IntegerField(blank=True, null=True, db_index=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2, db_index=True)
 
     def __str__(self):
         return f"{self.name} - ${self.price}"
@@ -20,9 +24,127 @@ class Product(models.Model):
 
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="orders")
-    products = models.ManyToManyField(Product, related_name="orders")
-    order_date = models.DateTimeField(auto_now_add=True)
-    total_amount = models.DecimalField(max_digits=1000, decimal_places=2, default=0.00)
+    products = models.ManyToManyField(Product, through="OrderItem", related_name="orders")
+    order_date = models.DateTimeField(default=timezone.now, db_index=True)
+    total_amount = models.DecimalField(max_digits=1000, decimal_places=2, default=0.00, db_index=True)
+
+    class Meta:
+        indexes = [
+            # "has this customer ordered since X" is one index seek
+            models.Index(fields=["customer", "order_date"], name="crm_order_customer_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"Order #{self.id} for {self.customer.name}"
+
+
+class OrderItem(models.Model):
+    """One product line of an order, with the price it was sold at."""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="order_items")
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["order", "product"], name="crm_orderitem_order_product_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} @ {self.unit_price}"
+
+
+def line_total(prefix=""):
+    """``quantity * unit_price`` of an order item, ``prefix`` reaches it through a
+    relation (e.g. ``"items__"`` from Order). Use it inside ``Sum()``."""
+    return ExpressionWrapper(
+        F(f"{prefix}quantity") * F(f"{prefix}unit_price"),
+        output_field=models.DecimalField(max_digits=1000, decimal_places=2),
+    )
+
+class CustomerImport(models.Model):
+    """Bookkeeping for a partial bulk customer import that can be resumed.
+
+    ``failed_rows`` holds the indexes (in the original batch) of the rows that
+    still have to be re-sent with this import's token.
+    """
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    total_rows = models.PositiveIntegerField(default=0)
+    created_count = models.PositiveIntegerField(default=0)
+    failed_rows = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"Import {self.token} ({self.created_count}/{self.total_rows})"
+
+
+# Rollups kept current by crm.rollups as orders are written, so reports and the
+# inactive-customer cleanup read one row per day / per customer instead of
+# scanning every order. ``manage.py rebuild_rollups`` recomputes them.
+
+class DailyOrderStats(models.Model):
+    day = models.DateField(primary_key=True)
+    order_count = models.PositiveIntegerField(default=0)
+    customer_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=1000, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day}: {self.order_count} orders, ${self.revenue}"
+
+
+class CustomerActivity(models.Model):
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name="activity")
+    order_count = models.PositiveIntegerField(default=0)
+    last_order_date = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.customer_id} last ordered {self.last_order_date}"
+
+
+class ReminderCheckpoint(models.Model):
+    """High-water mark of a reminder run: orders up to ``last_order_id`` were handled.
+
+    Sends that still failed after their retries are kept in ``failed_order_ids``
+    and tried again at the start of the next run.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_order_id = models.BigIntegerField(default=0)
+    failed_order_ids = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at order {self.last_order_id}"
+
+
+class Job(models.Model):
+    """A mutation run in the background by a Celery worker (``async: true``).
+
+    ``arguments`` holds the mutation input, so only the job id travels through
+    the broker. ``processed`` counts the rows handled so far out of ``total``;
+    ``result`` holds the counts of a finished job and ``errors`` its row errors
+    (``{"index", "message"}``) or the exception that failed it. ``attempts``
+    counts the runs started, a job whose worker was lost is run again (see
+    crm.jobs.sweep_stale_jobs).
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        SUCCEEDED = "succeeded"
+        FAILED = "failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    arguments = models.JSONField(default=dict)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    result = models.JSONField(default=dict)
+    errors = models.JSONField(default=list)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"Order #{self.id} for {self.customer.name}"
\ No newline at end of file
+        return f"{self.kind} {self.id} ({self.status})"
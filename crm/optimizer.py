@@ -0,0 +1,99 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+def optimize(queryset, info, path=(), required=()):
+    """Shape ``queryset`` after the selection set of the field being resolved.
+
+    Forward foreign keys become ``select_related``, reverse and many-to-many
+    relations become ``prefetch_related`` with their own optimized querysets, and
+    every level is pruned with ``only()`` to the columns the client asked for.
+    ``path`` walks down wrapper fields (e.g. ``("edges", "node")``) before the
+    model's own fields start, and ``required`` names columns that must be loaded
+    whether selected or not (e.g. the keys a paginator orders by).
+    """
+    selections = get_selections(info.field_nodes, info)
+    for name in path:
+        selections = get_selections(selections.get(name, []), info)
+    return _optimize(queryset, selections, info, required)
+
+
+def get_selections(field_nodes, info):
+    """Merge the sub-selections of ``field_nodes`` into ``{snake_name: [FieldNode]}``.
+
+    Inline fragments and named fragment spreads are flattened.
+    """
+    selections = {}
+
+    def collect(selection_set):
+        if selection_set is None:
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                name = to_snake_case(selection.name.value)
+                selections.setdefault(name, []).append(selection)
+            elif isinstance(selection, InlineFragmentNode):
+                collect(selection.selection_set)
+            elif isinstance(selection, FragmentSpreadNode):
+                collect(info.fragments[selection.name.value].selection_set)
+
+    for node in field_nodes:
+        collect(node.selection_set)
+    return selections
+
+
+def is_prefetched(instance, name):
+    """True when ``name`` was loaded by ``prefetch_related`` on ``instance``."""
+    return name in getattr(instance, "_prefetched_objects_cache", {})
+
+
+def _optimize(queryset, selections, info, required=()):
+    only = set(required)
+    select_related = []
+    prefetches = []
+    _plan(queryset.model, selections, info, "", only, select_related, prefetches)
+
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset.only(*only)
+
+
+def _plan(model, selections, info, prefix, only, select_related, prefetches):
+    only.add(prefix + model._meta.pk.name)
+    for name, nodes in selections.items():
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Not a model field (custom resolver or __typename), nothing to load
+            continue
+
+        if not field.is_relation:
+            only.add(prefix + field.name)
+        elif field.concrete and (field.many_to_one or field.one_to_one):
+            # Forward FK: join it and keep pruning columns on the related table
+            select_related.append(prefix + field.name)
+            _plan(
+                field.related_model,
+                get_selections(nodes, info),
+                info,
+                f"{prefix}{field.name}__",
+                only,
+                select_related,
+                prefetches,
+            )
+        else:
+            # Reverse FK and M2M get their own optimized query; the back
+            # reference column must stay loaded so Django can match the rows.
+            # Rows come in primary key order, as crm.loaders returns them.
+            required = (field.field.name,) if field.one_to_many else ()
+            child = _optimize(
+                field.related_model._default_manager.order_by("pk"),
+                get_selections(nodes, info),
+                info,
+                required,
+            )
+            prefetches.append(Prefetch(prefix + field.name, queryset=child))
@@ -0,0 +1,199 @@
+import base64
+import json
+from functools import partial
+
+import graphene
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from graphene import relay
+from graphene.relay.connection import PageInfo
+from graphene.types.argument import to_arguments
+from graphene_django.filter.fields import convert_enum
+from graphene_django.filter.utils import get_filtering_args_from_filterset
+from graphql import GraphQLError
+
+from .loaders import get_loaders
+from .optimizer import optimize
+
+
+class CountableConnection(relay.Connection):
+    """Relay connection with a ``totalCount`` that is only counted when selected."""
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(root, info):
+        if get_loaders(info).is_async:
+            return root.iterable.acount()
+        return root.iterable.count()
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, fields):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(fields):
+            raise ValueError
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except Exception:
+        raise GraphQLError(f"Invalid cursor: {cursor}")
+
+
+class KeysetConnectionField(relay.ConnectionField):
+    """Connection field paginated with keyset (seek) predicates instead of OFFSET.
+
+    ``ordering`` lists the model fields making up the key, prefixed with ``-`` for
+    descending order; the last one must be unique (usually ``id``). A cursor
+    holds the key of its row, so page N costs the same indexed range scan as the
+    first page. With ``filterset_class`` the filters of the django-filter
+    FilterSet are exposed as field arguments and applied before paginating.
+    """
+
+    def __init__(self, type_, *args, ordering=("id",), max_limit=100, filterset_class=None, **kwargs):
+        self.ordering = tuple(ordering)
+        self.max_limit = max_limit
+        self.filterset_class = filterset_class
+        self._filtering_args = None
+        self._base_args = None
+        super().__init__(type_, *args, **kwargs)
+
+    @property
+    def args(self):
+        return to_arguments(self._base_args or {}, self.filtering_args)
+
+    @args.setter
+    def args(self, args):
+        self._base_args = args
+
+    @property
+    def filtering_args(self):
+        if self.filterset_class is None:
+            return {}
+        if self._filtering_args is None:
+            connection_type = self.type
+            if isinstance(connection_type, graphene.NonNull):
+                connection_type = connection_type.of_type
+            self._filtering_args = get_filtering_args_from_filterset(
+                self.filterset_class, connection_type._meta.node
+            )
+        return self._filtering_args
+
+    def wrap_resolve(self, parent_resolver):
+        resolver = super(relay.ConnectionField, self).wrap_resolve(parent_resolver)
+        return partial(self.keyset_resolver, resolver)
+
+    def keyset_resolver(self, resolver, root, info, **args):
+        connection_type = self.type
+        if isinstance(connection_type, graphene.NonNull):
+            connection_type = connection_type.of_type
+
+        queryset = resolver(root, info, **args)
+        if get_loaders(info).is_async:
+            return self.apaginate(connection_type, queryset, info, args)
+        if self.filterset_class is not None:
+            queryset = self.filter(queryset, info, args)
+        return self.paginate(connection_type, queryset, info, args)
+
+    async def apaginate(self, connection_type, queryset, info, args):
+        if self.filterset_class is not None:
+            # Validating model choice filters may query, which only sync code can do
+            queryset = await sync_to_async(self.filter)(queryset, info, args)
+        queryset, page, limit, backwards = self.get_page(queryset, info, args)
+        rows = [row async for row in page[: limit + 1]]
+        return self.connection(connection_type, queryset, rows, limit, backwards, info, args)
+
+    def filter(self, queryset, info, args):
+        data = {name: convert_enum(value) for name, value in args.items() if name in self.filtering_args}
+        filterset = self.filterset_class(data=data, queryset=queryset, request=info.context)
+        if not filterset.is_valid():
+            raise GraphQLError(filterset.form.errors.as_json())
+        return filterset.qs
+
+    def paginate(self, connection_type, queryset, info, args):
+        queryset, page, limit, backwards = self.get_page(queryset, info, args)
+        rows = list(page[: limit + 1])
+        return self.connection(connection_type, queryset, rows, limit, backwards, info, args)
+
+    def get_page(self, queryset, info, args):
+        """``(queryset, page, limit, backwards)``: the optimized queryset and the
+        ordered, seeked one to read ``limit + 1`` rows of."""
+        first, last = args.get("first"), args.get("last")
+        after, before = args.get("after"), args.get("before")
+        for name, value in (("first", first), ("last", last)):
+            if value is not None and value < 0:
+                raise GraphQLError(f"Argument `{name}` must be a non-negative integer.")
+            if value is not None and value > self.max_limit:
+                raise GraphQLError(
+                    f"Requesting {value} records exceeds the `{name}` limit of {self.max_limit} records."
+                )
+
+        keys = self.get_keys()
+        fields = self.get_key_fields(queryset.model)
+
+        queryset = optimize(queryset, info, path=("edges", "node"), required=[name for name, _ in keys])
+        page = queryset
+        if after:
+            page = page.filter(self.seek(keys, decode_cursor(after, fields), forward=True))
+        if before:
+            page = page.filter(self.seek(keys, decode_cursor(before, fields), forward=False))
+
+        backwards = last is not None and first is None
+        if backwards:
+            limit = last
+            page = page.order_by(*[("" if desc else "-") + name for name, desc in keys])
+        else:
+            limit = first if first is not None else self.max_limit
+            page = page.order_by(*self.ordering)
+        return queryset, page, limit, backwards
+
+    def connection(self, connection_type, queryset, rows, limit, backwards, info, args):
+        after, before = args.get("after"), args.get("before")
+        fields = self.get_key_fields(queryset.model)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        get_loaders(info).queue(rows)
+
+        edges = [
+            connection_type.Edge(node=row, cursor=encode_cursor(self.key_of(row, fields)))
+            for row in rows
+        ]
+        connection = connection_type(
+            edges=edges,
+            page_info=PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_more if backwards else bool(after),
+                has_next_page=bool(before) if backwards else has_more,
+            ),
+        )
+        # Unsliced queryset for totalCount, counted only if the client asks for it
+        connection.iterable = queryset.order_by()
+        return connection
+
+    def get_keys(self):
+        return [(name.lstrip("-"), name.startswith("-")) for name in self.ordering]
+
+    def get_key_fields(self, model):
+        return [model._meta.get_field(name) for name, _ in self.get_keys()]
+
+    @staticmethod
+    def seek(keys, values, forward):
+        """Build ``(k1, k2, ...) > (v1, v2, ...)`` honouring each key's direction."""
+        condition = Q()
+        equal = Q()
+        for (name, desc), value in zip(keys, values):
+            lookup = "lt" if desc == forward else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    @staticmethod
+    def key_of(row, fields):
+        return [field.value_to_string(row) for field in fields]
@@ -0,0 +1,60 @@
+import hashlib
+import json
+
+from django.conf import settings
+from graphql import GraphQLError
+
+from .documents import DocumentCache
+
+# Automatic persisted queries, the protocol Apollo clients speak: a request
+# carries {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": ...}}}
+# and only sends the query text when the server answers PersistedQueryNotFound.
+
+PERSISTED_QUERY_NOT_FOUND = "PersistedQueryNotFound"
+PERSISTED_QUERY_NOT_SUPPORTED = "PersistedQueryNotSupported"
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+persisted_queries = DocumentCache(getattr(settings, "CRM_PERSISTED_QUERY_CACHE_SIZE", 1000))
+
+
+def get_persisted_query(request, data):
+    """The ``sha256Hash`` a request refers to, or None for a plain request."""
+    extensions = request.GET.get("extensions") or data.get("extensions")
+    if not extensions:
+        return None
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise GraphQLError("Extensions are invalid JSON.")
+    persisted = extensions.get("persistedQuery") if isinstance(extensions, dict) else None
+    if not persisted:
+        return None
+    if persisted.get("version") != 1 or not persisted.get("sha256Hash"):
+        raise GraphQLError(PERSISTED_QUERY_NOT_SUPPORTED, extensions={"code": "PERSISTED_QUERY_NOT_SUPPORTED"})
+    return persisted["sha256Hash"]
+
+
+def load_persisted_document(sha256_hash, query, parse_and_validate):
+    """Return the cached document for ``sha256_hash``, registering ``query`` on a miss.
+
+    ``parse_and_validate(query)`` returns ``(document, errors)``; only documents
+    that validated are kept, so a bad query can't push good ones out. Returns
+    ``(document, errors)``.
+    """
+    if query and query_hash(query) != sha256_hash:
+        raise GraphQLError("provided sha does not match query", extensions={"code": "BAD_REQUEST"})
+    document = persisted_queries.get(sha256_hash)
+    if document is not None:
+        return document, []
+    if not query:
+        # The client retries with the full text, which registers it
+        raise GraphQLError(PERSISTED_QUERY_NOT_FOUND, extensions={"code": "PERSISTED_QUERY_NOT_FOUND"})
+    document, errors = parse_and_validate(query)
+    if not errors:
+        persisted_queries.set(sha256_hash, document)
+    return document, errors
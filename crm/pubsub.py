@@ -0,0 +1,124 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Events behind the GraphQL subscriptions. Payloads are JSON-serializable so
+# they can travel through Redis.
+ORDER_CREATED = "order_created"  # {"id": order id}
+STOCK_CHANGED = "stock_changed"  # [{"id": product id, "change": +/- units}, ...]
+
+
+class InProcessBroker:
+    """Pub/sub between the threads of one process.
+
+    Every subscriber gets its own bounded queue on its event loop; publishing
+    is thread-safe, so a mutation running in a worker thread reaches the
+    WebSocket subscribers of the same process. A subscriber that falls more
+    than CRM_PUBSUB_QUEUE_SIZE events behind loses the newest ones.
+    """
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channel, payload):
+        with self.lock:
+            subscribers = list(self.subscribers[channel])
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self.deliver, channel, queue, payload)
+            except RuntimeError:
+                # The subscriber's loop is closed, it unsubscribes as it shuts down
+                pass
+
+    @staticmethod
+    def deliver(channel, queue, payload):
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            logger.warning("Dropped a %s event for a subscriber that is falling behind", channel)
+
+    async def subscribe(self, channel):
+        """Async iterator of the payloads published on ``channel`` from now on."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(getattr(settings, "CRM_PUBSUB_QUEUE_SIZE", 1000)))
+        with self.lock:
+            self.subscribers[channel].add(subscriber)
+        try:
+            while True:
+                yield await subscriber[1].get()
+        finally:
+            with self.lock:
+                self.subscribers[channel].discard(subscriber)
+
+
+class RedisBroker(InProcessBroker):
+    """Fans events out through Redis pub/sub, so subscribers connected to any
+    ASGI worker hear about writes made by any process (WSGI workers, Celery).
+
+    Each process keeps a single Redis subscription per event loop and hands its
+    messages to the local subscribers.
+    """
+
+    prefix = "crm:events:"
+
+    def __init__(self, url=None):
+        super().__init__()
+        import redis
+
+        self.url = url or getattr(settings, "CRM_PUBSUB_REDIS_URL", None) or "redis://localhost:6379/0"
+        self.client = redis.Redis.from_url(self.url)
+        self.listeners = {}
+
+    def publish(self, channel, payload):
+        try:
+            self.client.publish(self.prefix + channel, json.dumps(payload))
+        except Exception:
+            # The write is committed already, a lost event mustn't fail it
+            logger.exception("Could not publish a %s event to Redis", channel)
+
+    async def subscribe(self, channel):
+        loop = asyncio.get_running_loop()
+        listener = self.listeners.get(loop)
+        if listener is None or listener.done():
+            self.listeners[loop] = asyncio.ensure_future(self.listen())
+        async for payload in super().subscribe(channel):
+            yield payload
+
+    async def listen(self):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.psubscribe(self.prefix + "*")
+        try:
+            async for message in pubsub.listen():
+                if message["type"] == "pmessage":
+                    channel = message["channel"].decode()[len(self.prefix):]
+                    super().publish(channel, json.loads(message["data"]))
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(getattr(settings, "CRM_PUBSUB_BACKEND", "crm.pubsub.InProcessBroker"))()
+
+
+def publish(channel, payload):
+    """Publish ``payload`` once the current transaction commits (right away
+    outside one), so subscribers never hear about writes that rolled back."""
+    transaction.on_commit(lambda: get_broker().publish(channel, payload))
+
+
+def subscribe(channel):
+    return get_broker().subscribe(channel)
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Order, ReminderCheckpoint
+
+REMINDER_FIELDS = ("id", "order_date", "customer__name", "customer__email")
+
+
+class LogMailer:
+    """Local stand-in for a mail backend: appends one line per reminder to a file.
+
+    Any object with an ``async send(reminder)`` method (and optionally
+    ``close()``) can be plugged in through the CRM_REMINDER_MAILER setting.
+    """
+
+    def __init__(self, path="/tmp/order_reminders_log.txt"):
+        self.file = open(path, "a")
+
+    async def send(self, reminder):
+        self.file.write(
+            f"{timezone.now().isoformat()} - Order ID: {reminder['id']}, "
+            f"Customer Email: {reminder['customer__email']}\n"
+        )
+
+    def close(self):
+        self.file.close()
+
+
+def get_mailer():
+    return import_string(getattr(settings, "CRM_REMINDER_MAILER", "crm.reminders.LogMailer"))()
+
+
+def get_concurrency(concurrency=None):
+    return concurrency or getattr(settings, "CRM_REMINDER_CONCURRENCY", 50)
+
+
+async def deliver(mailer, reminder, attempts=3, backoff=0.5):
+    for attempt in range(attempts):
+        try:
+            return await mailer.send(reminder)
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+
+async def send_reminders(mailer=None, window=timedelta(days=7), batch_size=1000, concurrency=None,
+                         name="order_reminders"):
+    """Send one reminder per order placed in ``window`` that has not had one yet.
+
+    Orders are read by keyset (``id > mark``) ``batch_size`` at a time and fanned
+    out to ``concurrency`` workers. The high-water mark is saved once a page is
+    fully handled, so an interrupted run resumes after the last finished page
+    and nothing before it is sent twice. Returns ``(sent, failed, seconds)``.
+    """
+    mailer = mailer or get_mailer()
+    checkpoint, _ = await ReminderCheckpoint.objects.aget_or_create(name=name)
+    since = timezone.now() - window
+    queue = asyncio.Queue(maxsize=batch_size)
+    sent = 0
+    failed = []
+
+    async def worker():
+        nonlocal sent
+        while True:
+            reminder = await queue.get()
+            try:
+                await deliver(mailer, reminder)
+                sent += 1
+            except Exception:
+                failed.append(reminder["id"])
+            finally:
+                queue.task_done()
+
+    async def handle(page):
+        for reminder in page:
+            await queue.put(reminder)
+        await queue.join()
+
+    started = time.monotonic()
+    workers = [asyncio.create_task(worker()) for _ in range(get_concurrency(concurrency))]
+    try:
+        # Sends that failed last time go first
+        if checkpoint.failed_order_ids:
+            retry = Order.objects.filter(pk__in=checkpoint.failed_order_ids).values(*REMINDER_FIELDS)
+            await handle([reminder async for reminder in retry])
+            checkpoint.failed_order_ids = failed[:]
+            await checkpoint.asave(update_fields=["failed_order_ids", "updated_at"])
+
+        pending = Order.objects.filter(order_date__gte=since).order_by("pk").values(*REMINDER_FIELDS)
+        while True:
+            page = [reminder async for reminder in pending.filter(pk__gt=checkpoint.last_order_id)[:batch_size]]
+            if not page:
+                break
+            await handle(page)
+            checkpoint.last_order_id = page[-1]["id"]
+            checkpoint.failed_order_ids = failed[:]
+            await checkpoint.asave(update_fields=["last_order_id", "failed_order_ids", "updated_at"])
+    finally:
+        for task in workers:
+            task.cancel()
+        if hasattr(mailer, "close"):
+            mailer.close()
+    return sent, len(failed), time.monotonic() - started
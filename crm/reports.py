@@ -0,0 +1,109 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Exists, F, OuterRef, Q, Sum
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from .models import Customer, DailyOrderStats, Order
+
+CENTS = Decimal("0.01")
+
+
+def date_range(start_date=None, end_date=None):
+    """Aware ``[start, end)`` datetimes covering the inclusive dates given."""
+    start = end = None
+    if start_date:
+        start = timezone.make_aware(datetime.combine(start_date, time.min))
+    if end_date:
+        end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    return start, end
+
+
+def order_range_filter(start_date=None, end_date=None, prefix=""):
+    start, end = date_range(start_date, end_date)
+    condition = Q()
+    if start:
+        condition &= Q(**{f"{prefix}order_date__gte": start})
+    if end:
+        condition &= Q(**{f"{prefix}order_date__lt": end})
+    return condition
+
+
+def daily_rollups(start_date=None, end_date=None):
+    days = DailyOrderStats.objects.all()
+    if start_date:
+        days = days.filter(day__gte=start_date)
+    if end_date:
+        days = days.filter(day__lte=end_date)
+    return days
+
+
+def range_customers(start_date=None, end_date=None):
+    """Every customer, or with a range the customers who ordered in it.
+
+    Distinct customers can't be summed from the daily rollups, so a range is
+    one EXISTS seek per customer on the (customer, order_date) index.
+    """
+    if not (start_date or end_date):
+        return Customer.objects.all()
+    orders = Order.objects.filter(order_range_filter(start_date, end_date), customer=OuterRef("pk"))
+    return Customer.objects.filter(Exists(orders))
+
+
+def crm_stats(start_date=None, end_date=None):
+    """Customer count, order count and revenue for the inclusive date range.
+
+    Order numbers are summed from the daily rollups, one row per day instead of
+    one per order.
+    """
+    stats = daily_rollups(start_date, end_date).aggregate(
+        order_count=Sum("order_count"),
+        revenue=Sum("revenue"),
+    )
+    return stats_result(stats, range_customers(start_date, end_date).count())
+
+
+async def acrm_stats(start_date=None, end_date=None):
+    """``crm_stats()`` with the async ORM."""
+    stats = await daily_rollups(start_date, end_date).aaggregate(
+        order_count=Sum("order_count"),
+        revenue=Sum("revenue"),
+    )
+    return stats_result(stats, await range_customers(start_date, end_date).acount())
+
+
+def stats_result(stats, customer_count):
+    stats["customer_count"] = customer_count
+    stats["order_count"] = stats["order_count"] or 0
+    stats["revenue"] = (stats["revenue"] or Decimal(0)).quantize(CENTS)
+    return stats
+
+
+def bucket_rows(start_date=None, end_date=None, group_by="day"):
+    """Order count and revenue per day or week, read from the daily rollups.
+
+    Day buckets also carry the number of distinct customers who ordered; that
+    can't be summed over a week, so week buckets leave it out.
+    """
+    days = daily_rollups(start_date, end_date).order_by("day")
+    if group_by == "day":
+        return days.values("order_count", "revenue", "customer_count", period=F("day"))
+    return (
+        days.annotate(period=TruncWeek("day"))
+        .values("period")
+        .annotate(order_count=Sum("order_count"), revenue=Sum("revenue"))
+        .order_by("period")
+    )
+
+
+def bucket_result(bucket):
+    return {**bucket, "revenue": (bucket["revenue"] or Decimal(0)).quantize(CENTS)}
+
+
+def order_buckets(start_date=None, end_date=None, group_by="day"):
+    return [bucket_result(bucket) for bucket in bucket_rows(start_date, end_date, group_by)]
+
+
+async def aorder_buckets(start_date=None, end_date=None, group_by="day"):
+    return [bucket_result(bucket) async for bucket in bucket_rows(start_date, end_date, group_by)]
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import threading
+import uuid
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from graphene.utils.str_converters import to_snake_case
+from graphql import TypeInfo, TypeInfoVisitor, Visitor, get_named_type, print_ast, visit
+
+# Opt-in cache of query results on Django's cache framework.
+#
+# Every entry's key includes a generation token for each model the query reads
+# (found by walking the document against the schema). A write to a model only
+# replaces that model's token, which makes exactly the entries depending on it
+# unreachable; they then age out of the cache on their own.
+
+KEY_PREFIX = "crm:response:"
+
+# {(type name, field name): (max_age, models)}, see cache_hint()
+HINTS = {}
+
+
+def is_enabled():
+    return getattr(settings, "CRM_RESPONSE_CACHE_ENABLED", False)
+
+
+def get_cache():
+    return caches[getattr(settings, "CRM_RESPONSE_CACHE_ALIAS", "default")]
+
+
+def get_timeout():
+    return getattr(settings, "CRM_RESPONSE_CACHE_TIMEOUT", 60)
+
+
+def cache_hint(type_name, field_name, max_age=None, models=()):
+    """Declare how long results selecting ``type_name.field_name`` may be cached
+    (``max_age`` seconds, 0 for never) and which models they read when that
+    can't be told from the field's type."""
+    HINTS[(type_name, field_name)] = (max_age, tuple(models))
+
+
+def model_of(graphql_type):
+    """The Django model behind a DjangoObjectType or a connection of them."""
+    meta = getattr(getattr(get_named_type(graphql_type), "graphene_type", None), "_meta", None)
+    node = getattr(meta, "node", None)
+    if node is not None:
+        meta = node._meta
+    return getattr(meta, "model", None)
+
+
+def related_models(model, field_name):
+    # A relation field also reads its through table, e.g. Order.products
+    try:
+        field = model._meta.get_field(to_snake_case(field_name))
+    except FieldDoesNotExist:
+        return set()
+    models = {field.related_model} if field.is_relation and field.related_model else set()
+    through = getattr(getattr(field, "remote_field", None), "through", None)
+    if field.many_to_many and through is not None:
+        models.add(through)
+    return models
+
+
+def analyze(schema, document):
+    """``(models, max_age)`` of everything ``document`` selects.
+
+    ``max_age`` is the smallest hint among the selected fields, or the
+    CRM_RESPONSE_CACHE_TIMEOUT setting when none of them has one.
+    """
+    type_info = TypeInfo(schema)
+    models = set()
+    ages = []
+
+    class FieldVisitor(Visitor):
+        def enter_field(self, node, *args):
+            parent, field = type_info.get_parent_type(), type_info.get_field_def()
+            if parent is None or field is None:
+                return
+            for model in (model_of(field.type), model_of(parent)):
+                if model is not None:
+                    models.add(model)
+            if model_of(parent) is not None:
+                models.update(related_models(model_of(parent), node.name.value))
+            max_age, hinted = HINTS.get((parent.name, node.name.value), (None, ()))
+            models.update(hinted)
+            if max_age is not None:
+                ages.append(max_age)
+
+    visit(document, TypeInfoVisitor(type_info, FieldVisitor()))
+    return {model._meta.label_lower for model in models}, min(ages) if ages else get_timeout()
+
+
+plans = WeakKeyDictionary()
+plans_lock = threading.Lock()
+
+
+def get_plan(schema, document):
+    """``(digest, model labels, max_age)`` of a document, worked out once per document."""
+    with plans_lock:
+        plan = plans.get(document)
+    if plan is None:
+        labels, max_age = analyze(schema, document)
+        digest = hashlib.sha256(print_ast(document).encode("utf-8")).hexdigest()
+        plan = (digest, labels, max_age)
+        with plans_lock:
+            plans[document] = plan
+    return plan
+
+
+def generation_key(label):
+    return f"{KEY_PREFIX}gen:{label}"
+
+
+def generations(labels):
+    cache = get_cache()
+    keys = [generation_key(label) for label in sorted(labels)]
+    tokens = cache.get_many(keys)
+    for key in keys:
+        if key not in tokens:
+            # A fresh random token, so a lost generation can't revive old entries
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            tokens[key] = cache.get(key)
+    return [tokens[key] for key in keys]
+
+
+def response_key(schema, document, operation_name, variables):
+    """The cache key and timeout of a query, or ``(None, 0)`` when it must not be cached."""
+    digest, labels, max_age = get_plan(schema, document)
+    if not max_age:
+        return None, 0
+    parts = [digest, operation_name or "", json.dumps(variables or {}, sort_keys=True, default=str)]
+    parts += generations(labels)
+    return KEY_PREFIX + hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest(), max_age
+
+
+def get_response(key):
+    return get_cache().get(key)
+
+
+def set_response(key, data, timeout):
+    get_cache().set(key, data, timeout)
+
+
+pending = threading.local()
+
+
+def invalidate(*models):
+    """Drop the cached responses reading any of ``models`` once the current
+    transaction commits (right away outside one). Only ``save()`` sends a
+    signal for it, other writes (``bulk_create``, ``update()``, deletes, raw
+    SQL, any OrderItem write) call this themselves."""
+    if not is_enabled():
+        return
+    labels = getattr(pending, "labels", None)
+    if labels is None:
+        labels = pending.labels = set()
+    labels.update(model._meta.label_lower for model in models)
+    transaction.on_commit(flush)
+
+
+def flush():
+    labels, pending.labels = getattr(pending, "labels", None), set()
+    if labels:
+        get_cache().set_many({generation_key(label): uuid.uuid4().hex for label in labels}, timeout=None)
+
+
+def model_changed(sender, **kwargs):
+    invalidate(sender)
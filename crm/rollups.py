@@ -0,0 +1,163 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, Func, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from .models import Customer, CustomerActivity, DailyOrderStats, Order
+from .reports import CENTS, order_range_filter
+from .response_cache import invalidate
+
+
+def daily_stats(orders):
+    """Group ``orders`` by local day, one ``DailyOrderStats`` per day."""
+    rows = (
+        orders.annotate(day=TruncDate("order_date"))
+        .values("day")
+        .annotate(
+            order_count=Count("pk"),
+            customer_count=Count("customer", distinct=True),
+            revenue=Sum("total_amount"),
+        )
+        .order_by()
+    )
+    for row in rows.iterator():
+        row["revenue"] = (row["revenue"] or Decimal(0)).quantize(CENTS)
+        yield DailyOrderStats(**row)
+
+
+def customer_activity(customers):
+    rows = (
+        customers.annotate(order_count=Count("orders"), last_order_date=Max("orders__order_date"))
+        .filter(order_count__gt=0)
+        .values_list("pk", "order_count", "last_order_date")
+    )
+    for pk, order_count, last_order_date in rows.iterator():
+        yield CustomerActivity(customer_id=pk, order_count=order_count, last_order_date=last_order_date)
+
+
+def save_daily_stats(stats):
+    invalidate(DailyOrderStats)
+    DailyOrderStats.objects.bulk_create(
+        stats, update_conflicts=True, unique_fields=["day"],
+        update_fields=["order_count", "customer_count", "revenue"],
+    )
+
+
+def save_customer_activity(activity):
+    CustomerActivity.objects.bulk_create(
+        activity, update_conflicts=True, unique_fields=["customer"],
+        update_fields=["order_count", "last_order_date"],
+    )
+
+
+def lock_days(days):
+    """Create the missing rollup rows of ``days`` and lock them all.
+
+    Writers of the same day queue here, and once a writer holds the lock its
+    next reads see the orders of the writers before it. Days are locked in
+    order so two writers can't deadlock.
+    """
+    days = sorted(days)
+    DailyOrderStats.objects.bulk_create([DailyOrderStats(day=day) for day in days], ignore_conflicts=True)
+    list(DailyOrderStats.objects.select_for_update().filter(day__in=days).order_by("day").values_list("pk"))
+
+
+def in_days_filter(days):
+    in_days = Q()
+    for day in days:
+        in_days |= order_range_filter(day, day)
+    return in_days
+
+
+def add_to_row(rows, row, **deltas):
+    """``rows.update(**deltas)``, saving ``row`` (zeros) first when it is missing."""
+    if not rows.update(**deltas):
+        type(row).objects.bulk_create([row], ignore_conflicts=True)
+        rows.update(**deltas)
+
+
+def count_of(queryset):
+    """``queryset`` as a subquery of its row count."""
+    return Subquery(queryset.order_by().annotate(count=Func("pk", function="COUNT")).values("count"))
+
+
+def add_orders(orders):
+    """Add new ``orders`` to the rollups: one UPDATE per customer and per day.
+
+    Counts and dates come from the orders themselves and the revenue is summed
+    by the UPDATE, so nothing is read first. A customer counts for a day
+    unless another of their orders that day was there before.
+    """
+    by_customer, by_day = defaultdict(list), defaultdict(list)
+    for order in orders:
+        by_customer[order.customer_id].append(order)
+        by_day[timezone.localdate(order.order_date)].append(order)
+
+    # Customers first: the row update makes the writers of one customer take
+    # turns, so the day UPDATE (a later statement) sees their earlier orders
+    for customer_id, customer_orders in sorted(by_customer.items()):
+        last_order_date = max(order.order_date for order in customer_orders)
+        add_to_row(
+            CustomerActivity.objects.filter(customer_id=customer_id),
+            CustomerActivity(customer_id=customer_id, last_order_date=last_order_date),
+            order_count=F("order_count") + len(customer_orders),
+            last_order_date=Greatest("last_order_date", Value(last_order_date)),
+        )
+
+    invalidate(DailyOrderStats)
+    for day, day_orders in sorted(by_day.items()):
+        ids = [order.pk for order in day_orders]
+        earlier = Order.objects.filter(order_range_filter(day, day), customer=OuterRef("pk")).exclude(pk__in=ids)
+        new_customers = Customer.objects.filter(pk__in={order.customer_id for order in day_orders})
+        revenue = Order.objects.filter(pk__in=ids).order_by().annotate(total=Func("total_amount", function="SUM"))
+        add_to_row(
+            DailyOrderStats.objects.filter(day=day),
+            DailyOrderStats(day=day),
+            order_count=F("order_count") + len(day_orders),
+            customer_count=F("customer_count") + count_of(new_customers.filter(~Exists(earlier))),
+            revenue=F("revenue") + Subquery(revenue.values("total")),
+        )
+
+
+def refresh_days(days):
+    """Recompute the rollup of each of ``days`` from the orders of that day only."""
+    days = set(days)
+    if not days:
+        return
+    lock_days(days)
+    in_days = in_days_filter(days)
+    stats = {row.day: row for row in daily_stats(Order.objects.filter(in_days))}
+    # A day whose last order went away is kept with zeros
+    save_daily_stats([stats.get(day) or DailyOrderStats(day=day) for day in sorted(days)])
+
+
+def record_orders(orders):
+    """Bring the rollups up to date after new ``orders`` were written.
+
+    Only deltas are added, so the cost follows the size of the write and not
+    of the table. Call it inside the transaction that wrote the orders, once
+    their totals are saved, so the rollups commit or roll back with them.
+    """
+    add_orders(list(orders))
+
+
+def rebuild(batch_size=1000):
+    """Throw the rollups away and recompute them from every order."""
+    with transaction.atomic():
+        DailyOrderStats.objects.all().delete()
+        CustomerActivity.objects.all().delete()
+        for rows, save in (
+            (daily_stats(Order.objects.all()), save_daily_stats),
+            (customer_activity(Customer.objects.all()), save_customer_activity),
+        ):
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    save(batch)
+                    batch = []
+            save(batch)
+    return DailyOrderStats.objects.count(), CustomerActivity.objects.count()
@@ -1,26 +1,92 @@
 import graphene
 from graphene_django import DjangoObjectType
-from .models import Customer, Product, Order
+from .models import Customer, Product, Order, OrderItem, DailyOrderStats, Job, line_total
 import re
+import uuid
 from django.db import transaction, IntegrityError
+from django.db.models import Sum
 from decimal import Decimal
-from django.utils import timezone
 from crm.models import Product
+from .loaders import get_loaders
+from .optimizer import is_prefetched
+from .pagination import CountableConnection, KeysetConnectionField
+from .filters import CustomerFilter, ProductFilter, OrderFilter
+from .validators import clean_product, clean_order
+from .inventory import restock_low_stock, reserve_stock, OutOfStock
+from .reports import acrm_stats, aorder_buckets, crm_stats, order_buckets
+from .rollups import record_orders
+from .pubsub import ORDER_CREATED, STOCK_CHANGED, publish, subscribe
+from .response_cache import cache_hint, invalidate
+from .bulk import validate_customers, create_customers, import_customers_partial
+from .jobs import BULK_CREATE_CUSTOMERS, UPDATE_LOW_STOCK_PRODUCTS, enqueue
 
 class CustomerType(DjangoObjectType):
     class Meta:
         model = Customer
-        fields = ("id", "name", "email", "phone")
+        fields = ("id", "name", "email", "phone", "orders")
+
+    def resolve_orders(self, info):
+        if is_prefetched(self, "orders"):
+            return self.orders.all()
+        return get_loaders(info).orders_by_customer.load(self.pk)
 
 class ProductType(DjangoObjectType):
     class Meta:
         model = Product
-        fields = ("id", "name", "stock", "price")
+        fields = ("id", "name", "stock", "price", "orders")
+
+    def resolve_orders(self, info):
+        if is_prefetched(self, "orders"):
+            return self.orders.all()
+        return get_loaders(info).orders_by_product.load(self.pk)
+
+class OrderItemType(DjangoObjectType):
+    class Meta:
+        model = OrderItem
+        fields = ("id", "product", "quantity", "unit_price")
+
+    def resolve_product(self, info):
+        if OrderItem.product.is_cached(self):
+            return self.product
+        return get_loaders(info).product_by_id.load(self.product_id)
 
 class OrderType(DjangoObjectType):
     class Meta:
         model = Order
-        fields = ("id", "customer", "products", "order_date", "total_amount")
+        fields = ("id", "customer", "products", "items", "order_date", "total_amount")
+
+    # Related objects come from the optimizer's joins/prefetches when the root
+    # resolver planned them, otherwise from the per-request loaders so a list of
+    # orders costs one query per relation instead of one per order
+    def resolve_customer(self, info):
+        if Order.customer.is_cached(self):
+            return self.customer
+        return get_loaders(info).customer_by_id.load(self.customer_id)
+
+    def resolve_products(self, info):
+        if is_prefetched(self, "products"):
+            return self.products.all()
+        return get_loaders(info).products_by_order.load(self.pk)
+
+    def resolve_items(self, info):
+        if is_prefetched(self, "items"):
+            return self.items.all()
+        return get_loaders(info).items_by_order.load(self.pk)
+
+
+class CustomerConnection(CountableConnection):
+    class Meta:
+        node = CustomerType
+
+
+class ProductConnection(CountableConnection):
+    class Meta:
+        node = ProductType
+
+
+class OrderConnection(CountableConnection):
+    class Meta:
+        node = OrderType
 
 
 # Create an input type for the customer data
@@ -36,9 +102,17 @@ class ProductsInput(graphene.InputObjectType):
     price =  graphene.Float()
 
 
+# Input Type for one line of an order
+class OrderItemInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(default_value=1)
+
+
 # Input Type for Orders data
 class OrderInput(graphene.InputObjectType):
-    product_ids = graphene.List(graphene.ID, required=True)
+    # Either productIds (a repeated id orders one more unit) or items with quantities
+    product_ids = graphene.List(graphene.ID)
+    items = graphene.List(OrderItemInput)
     customer_id = graphene.ID(required=True)
     order_date = graphene.DateTime(required=False)
 
@@ -76,61 +150,139 @@ class CreateCustomer(graphene.Mutation):
 
 
 
+class ImportMode(graphene.Enum):
+    ALL_OR_NOTHING = "all_or_nothing"
+    PARTIAL = "partial"
+
+
+class RowError(graphene.ObjectType):
+    index = graphene.Int(description="0-based position of the row in the original batch")
+    message = graphene.String()
+
+
+class RestockedProduct(graphene.ObjectType):
+    id = graphene.ID()
+    stock = graphene.Int()
+
+
+class JobType(DjangoObjectType):
+    """A mutation run in the background, polled with the ``job`` query."""
+
+    class Meta:
+        model = Job
+        fields = ("id", "kind", "status", "total", "processed", "attempts", "created_at", "started_at", "finished_at")
+
+    progress = graphene.Float(description="Share of the rows processed so far, from 0 to 1")
+    errors = graphene.List(graphene.String)
+    row_errors = graphene.List(RowError)
+    # BulkCreateCustomers
+    created_count = graphene.Int()
+    import_token = graphene.String()
+    # UpdateLowStockProducts
+    updated_count = graphene.Int()
+    updated_products = graphene.List(RestockedProduct)
+    has_more = graphene.Boolean()
+
+    def resolve_progress(self, info):
+        if self.status == Job.Status.SUCCEEDED:
+            return 1.0
+        return self.processed / self.total if self.total else 0.0
+
+    def resolve_errors(self, info):
+        return [
+            f"Row {error['index']+1}: {error['message']}" if error["index"] is not None else error["message"]
+            for error in self.errors
+        ]
+
+    def resolve_row_errors(self, info):
+        return [RowError(**error) for error in self.errors if error["index"] is not None]
+
+    def resolve_created_count(self, info):
+        return self.result.get("created_count")
+
+    def resolve_import_token(self, info):
+        return self.result.get("import_token")
+
+    def resolve_updated_count(self, info):
+        return self.result.get("updated_count")
+
+    def resolve_updated_products(self, info):
+        products = self.result.get("updated_products")
+        return None if products is None else [RestockedProduct(**product) for product in products]
+
+    def resolve_has_more(self, info):
+        return self.result.get("has_more")
+
+
 class BulkCreateCustomers(graphene.Mutation):
     class Arguments:
         # Pass a list of the *input type*
         input = graphene.List(CustomerInput)
+        batch_size = graphene.Int(required=False)
+        mode = ImportMode(default_value=ImportMode.ALL_OR_NOTHING.value)
+        # Token of a previous PARTIAL import, input is then its failed rows in order
+        import_token = graphene.String(required=False)
+        # Queue the import on a Celery worker and return the job right away
+        async_ = graphene.Boolean(name="async", default_value=False)
     
     customers = graphene.List(CustomerType)
     errors = graphene.List(graphene.String)
+    row_errors = graphene.List(RowError)
+    created_count = graphene.Int()
+    import_token = graphene.String()
+    job = graphene.Field(JobType)
 
     @classmethod
-    def mutate(cls, root, info, input):
-        customers = []
-        errors = []
-        # Phone pattern and email pattern
-        email_pattern = "[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.(com|in|edu|net)"
-        phone_pattern = re.compile(r"(\+\d{1,3})?\s?\(?\d{1,4}\)?[\s.-]?\d{3}[\s.-]?\d{4}")
+    def mutate(cls, root, info, input, batch_size=None, mode=ImportMode.ALL_OR_NOTHING.value, import_token=None, async_=False):
+        if async_:
+            rows = [dict(row) for row in input or []]
+            job = enqueue(BULK_CREATE_CUSTOMERS, {
+                "input": rows,
+                "batch_size": batch_size,
+                "partial": mode == ImportMode.PARTIAL.value,
+                "import_token": import_token,
+            }, total=len(rows))
+            return BulkCreateCustomers(job=job)
+
+        if import_token or mode == ImportMode.PARTIAL.value:
+            return cls.mutate_partial(input or [], batch_size, import_token)
+
+        # Validate the whole batch in memory (one email__in lookup for the
+        # duplicates) before touching the table
+        valid, row_errors = validate_customers(input or [])
+        errors = [f"Row {index+1}: {message}" for index, message in row_errors]
+
+        row_errors = [RowError(index=index, message=message) for index, message in row_errors]
+
+        # All or nothing: any invalid row means no customer is saved
+        if errors:
+            return BulkCreateCustomers(customers=[], errors=errors, row_errors=row_errors, created_count=0)
 
         try:
-            with transaction.atomic():  
-                for index, data in enumerate(input):
-                    # Basic validation
-                    if not data.name or not data.email:
-                        errors.append(f"Row {index+1}: Name and Email are required.")
-                        continue
-                    if re.search(email_pattern, data.email) is None:
-                        errors.append(f"Row {index+1}: Invalid email: {data.email}")
-                        continue
-
-                    if data.phone and re.search(phone_pattern, data.phone) is None:
-                        errors.append(f"Row {index+1}: Invalid Phone: {data.phone}")
-                        continue
-                    # Check for duplicate emails
-                    if Customer.objects.filter(email=data.email).exists():
-                        errors.append(f"Row {index+1}: Email '{data.email}' already exists.")
-                        continue
-                    
-                    # Create the customer if all the validation passes and the phone number is provided
-                    # Fix the conditional logic for checking phone number to ensure its created without phone no provided
-                    customer = Customer(
-                        name=data.name,
-                        email=data.email,
-                        phone=data.phone
-                    )
-                    customer.save()
-                    customers.append(customer)
-
-                # If errors happened, rollback (no customers saved)
-                if errors:
-                    raise IntegrityError("Some records failed, rolling back.")
-
-        except IntegrityError:
-            customers = []  # rollback, nothing saved
+            with transaction.atomic():
+                customers = create_customers([customer for _, customer in valid], batch_size)
+        except IntegrityError as e:
+            # A concurrent insert took one of the emails after validation
+            return BulkCreateCustomers(customers=[], errors=[f"Some records failed, rolling back: {e}"], created_count=0)
 
         return BulkCreateCustomers(
             customers=customers,
-            errors=errors
+            errors=errors,
+            row_errors=row_errors,
+            created_count=len(customers),
+        )
+
+    @classmethod
+    def mutate_partial(cls, input, batch_size, import_token):
+        # Valid rows are committed chunk by chunk, the failed ones are kept on
+        # the import so the client only re-sends those with the token
+        customers, row_errors, customer_import = import_customers_partial(input, batch_size, import_token)
+        return BulkCreateCustomers(
+            customers=customers,
+            errors=[f"Row {index+1}: {message}" for index, message in row_errors],
+            row_errors=[RowError(index=index, message=message) for index, message in row_errors],
+            created_count=len(customers),
+            import_token=str(customer_import.token) if customer_import and customer_import.failed_rows else None,
         )
 
 
@@ -143,22 +295,9 @@ class CreateProduct(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, input):
-        price = input.price
-        stock = input.stock
-        name = input.name 
-       
-        # Create the product 
-        if stock < 0:
-            raise Exception("Stock cannot be negative")
-        
-        if price < 0:
-            raise Exception("Price cannot be negative")
-        
-        # Convert price from default float type to python native decimal before saving
-        price = Decimal(str(price))
-        
-        create_product = Product.objects.create(name=name, stock=stock, price=price)
-        create_product.save()
+        # Same rules as the bulk importers: name required, stock and price not
+        # negative, price converted from float to a Decimal through str()
+        create_product = Product.objects.create(**clean_product(input))
        
         return CreateProduct(product=create_product)
 
@@ -170,67 +309,164 @@ class CreateOrder(graphene.Mutation):
    
     @classmethod
     def mutate(cls, root, info, input):
-        total_amount = 0
-
-        # Get the products to see if they exist
-        products = Product.objects.filter(pk__in=input.product_ids)
-
-        # Get the customer to see if it exists
-        if not Customer.objects.filter(pk=input.customer_id).exists():
-            raise Exception("Sorry Invalid customer Id")
-        
-        # Check if the product IDs are valid
-        if not input.product_ids:
-            raise Exception("Product IDs list cannot be empty")
-        
-        if not products.exists() or products.count() != len(input.product_ids):
-            raise Exception("No valid products found for the given IDs")
-        
-
-        # Caculate the total price from the products
-        for product in products:
-            total_amount += product.price
-        
-        # Create the order
-        order_date = input.order_date or timezone.now()
-        customer = Customer.objects.get(pk=input.customer_id)
-        order = Order.objects.create(customer=customer, total_amount=total_amount, order_date=order_date)
-        order.save()
-
-        # Associate an order with a product
-        order.products.set(products)
+        try:
+            cleaned = clean_order(input)
+        except ValueError as e:
+            raise Exception(str(e))
+        quantities = cleaned["quantities"]
+
+        with transaction.atomic():
+            # The customer is locked so it can't be deleted before the order commits
+            if not Customer.objects.select_for_update().filter(pk=cleaned["customer_id"]).exists():
+                raise Exception("Sorry Invalid customer Id")
+
+            # One query for the prices, which also tells us if every product exists
+            prices = dict(Product.objects.filter(pk__in=quantities).values_list("pk", "price"))
+            if len(prices) != len(quantities):
+                raise Exception("No valid products found for the given IDs")
+
+            # Conditional decrement, rolls the whole order back when short
+            try:
+                reserve_stock(quantities)
+            except OutOfStock as e:
+                raise Exception(str(e))
+
+            order = Order.objects.create(customer_id=cleaned["customer_id"], order_date=cleaned["order_date"])
+            # One INSERT for the lines, each keeping the price it was sold at
+            OrderItem.objects.bulk_create(
+                OrderItem(order=order, product_id=pk, quantity=qty, unit_price=prices[pk])
+                for pk, qty in quantities.items()
+            )
+            invalidate(OrderItem)
+            # The total is summed by the database from the lines
+            total = order.items.aggregate(total=Sum(line_total()))["total"]
+            order.total_amount = total.quantize(Decimal("0.01"))
+            order.save(update_fields=["total_amount"])
+            record_orders([order])
+            publish(ORDER_CREATED, {"id": order.pk})
 
         return CreateOrder(order=order)
 
 class UpdateLowStockProducts(graphene.Mutation):
     class Arguments:
-        pass  # no arguments needed
+        threshold = graphene.Int(default_value=10)
+        increment = graphene.Int(default_value=10)
+        # How many of the updated products to return, the rest is only counted
+        first = graphene.Int(default_value=100)
+        # Queue the restock on a Celery worker and return the job right away
+        async_ = graphene.Boolean(name="async", default_value=False)
 
     success = graphene.String()
-    updated_products = graphene.List(ProductType)
+    updated_count = graphene.Int()
+    updated_products = graphene.List(RestockedProduct)
+    has_more = graphene.Boolean()
+    job = graphene.Field(JobType)
 
+    @classmethod
+    def mutate(cls, root, info, threshold=10, increment=10, first=100, async_=False):
+        if increment <= 0:
+            raise Exception("Increment must be positive")
+        if first < 0:
+            raise Exception("first cannot be negative")
 
-    def mutate(self, info):
-        low_stock_products = Product.objects.filter(stock__lt=10)
-        updated = []
+        if async_:
+            job = enqueue(UPDATE_LOW_STOCK_PRODUCTS, {"threshold": threshold, "increment": increment, "first": first})
+            return UpdateLowStockProducts(success="Low stock products update queued", job=job)
 
-        for product in low_stock_products:
-            product.stock += 10  # simulate restock
-            product.save()
-            updated.append(product)
+        # One UPDATE ... SET stock = stock + increment for every low-stock row
+        updated_count, rows = restock_low_stock(threshold=threshold, increment=increment, keep=first)
 
         return UpdateLowStockProducts(
             success="Low stock products updated successfully",
-            updated_products=updated,
+            updated_count=updated_count,
+            updated_products=[RestockedProduct(id=pk, stock=stock) for pk, stock in rows],
+            has_more=updated_count > len(rows),
         )
 
 
 
+class StatsPeriod(graphene.Enum):
+    DAY = "day"
+    WEEK = "week"
+
+
+class StatsBucket(graphene.ObjectType):
+    period = graphene.Date()
+    order_count = graphene.Int()
+    revenue = graphene.Decimal()
+    # Distinct customers who ordered, only for DAY buckets
+    customer_count = graphene.Int()
+
+
+class CrmStats(graphene.ObjectType):
+    # Customers who ordered in the range, or every customer without one
+    customer_count = graphene.Int()
+    order_count = graphene.Int()
+    revenue = graphene.Decimal()
+    buckets = graphene.List(StatsBucket)
+
+    @classmethod
+    def for_range(cls, stats, start_date, end_date, group_by):
+        result = cls(**stats)
+        result.start_date, result.end_date, result.group_by = start_date, end_date, group_by
+        return result
+
+    def resolve_buckets(root, info):
+        # Only grouped (and queried) when the client selects buckets
+        if not root.group_by:
+            return []
+        if get_loaders(info).is_async:
+            return root.abuckets()
+        return [
+            StatsBucket(**bucket)
+            for bucket in order_buckets(root.start_date, root.end_date, root.group_by)
+        ]
+
+    async def abuckets(root):
+        buckets = await aorder_buckets(root.start_date, root.end_date, root.group_by)
+        return [StatsBucket(**bucket) for bucket in buckets]
+
+
 # QUERY 
 class Query(graphene.ObjectType):
-    all_customers = graphene.List(CustomerType)
-    products = graphene.List(ProductType)
-    orders = graphene.List(OrderType)
+    # Keyset-paginated connections, the field handles filtering, ordering,
+    # cursors and column pruning so the resolvers only return the base queryset
+    # (and reads it with the async ORM under the async view)
+    all_customers = KeysetConnectionField(
+        CustomerConnection, ordering=("id",), filterset_class=CustomerFilter
+    )
+    products = KeysetConnectionField(
+        ProductConnection, ordering=("id",), filterset_class=ProductFilter
+    )
+    orders = KeysetConnectionField(
+        OrderConnection, ordering=("order_date", "id"), filterset_class=OrderFilter
+    )
+
+    crm_stats = graphene.Field(
+        CrmStats,
+        start_date=graphene.Date(),
+        end_date=graphene.Date(),
+        group_by=StatsPeriod(),
+    )
+
+    job = graphene.Field(JobType, id=graphene.ID(required=True))
+
+    def resolve_crm_stats(root, info, start_date=None, end_date=None, group_by=None):
+        group_by = getattr(group_by, "value", group_by)
+        if get_loaders(info).is_async:
+            async def resolve():
+                return CrmStats.for_range(await acrm_stats(start_date, end_date), start_date, end_date, group_by)
+            return resolve()
+        return CrmStats.for_range(crm_stats(start_date, end_date), start_date, end_date, group_by)
+
+    def resolve_job(root, info, id):
+        try:
+            pk = uuid.UUID(id)
+        except ValueError:
+            return None
+        if get_loaders(info).is_async:
+            return Job.objects.filter(pk=pk).afirst()
+        return Job.objects.filter(pk=pk).first()
 
     def resolve_all_customers(root, info, **kwargs):
         return Customer.objects.all()
@@ -242,6 +478,12 @@ class Query(graphene.ObjectType):
         return Order.objects.all()
 
 
+# crmStats is computed from the rollups and orders, which its return type doesn't show
+cache_hint("Query", "crmStats", max_age=300, models=[Customer, DailyOrderStats, Order])
+# A job is polled for its progress
+cache_hint("Query", "job", max_age=0)
+
+
 class Mutation(graphene.ObjectType):
     create_customer = CreateCustomer.Field()
     bulk_create_customers = BulkCreateCustomers.Field()
@@ -250,5 +492,36 @@ class Mutation(graphene.ObjectType):
     update_low_stock_products = UpdateLowStockProducts.Field()
 
 
-
-
+class StockChange(graphene.ObjectType):
+    product = graphene.Field(ProductType, description="The product, with its stock as of now")
+    change = graphene.Int(description="Units added (positive) or taken (negative) by the write")
+
+
+# SUBSCRIPTION, served over graphql-ws by crm.subscriptions
+class Subscription(graphene.ObjectType):
+    order_created = graphene.Field(OrderType)
+    stock_changed = graphene.Field(
+        StockChange,
+        threshold=graphene.Int(description="Only products below this stock, or that just crossed it"),
+    )
+
+    async def subscribe_order_created(root, info):
+        async for event in subscribe(ORDER_CREATED):
+            order = await Order.objects.select_related("customer").filter(pk=event["id"]).afirst()
+            if order is not None:
+                # Every event is executed with the same context, don't serve it stale loads
+                get_loaders(info).clear()
+                yield order
+
+    async def subscribe_stock_changed(root, info, threshold=None):
+        async for changes in subscribe(STOCK_CHANGED):
+            products = await Product.objects.ain_bulk([change["id"] for change in changes])
+            get_loaders(info).clear()
+            for change in changes:
+                product = products.get(change["id"])
+                if product is None or product.stock is None:
+                    continue
+                # Below the threshold now or before the change
+                if threshold is not None and min(product.stock, product.stock - change["change"]) >= threshold:
+                    continue
+                yield StockChange(product=product, change=change["change"])
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -60,12 +61,79 @@ CELERY_BEAT_SCHEDULE = {
         "task": "crm.tasks.generate_crm_report",
         "schedule": crontab(day_of_week="mon", hour=6, minute=0),
     },
+    "sweep-jobs": {
+        "task": "crm.tasks.sweep_jobs",
+        "schedule": crontab(minute="*/5"),
+    },
 }
 
 # GRAPHQL SETTING - GRAPHENE
 GRAPHENE = {
-    "SCHEMA": "alx_backend_graphql.schema.schema"
+    "SCHEMA": "alx_backend_graphql.schema.schema",
+    # WebSocket endpoint of the ASGI app for subscriptions, also used by GraphiQL
+    "SUBSCRIPTION_PATH": "/graphql/ws",
+}
+
+# Rows per INSERT for bulk customer imports
+CRM_BULK_CREATE_BATCH_SIZE = 1000
+
+# Order reminders: where they are sent and how many are in flight at once
+CRM_REMINDER_MAILER = "crm.reminders.LogMailer"
+CRM_REMINDER_CONCURRENCY = 50
+
+# Parsed and validated documents kept per process (LRU): by query text, and
+# by hash for persisted queries
+CRM_DOCUMENT_CACHE_SIZE = 1000
+CRM_PERSISTED_QUERY_CACHE_SIZE = 1000
+
+# Local memory by default, set REDIS_URL to share the cache between processes
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
 }
+if os.environ.get("REDIS_URL"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["REDIS_URL"],
+    }
+
+# Opt-in cache of query responses, dropped when the models they read change
+CRM_RESPONSE_CACHE_ENABLED = False
+CRM_RESPONSE_CACHE_ALIAS = "default"
+CRM_RESPONSE_CACHE_TIMEOUT = 60
+
+# Query budget (see crm/cost.py): operations estimated above these are
+# rejected. Unpaginated lists are assumed to hold CRM_QUERY_LIST_SIZE items,
+# operations returning more than CRM_QUERY_MAX_COST anyway are cut short.
+CRM_QUERY_MAX_COST = 20000
+CRM_QUERY_MAX_DEPTH = 10
+CRM_QUERY_PAGE_SIZE = 100
+CRM_QUERY_LIST_SIZE = 10
+CRM_QUERY_FIELD_WEIGHTS = {
+    "Query.crmStats": 10,
+}
+
+# Resolver timings and per-field SQL counts in the response extensions for
+# every request; a single request from staff (or under DEBUG) can ask for them
+# with "X-CRM-Trace: 1"
+CRM_GRAPHQL_TRACING = False
+
+# Most operations accepted in one batched (JSON array) request
+CRM_GRAPHQL_MAX_BATCH_SIZE = 20
+
+# Subscription events. The in-process broker only reaches WebSockets served by
+# the process that made the write; with WSGI workers or Celery writing too, use
+# "crm.pubsub.RedisBroker" to fan events out to every ASGI worker.
+CRM_PUBSUB_BACKEND = "crm.pubsub.InProcessBroker"
+CRM_PUBSUB_REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Events buffered per subscriber before new ones are dropped
+CRM_PUBSUB_QUEUE_SIZE = 1000
+# Seconds a WebSocket client has to send connection_init
+CRM_SUBSCRIPTION_INIT_TIMEOUT = 10
+
+# Seconds a mutation called with async: true may run before its task is
+# killed, and runs a job gets before it is failed (see crm.jobs)
+CRM_JOB_TIMEOUT = 60 * 60
+CRM_JOB_MAX_ATTEMPTS = 3
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from . import response_cache
+from .models import Customer, Order, Product
+
+
+# Deletes are invalidated where they happen: a post_delete receiver would make
+# Django load and signal every row of a cascade instead of fast-deleting it
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Order)
+def invalidate_cached_responses(sender, **kwargs):
+    response_cache.model_changed(sender, **kwargs)
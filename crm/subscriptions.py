@@ -0,0 +1,235 @@
+import asyncio
+import json
+from inspect import isawaitable
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from graphene_django.settings import graphene_settings
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast, subscribe
+
+from .cost import CostLimit
+from .documents import parse_and_validate
+from .loaders import CRMLoaders
+from .views import CRMGraphQLView, execute_operation
+
+# The two WebSocket subprotocols GraphQL clients speak: graphql-transport-ws
+# (the graphql-ws library, Apollo Client 3) and the legacy graphql-ws of
+# subscriptions-transport-ws (GraphiQL). They differ in a few message names.
+GRAPHQL_TRANSPORT_WS = "graphql-transport-ws"
+GRAPHQL_WS = "graphql-ws"
+
+MESSAGES = {
+    GRAPHQL_TRANSPORT_WS: {"start": "subscribe", "stop": "complete", "data": "next"},
+    GRAPHQL_WS: {"start": "start", "stop": "stop", "data": "data"},
+}
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class GraphQLWebSocket:
+    """One WebSocket connection running GraphQL operations, as an ASGI app.
+
+    Subscriptions stream a result per event (see crm.pubsub) until the client
+    stops them or disconnects; queries and mutations answer once. Documents go
+    through the same cached parse/validate and cost rule as the HTTP endpoint,
+    and mutations through its ATOMIC_MUTATIONS handling.
+
+    The socket outlives any request, so every operation and every event is
+    framed as one: request_started/request_finished are sent around it, which
+    closes the database connections past CONN_MAX_AGE like after a request.
+    """
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self.send_lock = asyncio.Lock()
+        self.protocol = None
+        self.acknowledged = False
+        self.connection_params = {}
+        self.operations = {}
+
+    @classmethod
+    async def app(cls, scope, receive, send):
+        await cls(scope, receive, send).run()
+
+    @property
+    def schema(self):
+        return graphene_settings.SCHEMA.graphql_schema
+
+    async def send(self, message):
+        async with self.send_lock:
+            await self._send(message)
+
+    async def send_json(self, message):
+        await self.send({"type": "websocket.send", "text": json.dumps(message, default=str)})
+
+    async def close(self, code, reason=""):
+        await self.send({"type": "websocket.close", "code": code, "reason": reason})
+        raise ConnectionClosed
+
+    async def run(self):
+        message = await self.receive()
+        if message["type"] != "websocket.connect":
+            return
+        offered = self.scope.get("subprotocols") or []
+        self.protocol = next((name for name in offered if name in MESSAGES), None)
+        if self.protocol is None:
+            await self.send({"type": "websocket.close", "code": 4406})
+            return
+        await self.send({"type": "websocket.accept", "subprotocol": self.protocol})
+        try:
+            while True:
+                try:
+                    timeout = None if self.acknowledged else getattr(settings, "CRM_SUBSCRIPTION_INIT_TIMEOUT", 10)
+                    message = await asyncio.wait_for(self.receive(), timeout)
+                except asyncio.TimeoutError:
+                    await self.close(4408, "Connection initialisation timeout")
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message["type"] == "websocket.receive":
+                    await self.handle(message.get("text") or message.get("bytes"))
+        except ConnectionClosed:
+            pass
+        finally:
+            for task in self.operations.values():
+                task.cancel()
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+            message_type = message["type"]
+        except (TypeError, ValueError, KeyError):
+            await self.close(4400, "Invalid message received")
+        messages = MESSAGES[self.protocol]
+
+        if message_type == "connection_init":
+            if self.acknowledged:
+                await self.close(4429, "Too many initialisation requests")
+            self.acknowledged = True
+            self.connection_params = message.get("payload") or {}
+            await self.send_json({"type": "connection_ack"})
+            if self.protocol == GRAPHQL_WS:
+                await self.send_json({"type": "ka"})
+        elif message_type == "ping":
+            await self.send_json({"type": "pong"})
+        elif message_type == "pong":
+            pass
+        elif message_type == messages["start"]:
+            if not self.acknowledged:
+                await self.close(4401, "Unauthorized")
+            operation_id = message.get("id")
+            if operation_id in self.operations:
+                await self.close(4409, f"Subscriber for {operation_id} already exists")
+            self.operations[operation_id] = asyncio.ensure_future(
+                self.run_operation(operation_id, message.get("payload") or {})
+            )
+        elif message_type == messages["stop"]:
+            task = self.operations.pop(message.get("id"), None)
+            if task is not None:
+                task.cancel()
+        elif message_type == "connection_terminate":
+            await self.close(1000)
+        else:
+            await self.close(4400, f"Unknown message type: {message_type}")
+
+    async def request_started(self):
+        await sync_to_async(request_started.send)(sender=self.__class__, scope=self.scope)
+
+    async def request_finished(self):
+        await sync_to_async(request_finished.send)(sender=self.__class__)
+
+    async def next_result(self, results):
+        await self.request_started()
+        try:
+            return await anext(results)
+        finally:
+            await self.request_finished()
+
+    def get_context(self, is_async=True):
+        return SimpleNamespace(
+            scope=self.scope,
+            connection_params=self.connection_params,
+            loaders=CRMLoaders(is_async=is_async),
+        )
+
+    async def run_operation(self, operation_id, payload):
+        try:
+            query, variables, operation_name = payload.get("query"), payload.get("variables"), payload.get("operationName")
+            document, errors = parse_and_validate(
+                self.schema, query or "", CRMGraphQLView.validation_rules, graphene_settings.MAX_VALIDATION_ERRORS
+            )
+            if errors:
+                await self.send_errors(operation_id, errors)
+                return
+            operation = get_operation_ast(document, operation_name)
+            options = {"variable_values": variables, "operation_name": operation_name}
+            if operation is not None and operation.operation == OperationType.SUBSCRIPTION:
+                results = await subscribe(self.schema, document, context_value=self.get_context(), **options)
+                if isinstance(results, ExecutionResult):
+                    await self.send_errors(operation_id, results.errors)
+                    return
+                try:
+                    while True:
+                        try:
+                            result = await self.next_result(results)
+                        except StopAsyncIteration:
+                            break
+                        await self.send_result(operation_id, result)
+                finally:
+                    await results.aclose()
+            else:
+                await self.request_started()
+                try:
+                    options["middleware"] = [CostLimit()]
+                    if operation is not None and operation.operation == OperationType.MUTATION:
+                        # Mutations write through the sync ORM and its transactions
+                        result = await sync_to_async(execute_operation)(
+                            self.schema, document, True, context_value=self.get_context(is_async=False), **options
+                        )
+                    else:
+                        result = execute(self.schema, document, context_value=self.get_context(), **options)
+                        if isawaitable(result):
+                            result = await result
+                finally:
+                    await self.request_finished()
+                await self.send_result(operation_id, result)
+            await self.send_json({"type": "complete", "id": operation_id})
+        except Exception as e:
+            await self.send_errors(operation_id, [e])
+        finally:
+            if self.operations.get(operation_id) is asyncio.current_task():
+                del self.operations[operation_id]
+
+    async def send_result(self, operation_id, result):
+        payload = {"data": result.data}
+        if result.errors:
+            payload["errors"] = [CRMGraphQLView.format_error(error) for error in result.errors]
+        await self.send_json({"type": MESSAGES[self.protocol]["data"], "id": operation_id, "payload": payload})
+
+    async def send_errors(self, operation_id, errors):
+        await self.send_json({
+            "type": "error",
+            "id": operation_id,
+            "payload": [CRMGraphQLView.format_error(error) for error in errors],
+        })
+
+
+def websocket_application(http_application):
+    """Wrap the Django ASGI app so WebSockets on the GRAPHENE SUBSCRIPTION_PATH
+    setting are answered by ``GraphQLWebSocket``."""
+    path = graphene_settings.SUBSCRIPTION_PATH or "/graphql/ws"
+
+    async def application(scope, receive, send):
+        if scope["type"] == "websocket":
+            if scope["path"] == path:
+                return await GraphQLWebSocket.app(scope, receive, send)
+            await receive()
+            return await send({"type": "websocket.close", "code": 4404})
+        return await http_application(scope, receive, send)
+
+    return application
@@ -1,3 +1,1311 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from functools import partial
+from unittest import mock
+from urllib.parse import urlencode
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.signals import post_delete, pre_delete
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import celery_app, cron
+from .bulk import existing_emails
+from .documents import CacheInfo, DocumentCache, documents
+from .filters import CustomerFilter, OrderFilter, ProductFilter
+from .graphql_client import OperationError, execute, load_schema
+from .importers import stream_import
+from .inventory import OutOfStock, reserve_stock
+from .jobs import UPDATE_LOW_STOCK_PRODUCTS, sweep_stale_jobs
+from .loaders import CRMLoaders
+from .models import (
+    Customer, CustomerActivity, CustomerImport, DailyOrderStats, Job, Order, OrderItem, Product, ReminderCheckpoint,
+)
+from .persisted import persisted_queries, query_hash
+from .pubsub import ORDER_CREATED, STOCK_CHANGED, get_broker
+from .reminders import send_reminders
+from .reports import crm_stats
+from .rollups import rebuild, record_orders
+from .subscriptions import GraphQLWebSocket
+
+
+class FilterIndexTests(TestCase):
+    """The FilterSet lookups exposed on the connections are served by indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        customers = Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"customer{i}@example.com", phone=f"+1555{i:07d}")
+            for i in range(50)
+        )
+        Product.objects.bulk_create(
+            Product(name=f"Product {i}", stock=i, price=Decimal(i) + Decimal("0.99"))
+            for i in range(50)
+        )
+        Order.objects.bulk_create(
+            Order(customer=customers[i % 50], total_amount=Decimal(i)) for i in range(200)
+        )
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_order_date_filter_uses_index(self):
+        since = timezone.now() - timedelta(days=7)
+        qs = OrderFilter({"order_date__gte": since.isoformat()}, queryset=Order.objects.all()).qs
+        self.assertUsesIndex(qs.values("id"), "crm_order_order_date")
+
+    def test_total_amount_filter_uses_index(self):
+        qs = OrderFilter({"total_amount__gte": "150"}, queryset=Order.objects.all()).qs
+        self.assertUsesIndex(qs.values("id"), "crm_order_total_amount")
+
+    def test_stock_filter_uses_index(self):
+        qs = ProductFilter({"stock__lt": "10"}, queryset=Product.objects.all()).qs
+        self.assertUsesIndex(qs.values("id"), "crm_product_stock")
+
+    def test_price_filter_uses_index(self):
+        qs = ProductFilter({"price__gt": "40"}, queryset=Product.objects.all()).qs
+        self.assertUsesIndex(qs.values("id"), "crm_product_price")
+
+    def test_phone_pattern_filter_uses_prefix_index(self):
+        qs = CustomerFilter({"phone_pattern": "+1555000001"}, queryset=Customer.objects.all()).qs
+        self.assertEqual(qs.count(), 10)
+        self.assertUsesIndex(qs.values("id"), "crm_customer_phone_prefix_idx")
+
+
+class JobTests(TestCase):
+    """Mutations called with ``async: true`` run as Celery jobs (eagerly here)."""
+
+    def setUp(self):
+        from alx_backend_graphql.schema import schema
+
+        self.schema = schema
+        eager = celery_app.conf.task_always_eager, celery_app.conf.task_eager_propagates
+        celery_app.conf.task_always_eager = celery_app.conf.task_eager_propagates = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", eager[0])
+        self.addCleanup(setattr, celery_app.conf, "task_eager_propagates", eager[1])
+
+    def execute(self, query, **variables):
+        result = self.schema.execute(query, variable_values=variables)
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def get_job(self, job_id):
+        return self.execute(
+            """query($id: ID!) { job(id: $id) {
+                status total processed progress createdCount importToken updatedCount hasMore
+                updatedProducts { id stock } errors rowErrors { index message }
+            } }""",
+            id=job_id,
+        )["job"]
+
+    def test_bulk_create_customers_runs_as_job(self):
+        rows = [{"name": f"Customer {i}", "email": f"job{i}@example.com"} for i in range(5)]
+        rows.append({"name": "Broken", "email": "not-an-email"})
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            data = self.execute(
+                """mutation($input: [CustomerInput]) {
+                    bulkCreateCustomers(input: $input, mode: PARTIAL, batchSize: 2, async: true) {
+                        createdCount job { id status total processed }
+                    }
+                }""",
+                input=rows,
+            )["bulkCreateCustomers"]
+        self.assertIsNone(data["createdCount"])
+        self.assertEqual(data["job"]["status"], "PENDING")
+        self.assertEqual((data["job"]["total"], data["job"]["processed"]), (6, 0))
+        self.assertFalse(Customer.objects.exists())
+
+        for callback in callbacks:
+            callback()
+        job = self.get_job(data["job"]["id"])
+        self.assertEqual(job["status"], "SUCCEEDED")
+        self.assertEqual((job["processed"], job["progress"]), (6, 1.0))
+        self.assertEqual(job["createdCount"], 5)
+        self.assertIsNotNone(job["importToken"])
+        self.assertEqual(job["rowErrors"], [{"index": 5, "message": "Invalid email: not-an-email"}])
+        self.assertEqual(Customer.objects.count(), 5)
+
+    def test_all_or_nothing_job_reports_row_errors(self):
+        rows = [{"name": "Ann", "email": "ann@example.com"}, {"name": "", "email": "bob@example.com"}]
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self.execute(
+                """mutation($input: [CustomerInput]) {
+                    bulkCreateCustomers(input: $input, async: true) { job { id } }
+                }""",
+                input=rows,
+            )["bulkCreateCustomers"]
+        job = self.get_job(data["job"]["id"])
+        self.assertEqual(job["status"], "SUCCEEDED")
+        self.assertEqual(job["createdCount"], 0)
+        self.assertEqual(job["errors"], ["Row 2: Name and Email are required."])
+        self.assertFalse(Customer.objects.exists())
+
+    def test_update_low_stock_products_runs_as_job(self):
+        Product.objects.bulk_create(Product(name=f"Product {i}", stock=i, price=Decimal("1.00")) for i in range(4))
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self.execute(
+                """mutation { updateLowStockProducts(threshold: 3, increment: 10, first: 2, async: true) {
+                    updatedCount job { id }
+                } }"""
+            )["updateLowStockProducts"]
+        self.assertIsNone(data["updatedCount"])
+        job = self.get_job(data["job"]["id"])
+        self.assertEqual(job["status"], "SUCCEEDED")
+        self.assertEqual((job["updatedCount"], job["total"], job["hasMore"]), (3, 3, True))
+        self.assertEqual([product["stock"] for product in job["updatedProducts"]], [10, 11])
+        self.assertEqual(sorted(Product.objects.values_list("stock", flat=True)), [3, 10, 11, 12])
+
+    def test_failed_job_records_the_error(self):
+        with self.assertLogs("crm.jobs", "ERROR"), self.captureOnCommitCallbacks(execute=True):
+            data = self.execute(
+                """mutation { bulkCreateCustomers(input: [], importToken: "missing", async: true) { job { id } } }"""
+            )["bulkCreateCustomers"]
+        job = self.get_job(data["job"]["id"])
+        self.assertEqual(job["status"], "FAILED")
+        self.assertEqual(job["errors"], ["Unknown import token: missing"])
+        self.assertEqual(Job.objects.get().status, Job.Status.FAILED)
+
+    def stuck_job(self, started_ago, attempts=1):
+        Product.objects.create(name="Widget", stock=1, price=Decimal("2.00"))
+        return Job.objects.create(
+            kind=UPDATE_LOW_STOCK_PRODUCTS,
+            arguments={"threshold": 5, "increment": 10, "first": 10},
+            status=Job.Status.RUNNING,
+            started_at=timezone.now() - started_ago,
+            attempts=attempts,
+        )
+
+    @override_settings(CRM_JOB_TIMEOUT=60)
+    def test_lost_job_is_run_again(self):
+        job = self.stuck_job(timedelta(minutes=5))
+        self.assertEqual(sweep_stale_jobs(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result["updated_count"]), (Job.Status.SUCCEEDED, 2, 1))
+        self.assertEqual(Product.objects.get().stock, 11)
+
+    @override_settings(CRM_JOB_TIMEOUT=60)
+    def test_running_job_is_left_alone(self):
+        job = self.stuck_job(timedelta(seconds=10))
+        self.assertEqual(sweep_stale_jobs(), (0, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.RUNNING)
+
+    @override_settings(CRM_JOB_TIMEOUT=60, CRM_JOB_MAX_ATTEMPTS=3)
+    def test_job_fails_after_its_attempts(self):
+        job = self.stuck_job(timedelta(minutes=5), attempts=3)
+        self.assertEqual(sweep_stale_jobs(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertIn("in 3 attempts", job.errors[0]["message"])
+        self.assertEqual(Product.objects.get().stock, 1)
+
+    def test_unknown_job_is_null(self):
+        self.assertIsNone(self.execute("{ job(id: \"not-a-uuid\") { id } }")["job"])
+
+
+class QueryCostTests(TestCase):
+    """Operations over the cost budget are rejected, before or while executing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        Order.objects.bulk_create(Order(customer=customer, total_amount=Decimal(i)) for i in range(30))
+
+    def post(self, query):
+        return self.client.post("/graphql", {"query": query}, content_type="application/json")
+
+    def test_cyclic_fragment_is_a_validation_error(self):
+        response = self.post("""
+            query { allCustomers(first: 2) { edges { node { ...A } } } }
+            fragment A on CustomerType { orders { customer { ...A } } }
+        """)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Cannot spread fragment 'A' within itself.", [e["message"] for e in response.json()["errors"]])
+
+    @override_settings(CRM_QUERY_MAX_DEPTH=3)
+    def test_deep_query_is_rejected(self):
+        # Validation results are cached per query text, hence a query of its own
+        response = self.post("query Deep { allCustomers(first: 1) { edges { node { orders { id } } } } }")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["extensions"]["code"], "QUERY_TOO_DEEP")
+
+    @override_settings(CRM_QUERY_MAX_COST=100)
+    def test_costly_query_is_rejected_before_executing(self):
+        with self.assertNumQueries(0):
+            response = self.post("{ allCustomers(first: 100) { edges { node { orders { id } } } } }")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"][0]["extensions"]["code"], "QUERY_TOO_COSTLY")
+
+    @override_settings(CRM_QUERY_MAX_COST=25)
+    def test_unbounded_list_is_stopped_at_the_actual_cost(self):
+        # Estimated at 1 + 1 + 1 + 10 orders, the customer has 30
+        response = self.post("query Orders { allCustomers(first: 1) { edges { node { orders { id } } } } }")
+        body = response.json()
+        self.assertEqual(body["extensions"]["cost"]["estimated"], 13)
+        self.assertEqual([e["extensions"]["code"] for e in body["errors"]], ["QUERY_TOO_COSTLY"])
+        self.assertEqual(body["errors"][0]["path"], ["allCustomers", "edges", 0, "node", "orders"])
+        # orders is a non-null list, its null reaches the nullable node
+        self.assertEqual(body["data"]["allCustomers"], {"edges": [{"node": None}]})
+
+    def test_cost_is_reported(self):
+        response = self.post("{ allCustomers(first: 1) { edges { node { orders { id } } } } }")
+        body = response.json()
+        self.assertNotIn("errors", body)
+        self.assertEqual(body["extensions"]["cost"]["actual"], 33)
+
+    @override_settings(CRM_QUERY_MAX_COST=25)
+    async def test_unbounded_list_is_stopped_under_the_async_view(self):
+        response = await self.async_client.post(
+            "/graphql/async",
+            {"query": "query AsyncOrders { allCustomers(first: 1) { edges { node { orders { id } } } } }"},
+            content_type="application/json",
+        )
+        body = response.json()
+        self.assertEqual([e["extensions"]["code"] for e in body["errors"]], ["QUERY_TOO_COSTLY"])
+
+
+class RollupTests(TestCase):
+    """record_orders() adds new orders to the daily rollups."""
+
+    def setUp(self):
+        self.ann = Customer.objects.create(name="Ann", email="ann@example.com")
+        self.bob = Customer.objects.create(name="Bob", email="bob@example.com")
+        self.today = timezone.localdate()
+
+    def order(self, customer, total):
+        order = Order.objects.create(customer=customer, total_amount=Decimal(total))
+        record_orders([order])
+        return order
+
+    def test_orders_are_added_to_the_day(self):
+        self.order(self.ann, "10.00")
+        self.order(self.ann, "5.50")
+        self.order(self.bob, "1.25")
+        stats = DailyOrderStats.objects.get(day=self.today)
+        self.assertEqual((stats.order_count, stats.customer_count, stats.revenue), (3, 2, Decimal("16.75")))
+        rebuild()
+        self.assertEqual(
+            DailyOrderStats.objects.values_list("order_count", "customer_count", "revenue").get(day=self.today),
+            (3, 2, Decimal("16.75")),
+        )
+        self.assertEqual(CustomerActivity.objects.get(customer=self.ann).order_count, 2)
+
+    def test_rollup_is_updated_not_recomputed(self):
+        # Orders another transaction counted already, which this one can't see:
+        # recomputing the day from the visible orders would lose them
+        DailyOrderStats.objects.create(day=self.today, order_count=4, customer_count=3, revenue=Decimal("40.00"))
+        self.order(self.ann, "10.00")
+        stats = DailyOrderStats.objects.get(day=self.today)
+        self.assertEqual((stats.order_count, stats.customer_count, stats.revenue), (5, 4, Decimal("50.00")))
+
+    def test_batch_counts_each_new_customer_once(self):
+        self.order(self.ann, "10.00")
+        orders = [
+            Order.objects.create(customer=customer, total_amount=Decimal(total))
+            for customer, total in ((self.ann, "1.00"), (self.bob, "2.00"), (self.bob, "3.00"))
+        ]
+        record_orders(orders)
+        stats = DailyOrderStats.objects.get(day=self.today)
+        self.assertEqual((stats.order_count, stats.customer_count, stats.revenue), (4, 2, Decimal("16.00")))
+        self.assertEqual(
+            list(CustomerActivity.objects.order_by("customer").values_list("order_count", flat=True)), [2, 2]
+        )
+
+    def test_recording_an_order_is_two_updates(self):
+        self.order(self.ann, "10.00")
+        order = Order.objects.create(customer=self.ann, total_amount=Decimal("5.00"))
+        with self.assertNumQueries(2):
+            record_orders([order])
+        self.assertEqual(CustomerActivity.objects.get(customer=self.ann).last_order_date, order.order_date)
+
+    def test_stats_count_the_customers_of_the_range(self):
+        Customer.objects.create(name="Cy", email="cy@example.com")
+        self.order(self.ann, "10.00")
+        self.order(self.ann, "5.00")
+        Order.objects.filter(customer=self.ann).update(order_date=timezone.now() - timedelta(days=2))
+        self.order(self.bob, "1.25")
+        self.assertEqual(crm_stats()["customer_count"], 3)
+        self.assertEqual(crm_stats(self.today, self.today)["customer_count"], 1)
+        self.assertEqual(crm_stats(end_date=self.today - timedelta(days=1))["customer_count"], 1)
+
+
+@override_settings(CRM_RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTests(TestCase):
+    """Cached query results are dropped by the writes to the models they read."""
+
+    query = "query Stock { products(first: 5) { edges { node { name stock } } } }"
+
+    def setUp(self):
+        caches["default"].clear()
+        self.product = Product.objects.create(name="Widget", stock=1, price=Decimal("2.00"))
+        self.customer = Customer.objects.create(name="Ann", email="ann@example.com")
+
+    def post(self, query, variables=None):
+        response = self.client.post("/graphql", {"query": query, "variables": variables}, content_type="application/json")
+        self.assertNotIn("errors", response.json())
+        return response.json()["data"]
+
+    def stock(self):
+        return self.post(self.query)["products"]["edges"][0]["node"]["stock"]
+
+    def test_mutation_invalidates_cached_query(self):
+        self.assertEqual(self.stock(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.stock(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post("mutation { updateLowStockProducts(threshold: 5, increment: 10) { updatedCount } }")
+        self.assertEqual(self.stock(), 11)
+
+    async def test_async_view_answers_from_the_cache(self):
+        query = "query AsyncStock { products(first: 5) { edges { node { name stock } } } }"
+        post = partial(self.async_client.post, "/graphql/async", {"query": query}, content_type="application/json")
+        await post()
+        # update() doesn't invalidate, a response read from the cache misses it
+        await Product.objects.aupdate(stock=5)
+        response = await post()
+        self.assertEqual(response.json()["data"]["products"]["edges"][0]["node"]["stock"], 1)
+
+    def test_order_invalidates_cached_stock(self):
+        self.assertEqual(self.stock(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post(
+                "mutation($input: OrderInput!) { createOrder(input: $input) { order { id } } }",
+                {"input": {"customerId": self.customer.pk, "productIds": [self.product.pk]}},
+            )
+        self.assertEqual(self.stock(), 0)
+
+    def test_deletes_have_no_receivers(self):
+        # A delete receiver would make every cascade load and signal its rows,
+        # deletes call invalidate() themselves
+        for model in (Customer, Product, Order, OrderItem):
+            self.assertFalse(pre_delete.has_listeners(model) or post_delete.has_listeners(model), model)
+
+
+class ImportTests(TestCase):
+    """Import progress streams under WSGI and ASGI alike, for staff only."""
+
+    body = b"name,email\nAnn,ann@example.com\nBob,bob@example.com\n"
+
+    def setUp(self):
+        self.staff = get_user_model().objects.create_user("staff", is_staff=True)
+        self.client.force_login(self.staff)
+
+    def post(self, kind, body, content_type="text/csv", **params):
+        path = f"/import/{kind}" + (f"?{urlencode(params)}" if params else "")
+        response = self.client.post(path, body, content_type=content_type)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_wsgi_import(self):
+        reports = self.post("customers", self.body)
+        self.assertEqual(reports[-1]["created"], 2)
+
+    async def test_asgi_streams_an_async_iterator(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.post("/import/customers", self.body, content_type="text/csv")
+        self.assertTrue(response.is_async)
+        reports = [json.loads(line) async for line in response.streaming_content]
+        self.assertEqual(reports[-1]["created"], 2)
+        self.assertEqual(await Customer.objects.acount(), 2)
+
+    def test_anonymous_import_is_refused(self):
+        self.client.logout()
+        response = self.client.post("/import/customers", self.body, content_type="text/csv")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Customer.objects.exists())
+
+    def test_duplicate_customers(self):
+        body = self.body + b"Cy,cy@example.com\nCy again,cy@example.com\nAnn again,ann@example.com\nNo email,\n"
+        reports = self.post("customers", body, batch_size=2)
+        self.assertEqual([report["created"] for report in reports], [2, 3, 3])
+        self.assertEqual(
+            [error for report in reports for error in report["errors"]],
+            [
+                "Row 4: Email 'cy@example.com' is repeated in this batch.",
+                "Row 5: Email 'ann@example.com' already exists.",
+                "Row 6: Name and Email are required.",
+            ],
+        )
+        self.assertEqual(Customer.objects.count(), 3)
+
+    def test_products_import(self):
+        body = (
+            b"name,stock,price\n"
+            b"Widget,5,2.50\n"
+            b",1,1.00\n"
+            b"Gadget,-1,3.00\n"
+            b"Gizmo,,abc\n"
+            b"Widget,5,2.50\n"
+        )
+        reports = self.post("products", body)
+        self.assertEqual((reports[-1]["created"], reports[-1]["failed"]), (2, 3))
+        self.assertEqual(reports[-1]["errors"], [
+            "Row 2: Name is required.",
+            "Row 3: Stock cannot be negative",
+            "Row 4: Invalid price: abc",
+        ])
+        # Products have no natural key, a repeated row is another product
+        self.assertEqual(list(Product.objects.values_list("name", "stock", "price")), [
+            ("Widget", 5, Decimal("2.50")),
+            ("Widget", 5, Decimal("2.50")),
+        ])
+
+    def test_orders_import(self):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        widget = Product.objects.create(name="Widget", stock=10, price=Decimal("2.00"))
+        gadget = Product.objects.create(name="Gadget", stock=10, price=Decimal("3.00"))
+        items = [{"product_id": widget.pk, "quantity": 2}, {"product_id": gadget.pk}]
+        row = {"customer_id": customer.pk, "items": items}
+        lines = [
+            row,
+            {"customer_id": 999, "product_ids": [widget.pk]},
+            {"customer_id": customer.pk, "product_ids": [999]},
+            {"customer_id": customer.pk, "product_ids": []},
+            "not json",
+            row,
+        ]
+        body = "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines).encode()
+        reports = self.post("orders", body, content_type="application/x-ndjson", batch_size=3)
+        self.assertEqual((reports[-1]["created"], reports[-1]["failed"]), (2, 4))
+        self.assertEqual(reports[0]["errors"], [
+            "Row 2: Sorry Invalid customer Id",
+            "Row 3: No valid products found for the given IDs",
+        ])
+        self.assertEqual(reports[1]["errors"][0], "Row 4: Product IDs list cannot be empty")
+        self.assertTrue(reports[1]["errors"][1].startswith("Row 5: Invalid JSON"))
+        # A repeated row is another order, with the same lines and total
+        self.assertEqual(list(Order.objects.values_list("total_amount", flat=True)), [Decimal("7.00")] * 2)
+        self.assertEqual(OrderItem.objects.count(), 4)
+        stats = DailyOrderStats.objects.get()
+        self.assertEqual((stats.order_count, stats.customer_count, stats.revenue), (2, 1, Decimal("14.00")))
+
+
+@override_settings(DEBUG=True)
+class ExportTests(TestCase):
+    """Order exports stream under WSGI and ASGI alike."""
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        Order.objects.bulk_create(Order(customer=customer, total_amount=Decimal(i)) for i in range(3))
+
+    def test_gzip_refused_with_zero_quality(self):
+        response = self.client.get("/export/orders", headers={"accept-encoding": "gzip;q=0, identity"})
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 3)
+
+    def test_gzip_accepted(self):
+        for header in ("gzip", "deflate, gzip;q=0.5", "*"):
+            response = self.client.get("/export/orders", headers={"accept-encoding": header})
+            self.assertEqual(response.get("Content-Encoding"), "gzip", header)
+            rows = gzip.decompress(b"".join(response.streaming_content)).splitlines()
+            self.assertEqual(len(rows), 3)
+
+    async def test_asgi_streams_an_async_iterator(self):
+        response = await self.async_client.get("/export/orders", {"format": "csv"})
+        # A sync iterator would be read into a list before the first byte is sent
+        self.assertTrue(response.is_async)
+        lines = b"".join([chunk async for chunk in response.streaming_content]).splitlines()
+        self.assertEqual(len(lines), 4)
+
+
+class BatchTests(TestCase):
+    """A JSON array posted to /graphql runs as a batch."""
+
+    stock = "query Stock { products(first: 5) { edges { node { stock } } } }"
+
+    def setUp(self):
+        Product.objects.create(name="Widget", stock=1, price=Decimal("2.00"))
+
+    def post(self, batch, path="/graphql"):
+        return self.client.post(path, batch, content_type="application/json")
+
+    def stocks(self, result):
+        return [edge["node"]["stock"] for edge in result["data"]["products"]["edges"]]
+
+    def test_results_in_order(self):
+        response = self.post([{"query": self.stock, "id": 1}, {"query": "{ crmStats { orderCount } }", "id": 2}])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual([result["id"] for result in results], [1, 2])
+        self.assertEqual(self.stocks(results[0]), [1])
+        self.assertEqual(results[1]["data"], {"crmStats": {"orderCount": 0}})
+
+    def test_repeated_query_runs_once(self):
+        with self.assertNumQueries(1):
+            self.post([{"query": self.stock}])
+        with self.assertNumQueries(1):
+            results = self.post([{"query": self.stock}, {"query": self.stock}]).json()
+        self.assertEqual(results[0]["data"], results[1]["data"])
+
+    def test_mutation_clears_shared_state(self):
+        results = self.post([
+            {"query": self.stock},
+            {"query": "mutation { updateLowStockProducts(threshold: 5, increment: 10) { updatedCount } }"},
+            {"query": self.stock},
+        ]).json()
+        self.assertEqual(self.stocks(results[0]), [1])
+        self.assertEqual(self.stocks(results[2]), [11])
+
+    @override_settings(CRM_QUERY_MAX_COST=15)
+    def test_batch_cost_is_summed(self):
+        # 1 + 5 + 5 each, under the limit alone but not together
+        response = self.post([{"query": self.stock}, {"query": self.stock}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("estimated cost of 22", response.json()["errors"][0]["message"])
+
+    @override_settings(CRM_GRAPHQL_MAX_BATCH_SIZE=2)
+    def test_batch_size_limit(self):
+        self.assertEqual(self.post([{"query": self.stock}] * 3).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+
+    @override_settings(CRM_QUERY_MAX_COST=15)
+    async def test_async_batch(self):
+        response = await self.async_client.post(
+            "/graphql/async", [{"query": self.stock}], content_type="application/json"
+        )
+        self.assertEqual(self.stocks(response.json()[0]), [1])
+        response = await self.async_client.post(
+            "/graphql/async", [{"query": self.stock}] * 2, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class PersistedQueryTests(TestCase):
+    """Automatic persisted queries and the document caches behind /graphql."""
+
+    query = "query Persisted { products(first: 1) { edges { node { name } } } }"
+
+    def setUp(self):
+        Product.objects.create(name="Widget", stock=1, price=Decimal("2.00"))
+        persisted_queries.clear()
+        documents.clear()
+
+    def extensions(self, sha256_hash=None):
+        return {"persistedQuery": {"version": 1, "sha256Hash": sha256_hash or query_hash(self.query)}}
+
+    def post(self, **data):
+        return self.client.post("/graphql", data, content_type="application/json").json()
+
+    def test_register_then_hash_only(self):
+        data = self.post(extensions=self.extensions())
+        self.assertEqual(data["errors"][0]["message"], "PersistedQueryNotFound")
+        self.assertEqual(data["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND")
+
+        data = self.post(query=self.query, extensions=self.extensions())
+        self.assertEqual(data["data"]["products"]["edges"][0]["node"]["name"], "Widget")
+
+        data = self.post(extensions=self.extensions())
+        self.assertEqual(data["data"]["products"]["edges"][0]["node"]["name"], "Widget")
+        self.assertEqual(persisted_queries.cache_info(), CacheInfo(hits=1, misses=2, size=1, maxsize=1000))
+
+    def test_get_with_hash_only(self):
+        self.post(query=self.query, extensions=self.extensions())
+        response = self.client.get(
+            "/graphql", {"extensions": json.dumps(self.extensions())}, headers={"accept": "application/json"}
+        )
+        self.assertEqual(response.json()["data"]["products"]["edges"][0]["node"]["name"], "Widget")
+
+    def test_hash_mismatch_is_rejected(self):
+        data = self.post(query=self.query, extensions=self.extensions(query_hash("{ products { totalCount } }")))
+        self.assertEqual(data["errors"][0]["message"], "provided sha does not match query")
+        self.assertEqual(len(persisted_queries), 0)
+
+    def test_unsupported_version(self):
+        data = self.post(extensions={"persistedQuery": {"version": 2, "sha256Hash": query_hash(self.query)}})
+        self.assertEqual(data["errors"][0]["message"], "PersistedQueryNotSupported")
+
+    def test_document_cache_counts_hits_and_misses(self):
+        self.post(query=self.query)
+        self.post(query=self.query)
+        self.assertEqual(documents.cache_info(), CacheInfo(hits=1, misses=1, size=1, maxsize=1000))
+        self.client.force_login(get_user_model().objects.create_user("staff", is_staff=True))
+        stats = self.client.get("/graphql/cache").json()
+        self.assertEqual(stats["documents"], {"hits": 1, "misses": 1, "size": 1, "maxsize": 1000})
+
+    def test_cache_evicts_the_least_recently_used(self):
+        cache = DocumentCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        self.assertEqual(cache.cache_info(), CacheInfo(hits=3, misses=1, size=2, maxsize=2))
+
+
+class WebSocketTests(TestCase):
+    """GraphQL over WebSocket frames every operation as a request."""
+
+    async def run_socket(self, *messages):
+        incoming = asyncio.Queue()
+        for message in (
+            {"type": "websocket.connect"},
+            {"type": "websocket.receive", "text": json.dumps({"type": "connection_init"})},
+            *({"type": "websocket.receive", "text": json.dumps(message)} for message in messages),
+        ):
+            incoming.put_nowait(message)
+        sent = []
+
+        async def receive():
+            if incoming.empty():
+                # Let the operations finish before the client goes away
+                await asyncio.sleep(0.05)
+                return {"type": "websocket.disconnect"}
+            return incoming.get_nowait()
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "websocket", "path": "/graphql/ws", "subprotocols": ["graphql-transport-ws"]}
+        # As the test client does, so the test's transaction stays open
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            await GraphQLWebSocket.app(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        return [json.loads(message["text"]) for message in sent if message["type"] == "websocket.send"]
+
+    async def test_operations_send_request_signals(self):
+        events = []
+        started = lambda **kwargs: events.append("started")
+        finished = lambda **kwargs: events.append("finished")
+        request_started.connect(started)
+        request_finished.connect(finished)
+        self.addCleanup(request_started.disconnect, started)
+        self.addCleanup(request_finished.disconnect, finished)
+
+        await Product.objects.acreate(name="Widget", stock=1, price=Decimal("2.00"))
+        for query, data in (
+            ("{ products(first: 1) { edges { node { stock } } } }", {"products": {"edges": [{"node": {"stock": 1}}]}}),
+            (
+                "mutation { updateLowStockProducts(threshold: 5, increment: 10) { updatedCount } }",
+                {"updateLowStockProducts": {"updatedCount": 1}},
+            ),
+        ):
+            messages = await self.run_socket({"id": "1", "type": "subscribe", "payload": {"query": query}})
+            self.assertEqual([m["payload"]["data"] for m in messages if m["type"] == "next"], [data])
+        self.assertEqual(events, ["started", "finished"] * 2)
+
+
+    async def open_socket(self):
+        """A connected socket left running: ``(send, messages, close)``."""
+        incoming, sent = asyncio.Queue(), []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "websocket", "path": "/graphql/ws", "subprotocols": ["graphql-transport-ws"]}
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+        task = asyncio.ensure_future(GraphQLWebSocket.app(scope, incoming.get, send))
+        incoming.put_nowait({"type": "websocket.connect"})
+
+        def send_json(message):
+            incoming.put_nowait({"type": "websocket.receive", "text": json.dumps(message)})
+
+        def messages():
+            return [json.loads(message["text"]) for message in sent if message["type"] == "websocket.send"]
+
+        async def close():
+            incoming.put_nowait({"type": "websocket.disconnect"})
+            await task
+
+        send_json({"type": "connection_init"})
+        return send_json, messages, close
+
+    async def wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail("Timed out")
+
+    def create_order(self, customer, product, quantity):
+        from alx_backend_graphql.schema import schema
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return schema.execute(
+                "mutation($input: OrderInput!) { createOrder(input: $input) { order { id } } }",
+                variable_values={"input": {
+                    "customerId": customer.pk, "items": [{"productId": product.pk, "quantity": quantity}],
+                }},
+            )
+
+    async def test_committed_order_reaches_the_subscribers(self):
+        customer = await Customer.objects.acreate(name="Ann", email="ann@example.com")
+        product = await Product.objects.acreate(name="Widget", stock=3, price=Decimal("2.00"))
+        send, messages, close = await self.open_socket()
+        send({"id": "orders", "type": "subscribe", "payload": {
+            "query": "subscription { orderCreated { id totalAmount } }",
+        }})
+        send({"id": "stock", "type": "subscribe", "payload": {
+            "query": "subscription { stockChanged { product { name stock } change } }",
+        }})
+        broker = get_broker()
+        await self.wait_for(lambda: broker.subscribers[ORDER_CREATED] and broker.subscribers[STOCK_CHANGED])
+
+        # Rolled back (out of stock): nobody hears about it
+        result = await sync_to_async(self.create_order)(customer, product, 5)
+        self.assertIn("Out of stock", result.errors[0].message)
+        result = await sync_to_async(self.create_order)(customer, product, 2)
+        self.assertIsNone(result.errors)
+        order_id = result.data["createOrder"]["order"]["id"]
+
+        def events():
+            return {m["id"]: m["payload"]["data"] for m in messages() if m["type"] == "next"}
+
+        await self.wait_for(lambda: len(events()) == 2)
+        await close()
+        self.assertEqual(events(), {
+            "orders": {"orderCreated": {"id": order_id, "totalAmount": "4.00"}},
+            "stock": {"stockChanged": {"product": {"name": "Widget", "stock": 1}, "change": -2}},
+        })
+        self.assertEqual(len([m for m in messages() if m["type"] == "next"]), 2)
+
+class ReserveStockTests(TestCase):
+    """reserve_stock() takes stock out all or nothing."""
+
+    def setUp(self):
+        self.widget = Product.objects.create(name="Widget", stock=5, price=Decimal("2.00"))
+        self.gadget = Product.objects.create(name="Gadget", stock=1, price=Decimal("3.00"))
+        self.untracked = Product.objects.create(name="Service", stock=None, price=Decimal("9.00"))
+
+    def stock(self):
+        return dict(Product.objects.values_list("name", "stock"))
+
+    def test_reserves_every_product(self):
+        reserve_stock({self.widget.pk: 2, self.gadget.pk: 1, self.untracked.pk: 4})
+        self.assertEqual(self.stock(), {"Widget": 3, "Gadget": 0, "Service": None})
+
+    def test_shortage_rolls_everything_back(self):
+        with self.assertRaises(OutOfStock) as raised:
+            reserve_stock({self.widget.pk: 2, self.gadget.pk: 3})
+        self.assertEqual(raised.exception.shortages, [(self.gadget.pk, 3, 1)])
+        self.assertEqual(self.stock(), {"Widget": 5, "Gadget": 1, "Service": None})
+
+    def test_create_order_reports_the_shortage(self):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        response = self.client.post(
+            "/graphql",
+            {
+                "query": "mutation($input: OrderInput!) { createOrder(input: $input) { order { id } } }",
+                "variables": {"input": {
+                    "customerId": customer.pk,
+                    "items": [{"productId": self.widget.pk, "quantity": 1}, {"productId": self.gadget.pk, "quantity": 2}],
+                }},
+            },
+            content_type="application/json",
+        )
+        self.assertIn("Out of stock", response.json()["errors"][0]["message"])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.stock(), {"Widget": 5, "Gadget": 1, "Service": None})
+
+    def test_import_reserves_stock_per_order(self):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        rows = [
+            {"customer_id": customer.pk, "items": [{"product_id": self.widget.pk, "quantity": 3}]},
+            {"customer_id": customer.pk, "items": [{"product_id": self.widget.pk, "quantity": 3}]},
+            {"customer_id": customer.pk, "items": [{"product_id": self.gadget.pk}, {"product_id": self.untracked.pk}]},
+        ]
+        report = list(stream_import("orders", rows))[-1]
+        self.assertEqual((report["created"], report["failed"]), (2, 1))
+        self.assertEqual(
+            report["errors"], [f"Row 2: Out of stock: product {self.widget.pk} (requested 3, available 2)"]
+        )
+        self.assertEqual(self.stock(), {"Widget": 2, "Gadget": 0, "Service": None})
+
+
+class RelatedOrderingTests(TestCase):
+    """The loaders and the optimizer's prefetches list related rows in the same order."""
+
+    def setUp(self):
+        self.ann = Customer.objects.create(name="Ann", email="ann@example.com")
+        self.widget = Product.objects.create(name="Widget", stock=5, price=Decimal("2.00"))
+        self.gadget = Product.objects.create(name="Gadget", stock=5, price=Decimal("3.00"))
+        now = timezone.now()
+        # Newer orders first, so the (customer, order_date) index order isn't the pk order
+        self.orders = [
+            Order.objects.create(customer=self.ann, total_amount=Decimal("1.00"), order_date=now - timedelta(days))
+            for days in (0, 2, 1)
+        ]
+        for order in self.orders:
+            OrderItem.objects.create(order=order, product=self.gadget, quantity=1, unit_price=Decimal("3.00"))
+            OrderItem.objects.create(order=order, product=self.widget, quantity=1, unit_price=Decimal("2.00"))
+
+    def test_prefetch_and_loader_agree(self):
+        response = self.client.post(
+            "/graphql",
+            {"query": "{ allCustomers(first: 1) { edges { node { orders { id products { id } } } } } }"},
+            content_type="application/json",
+        )
+        orders = response.json()["data"]["allCustomers"]["edges"][0]["node"]["orders"]
+        prefetched = [(int(order["id"]), [int(product["id"]) for product in order["products"]]) for order in orders]
+
+        loaders = CRMLoaders()
+        loaded = [
+            (order.pk, [product.pk for product in loaders.products_by_order.load(order.pk)])
+            for order in loaders.orders_by_customer.load(self.ann.pk)
+        ]
+        self.assertEqual(prefetched, loaded)
+        self.assertEqual([pk for pk, _ in loaded], sorted(order.pk for order in self.orders))
+
+
+@override_settings(ALLOWED_HOSTS=["localhost"])
+class LoadTestCommandTests(TransactionTestCase):
+    """loadtest_graphql only reports throughput when every request succeeded.
+
+    The requests are served from other threads, which only see committed rows.
+    """
+
+    def call(self, *args):
+        out = io.StringIO()
+        call_command("loadtest_graphql", "--requests=4", "--concurrency=2", "--warmup=0", *args, stdout=out)
+        return out.getvalue()
+
+    def test_in_process_requests_succeed(self):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        widget = Product.objects.create(name="Widget", stock=5, price=Decimal("2.00"))
+        order = Order.objects.create(customer=customer, total_amount=Decimal("2.00"))
+        OrderItem.objects.create(order=order, product=widget, quantity=1, unit_price=Decimal("2.00"))
+        out = self.call()
+        self.assertIn("ASGI/WSGI", out)
+
+    def test_errors_fail_the_command(self):
+        with self.assertRaisesMessage(CommandError, "WSGI: 4 of 4 requests failed or returned errors"):
+            self.call("--query={ nope }")
+
+
+class PruneInactiveCustomersTests(TestCase):
+    """prune_inactive_customers deletes, in batches, the customers without a recent order."""
+
+    def setUp(self):
+        old = timezone.now() - timedelta(days=400)
+        self.active = []
+        for i in range(7):
+            customer = Customer.objects.create(name=f"Customer {i}", email=f"prune{i}@example.com")
+            # Every third customer ordered recently, the others a long time ago or never
+            if i % 3 == 0:
+                record_orders([Order.objects.create(customer=customer, total_amount=Decimal("1.00"))])
+                self.active.append(customer.pk)
+            elif i % 3 == 1:
+                record_orders([Order.objects.create(customer=customer, total_amount=Decimal("2.00"), order_date=old)])
+        self.old_day = timezone.localdate(old)
+
+    def call(self, *args):
+        out = io.StringIO()
+        call_command("prune_inactive_customers", "--days=30", *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_deletes_nothing(self):
+        out = self.call("--dry-run")
+        self.assertIn("4 customers have not ordered since", out)
+        self.assertEqual(Customer.objects.count(), 7)
+
+    def test_inactive_customers_go_in_batches(self):
+        out = self.call("--batch-size=3")
+        self.assertEqual(sorted(Customer.objects.values_list("pk", flat=True)), self.active)
+        self.assertIn("Deleted 3 customers", out)
+        self.assertIn("Deleted 4 customers", out)
+        self.assertIn("Deleted 4 customers inactive since", out)
+        self.assertEqual(Order.objects.count(), 3)
+        stats = DailyOrderStats.objects.get(day=self.old_day)
+        self.assertEqual((stats.order_count, stats.customer_count, stats.revenue), (0, 0, Decimal("0.00")))
+        self.assertEqual(CustomerActivity.objects.count(), 3)
+
+
+class TracingTests(TestCase):
+    """X-CRM-Trace adds resolver timings and per-field SQL counts, for staff only."""
+
+    query = "query Traced { allCustomers(first: 5) { edges { node { name orders { id } } } } }"
+
+    def setUp(self):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        Order.objects.create(customer=customer, total_amount=Decimal("1.00"))
+        self.staff = get_user_model().objects.create_user("staff", is_staff=True)
+
+    def post(self):
+        return self.client.post(
+            "/graphql", {"query": self.query}, content_type="application/json", headers={"x-crm-trace": "1"}
+        )
+
+    def test_anonymous_header_is_ignored(self):
+        self.assertNotIn("tracing", self.post().json()["extensions"])
+
+    def test_staff_gets_the_sql_of_each_field(self):
+        self.client.force_login(self.staff)
+        tracing = self.post().json()["extensions"]["tracing"]
+        resolvers = {".".join(map(str, record["path"])) for record in tracing["execution"]["resolvers"]}
+        self.assertIn("allCustomers", resolvers)
+        self.assertIn("allCustomers.edges.0.node.orders", resolvers)
+        by_field = tracing["sql"]["byField"]
+        # The page and its prefetched orders are both read by the root field
+        self.assertEqual(list(by_field), ["allCustomers"])
+        self.assertEqual(by_field["allCustomers"]["count"], tracing["sql"]["count"])
+        self.assertGreater(tracing["sql"]["count"], 0)
+
+    @override_settings(DEBUG=True)
+    def test_debug_traces_anyone(self):
+        self.assertIn("tracing", self.post().json()["extensions"])
+
+    async def test_async_view_checks_the_user(self):
+        response = await self.async_client.post(
+            "/graphql/async", {"query": self.query}, content_type="application/json", headers={"x-crm-trace": "1"}
+        )
+        self.assertNotIn("tracing", response.json()["extensions"])
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.post(
+            "/graphql/async", {"query": self.query}, content_type="application/json", headers={"x-crm-trace": "1"}
+        )
+        self.assertIn("allCustomers", response.json()["extensions"]["tracing"]["sql"]["byField"])
+
+
+class QueryCountTests(TestCase):
+    """Nested connections cost the same number of queries whatever the page size."""
+
+    @classmethod
+    def setUpTestData(cls):
+        products = Product.objects.bulk_create(
+            Product(name=f"Product {i}", stock=100, price=Decimal("1.00")) for i in range(4)
+        )
+        for i in range(10):
+            customer = Customer.objects.create(name=f"Customer {i}", email=f"count{i}@example.com")
+            for j in range(2):
+                order = Order.objects.create(customer=customer, total_amount=Decimal("2.00"))
+                OrderItem.objects.bulk_create(
+                    OrderItem(order=order, product=product, unit_price=product.price)
+                    for product in products[j:j + 2]
+                )
+
+    def post(self, first):
+        response = self.client.post(
+            "/graphql",
+            {"query": f"""{{ allCustomers(first: {first}) {{ totalCount edges {{ node {{
+                name orders {{
+                    id totalAmount customer {{ name }} products {{ name }} items {{ quantity product {{ name }} }}
+                }}
+            }} }} }} }}"""},
+            content_type="application/json",
+        )
+        edges = response.json()["data"]["allCustomers"]["edges"]
+        self.assertEqual(len(edges), first)
+        self.assertEqual(len(edges[-1]["node"]["orders"][-1]["products"]), 2)
+
+    def test_page_size_does_not_change_the_query_count(self):
+        with CaptureQueriesContext(connection) as small:
+            self.post(2)
+        with self.assertNumQueries(len(small)):
+            self.post(10)
+
+
+class KeysetPaginationTests(TestCase):
+    """Connections page with keyset cursors in both directions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        now = timezone.now()
+        # Two pairs of orders share their order_date, the id breaks the tie
+        cls.orders = [
+            Order.objects.create(customer=customer, order_date=now - timedelta(days))
+            for days in (3, 1, 3, 0, 1)
+        ]
+        cls.ordered = [order.pk for order in sorted(cls.orders, key=lambda order: (order.order_date, order.pk))]
+
+    page_fields = "edges { node { id } } pageInfo { hasNextPage hasPreviousPage startCursor endCursor }"
+
+    def page(self, arguments, fields=page_fields):
+        query = f"query Page {{ orders({arguments}) {{ {fields} }} }}"
+        response = self.client.post("/graphql", {"query": query}, content_type="application/json")
+        return response.json()
+
+    def ids(self, data):
+        return [int(edge["node"]["id"]) for edge in data["data"]["orders"]["edges"]]
+
+    def test_forward_paging_breaks_ties_on_id(self):
+        seen, cursor = [], None
+        while True:
+            data = self.page(f'first: 2, after: "{cursor}"' if cursor else "first: 2")
+            seen += self.ids(data)
+            page_info = data["data"]["orders"]["pageInfo"]
+            self.assertEqual(page_info["hasPreviousPage"], cursor is not None)
+            if not page_info["hasNextPage"]:
+                break
+            cursor = page_info["endCursor"]
+        self.assertEqual(seen, self.ordered)
+
+    def test_backward_paging(self):
+        data = self.page("last: 2")
+        self.assertEqual(self.ids(data), self.ordered[-2:])
+        self.assertTrue(data["data"]["orders"]["pageInfo"]["hasPreviousPage"])
+        data = self.page(f'last: 2, before: "{data["data"]["orders"]["pageInfo"]["startCursor"]}"')
+        self.assertEqual(self.ids(data), self.ordered[1:3])
+        self.assertTrue(data["data"]["orders"]["pageInfo"]["hasNextPage"])
+        data = self.page(f'last: 5, before: "{data["data"]["orders"]["pageInfo"]["startCursor"]}"')
+        self.assertEqual(self.ids(data), self.ordered[:1])
+        self.assertFalse(data["data"]["orders"]["pageInfo"]["hasPreviousPage"])
+
+    def test_after_and_before_bound_the_page(self):
+        cursors = [edge["cursor"] for edge in self.page("first: 5", "edges { cursor }")["data"]["orders"]["edges"]]
+        data = self.page(f'first: 5, after: "{cursors[0]}", before: "{cursors[3]}"')
+        self.assertEqual(self.ids(data), self.ordered[1:3])
+
+    def test_bad_cursors_are_rejected(self):
+        customer_cursor = self.client.post(
+            "/graphql", {"query": "{ allCustomers(first: 1) { edges { cursor } } }"}, content_type="application/json"
+        ).json()["data"]["allCustomers"]["edges"][0]["cursor"]
+        # Garbage, a cursor of another connection (one key instead of two) and
+        # a cursor whose values don't fit the key fields
+        bad_values = base64.urlsafe_b64encode(json.dumps(["yesterday", "x"]).encode()).decode()
+        for cursor in ("nope", customer_cursor, bad_values):
+            data = self.page(f'first: 2, after: "{cursor}"')
+            self.assertEqual(data["errors"][0]["message"], f"Invalid cursor: {cursor}")
+
+    def test_total_count_only_queried_when_selected(self):
+        with self.assertNumQueries(1):
+            self.page("first: 2", "edges { node { id } }")
+        with self.assertNumQueries(2):
+            data = self.page("first: 2", "totalCount edges { node { id } }")
+        self.assertEqual(data["data"]["orders"]["totalCount"], 5)
+
+
+class BulkCreateCustomersTests(TestCase):
+    """bulkCreateCustomers: all or nothing by default, or PARTIAL with a resumable import."""
+
+    mutation = """mutation Bulk($input: [CustomerInput], $mode: ImportMode, $token: String, $batchSize: Int) {
+        bulkCreateCustomers(input: $input, mode: $mode, importToken: $token, batchSize: $batchSize) {
+            createdCount errors importToken rowErrors { index message }
+        }
+    }"""
+
+    def setUp(self):
+        from alx_backend_graphql.schema import schema
+
+        self.schema = schema
+        Customer.objects.create(name="Taken", email="taken@example.com")
+
+    def execute(self, rows, **variables):
+        result = self.schema.execute(self.mutation, variable_values={"input": rows, **variables})
+        if result.errors:
+            return result.errors[0].message
+        return result.data["bulkCreateCustomers"]
+
+    def rows(self, *emails):
+        return [{"name": email.split("@")[0].title(), "email": email} for email in emails]
+
+    def emails(self):
+        return set(Customer.objects.values_list("email", flat=True)) - {"taken@example.com"}
+
+    def test_an_invalid_row_saves_nothing(self):
+        data = self.execute(self.rows("ann@example.com", "not-an-email", "taken@example.com"))
+        self.assertEqual(data["createdCount"], 0)
+        self.assertEqual([error["index"] for error in data["rowErrors"]], [1, 2])
+        self.assertEqual(data["errors"][1], "Row 3: Email 'taken@example.com' already exists.")
+        self.assertEqual(self.emails(), set())
+
+    def test_duplicates_within_the_batch(self):
+        data = self.execute(self.rows("ann@example.com", "bob@example.com", "ann@example.com"))
+        self.assertEqual(
+            data["rowErrors"], [{"index": 2, "message": "Email 'ann@example.com' is repeated in this batch."}]
+        )
+        self.assertEqual(self.emails(), set())
+
+    def test_insert_failure_rolls_back_earlier_chunks(self):
+        # An email taken after validation: the second chunk fails, the first goes too
+        with mock.patch("crm.bulk.existing_emails", return_value=set()):
+            data = self.execute(self.rows("ann@example.com", "taken@example.com"), batchSize=1)
+        self.assertEqual(data["createdCount"], 0)
+        self.assertTrue(data["errors"][0].startswith("Some records failed, rolling back"))
+        self.assertEqual(self.emails(), set())
+
+    def test_email_lookup_is_chunked_by_the_parameter_limit(self):
+        emails = [f"customer{i}@example.com" for i in range(5)] + ["taken@example.com"]
+        with mock.patch.object(connection.features, "max_query_params", 2), self.assertNumQueries(3):
+            self.assertEqual(existing_emails(emails), {"taken@example.com"})
+        with self.assertNumQueries(1):
+            existing_emails(emails)
+
+    def test_partial_import_resumes_with_its_token(self):
+        rows = self.rows("ann@example.com", "bad", "bob@example.com", "taken@example.com")
+        data = self.execute(rows, mode="PARTIAL", batchSize=1)
+        self.assertEqual(data["createdCount"], 2)
+        self.assertEqual([error["index"] for error in data["rowErrors"]], [1, 3])
+        self.assertEqual(self.emails(), {"ann@example.com", "bob@example.com"})
+        token = data["importToken"]
+
+        # The failed rows again, in order: still failing rows keep their original index
+        data = self.execute(self.rows("cy@example.com", "taken@example.com"), token=token)
+        self.assertEqual((data["createdCount"], data["importToken"]), (1, token))
+        self.assertEqual(data["rowErrors"], [{"index": 3, "message": "Email 'taken@example.com' already exists."}])
+
+        data = self.execute(self.rows("dee@example.com"), token=token)
+        self.assertEqual((data["createdCount"], data["importToken"], data["rowErrors"]), (1, None, []))
+        customer_import = CustomerImport.objects.get(token=token)
+        self.assertEqual((customer_import.created_count, customer_import.failed_rows), (4, []))
+        self.assertEqual(len(self.emails()), 4)
+
+    def test_resume_needs_the_failed_rows(self):
+        token = self.execute(self.rows("ann@example.com", "bad", "worse"), mode="PARTIAL")["importToken"]
+        message = self.execute(self.rows("cy@example.com"), token=token)
+        self.assertEqual(message, f"Import {token} expects the 2 failed rows to be re-sent, got 1.")
+        self.assertEqual(self.execute(self.rows("cy@example.com"), token="nope"), "Unknown import token: nope")
+        self.assertEqual(self.emails(), {"ann@example.com"})
+
+
+class RecordingMailer:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def send(self, reminder):
+        if reminder["id"] in self.failing:
+            raise OSError("Mail server unavailable")
+        self.sent.append(reminder["id"])
+
+
+@mock.patch("crm.reminders.asyncio.sleep", mock.AsyncMock())
+class ReminderTests(TestCase):
+    """send_reminders() sends once per order and retries the failed sends on the next run."""
+
+    def setUp(self):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        self.old = Order.objects.create(customer=customer, order_date=timezone.now() - timedelta(days=30))
+        self.orders = [Order.objects.create(customer=customer) for _ in range(3)]
+        self.ids = [order.pk for order in self.orders]
+
+    async def test_second_run_sends_nothing(self):
+        mailer = RecordingMailer()
+        self.assertEqual((await send_reminders(mailer, batch_size=2))[:2], (3, 0))
+        self.assertEqual(sorted(mailer.sent), self.ids)
+        self.assertEqual((await send_reminders(mailer, batch_size=2))[:2], (0, 0))
+        self.assertEqual(len(mailer.sent), 3)
+        checkpoint = await ReminderCheckpoint.objects.aget(name="order_reminders")
+        self.assertEqual((checkpoint.last_order_id, checkpoint.failed_order_ids), (self.ids[-1], []))
+
+    async def test_failed_send_is_retried_next_run(self):
+        mailer = RecordingMailer(failing=[self.ids[0]])
+        self.assertEqual((await send_reminders(mailer))[:2], (2, 1))
+        checkpoint = await ReminderCheckpoint.objects.aget(name="order_reminders")
+        # The mark moved past the failed order, which is kept to be retried
+        self.assertEqual((checkpoint.last_order_id, checkpoint.failed_order_ids), (self.ids[-1], [self.ids[0]]))
+
+        mailer.failing.clear()
+        self.assertEqual((await send_reminders(mailer))[:2], (1, 0))
+        self.assertEqual(sorted(mailer.sent), self.ids)
+        await checkpoint.arefresh_from_db()
+        self.assertEqual(checkpoint.failed_order_ids, [])
+
+
+class OrderItemMigrationTests(TransactionTestCase):
+    """0010 turns the plain order/product links into OrderItem rows."""
+
+    migrate_from = [("crm", "0009_order_date_default")]
+    migrate_to = [("crm", "0010_orderitem")]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.migrate_from)
+        self.addCleanup(self.migrate_to_latest)
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_links_become_items_and_totals_are_summed(self):
+        apps = self.executor.loader.project_state(self.migrate_from).apps
+        Customer, Product, Order = (apps.get_model("crm", name) for name in ("Customer", "Product", "Order"))
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        widget = Product.objects.create(name="Widget", stock=5, price=Decimal("2.00"))
+        gadget = Product.objects.create(name="Gadget", stock=5, price=Decimal("3.50"))
+        both = Order.objects.create(customer=customer, total_amount=Decimal("1.00"))
+        both.products.add(widget, gadget)
+        empty = Order.objects.create(customer=customer, total_amount=Decimal("9.00"))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_to)
+        apps = executor.loader.project_state(self.migrate_to).apps
+        OrderItem, Order = apps.get_model("crm", "OrderItem"), apps.get_model("crm", "Order")
+        self.assertEqual(
+            sorted(OrderItem.objects.values_list("order_id", "product_id", "quantity", "unit_price")),
+            [(both.pk, widget.pk, 1, Decimal("2.00")), (both.pk, gadget.pk, 1, Decimal("3.50"))],
+        )
+        self.assertEqual(Order.objects.get(pk=both.pk).total_amount, Decimal("5.50"))
+        # No lines to sum, the stored total stays
+        self.assertEqual(Order.objects.get(pk=empty.pk).total_amount, Decimal("9.00"))
+
+
+class GraphQLClientTests(TestCase):
+    def get(self, url, headers=None, timeout=None):
+        # requests.get, served by the test client
+        extra = {"HTTP_IF_NONE_MATCH": headers["If-None-Match"]} if headers else {}
+        response = self.client.get(url.removeprefix("http://testserver"), **extra)
+        self.requests.append((response.status_code, dict(headers or {})))
+        return mock.Mock(
+            status_code=response.status_code, headers=response.headers, text=response.content.decode("utf-8")
+        )
+
+    def setUp(self):
+        self.requests = []
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        patcher = mock.patch("crm.graphql_client.requests.get", side_effect=self.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_schema_view_revalidates_with_etag(self):
+        response = self.client.get("/graphql/schema")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("type Query", response.content.decode())
+        response = self.client.get("/graphql/schema", HTTP_IF_NONE_MATCH=response.headers["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_schema_is_cached_by_version(self):
+        sdl = load_schema("http://testserver/graphql", cache_dir=self.cache_dir)
+        self.assertIn("type Query", sdl)
+        self.assertEqual(load_schema("http://testserver/graphql", cache_dir=self.cache_dir), sdl)
+        (first, _), (second, headers) = self.requests
+        self.assertEqual((first, second), (200, 304))
+        self.assertIn("If-None-Match", headers)
+
+    def test_stale_schema_is_refetched(self):
+        load_schema("http://testserver/graphql", cache_dir=self.cache_dir)
+        (path,) = (entry.path for entry in os.scandir(self.cache_dir))
+        with open(path, "w") as f:
+            json.dump({"etag": '"old-version"', "sdl": "type Query { gone: Int }"}, f)
+        self.assertIn("hello", load_schema("http://testserver/graphql", cache_dir=self.cache_dir))
+        self.assertEqual([status for status, _ in self.requests], [200, 200])
+
+    def test_execute_in_process(self):
+        self.assertEqual(execute("{ hello }"), {"hello": "Hello, GraphQL!"})
+        with self.assertRaises(OperationError):
+            execute("{ nope }")
+        self.assertEqual(self.requests, [])
+
+    def test_cron_restocks_in_process(self):
+        product = Product.objects.create(name="Widget", stock=2, price=Decimal("1.00"))
+        log = mock.mock_open()
+        with mock.patch("crm.cron.open", log, create=True):
+            cron.update_low_stock()
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 12)
+        written = "".join(call.args[0] for call in log().write.call_args_list)
+        self.assertIn(f"Product {product.pk} restocked to 12", written)
+        self.assertNotIn("Error", written)
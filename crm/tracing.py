@@ -0,0 +1,140 @@
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.db.models import QuerySet
+from django.utils import timezone
+
+TRACING_HEADER = "HTTP_X_CRM_TRACE"
+
+# The record of the resolver running in this context. A context var rather
+# than a stack so that resolvers awaited concurrently each keep their own.
+current_record = ContextVar("crm_trace_record", default=None)
+
+
+def tracing_enabled(request):
+    """On for every request with the CRM_GRAPHQL_TRACING setting, or per request
+    with an ``X-CRM-Trace: 1`` header from staff (or anyone under DEBUG): the
+    report shows SQL timings and a traced request skips the response cache."""
+    if getattr(settings, "CRM_GRAPHQL_TRACING", False):
+        return True
+    return request.META.get(TRACING_HEADER) in ("1", "true") and (settings.DEBUG or request.user.is_staff)
+
+
+async def atracing_enabled(request):
+    """``tracing_enabled()`` for the async view, loading the user with the async ORM."""
+    if getattr(settings, "CRM_GRAPHQL_TRACING", False):
+        return True
+    return request.META.get(TRACING_HEADER) in ("1", "true") and (settings.DEBUG or (await request.auser()).is_staff)
+
+
+def field_pattern(path):
+    # orders.edges.3.node.customer -> orders.edges.node.customer
+    return ".".join(str(key) for key in path if not isinstance(key, int))
+
+
+class Tracer:
+    """Graphene middleware timing every resolver (Apollo tracing format) and
+    charging each SQL query to the resolver that ran it.
+
+    A resolver returning an unevaluated QuerySet has it evaluated inside the
+    timed call, otherwise graphql-core would run that SQL after the resolver
+    returned and it couldn't be attributed. An async resolver is timed until
+    its coroutine finishes.
+    """
+
+    def __init__(self):
+        self.started_at = timezone.now()
+        self.start = time.perf_counter_ns()
+        self.resolvers = []
+        self.sql = defaultdict(lambda: {"count": 0, "duration": 0})
+
+    def resolve(self, next, root, info, **args):
+        record = {
+            "path": info.path.as_list(),
+            "parentType": info.parent_type.name,
+            "fieldName": info.field_name,
+            "returnType": str(info.return_type),
+            "startOffset": time.perf_counter_ns() - self.start,
+            "duration": 0,
+            "sql": {"count": 0, "duration": 0},
+        }
+        self.resolvers.append(record)
+        token = current_record.set(record)
+        awaited = False
+        try:
+            result = next(root, info, **args)
+            if isawaitable(result):
+                awaited = True
+                return self.resolve_async(result, record)
+            if isinstance(result, QuerySet):
+                result = list(result)
+            return result
+        finally:
+            current_record.reset(token)
+            if not awaited:
+                record["duration"] = time.perf_counter_ns() - self.start - record["startOffset"]
+
+    async def resolve_async(self, result, record):
+        token = current_record.set(record)
+        try:
+            return await result
+        finally:
+            record["duration"] = time.perf_counter_ns() - self.start - record["startOffset"]
+            current_record.reset(token)
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter_ns()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter_ns() - started
+            record = current_record.get()
+            pattern = field_pattern(record["path"]) if record else None
+            if record:
+                record["sql"]["count"] += 1
+                record["sql"]["duration"] += duration
+            self.sql[pattern]["count"] += 1
+            self.sql[pattern]["duration"] += duration
+
+    @contextmanager
+    def capture_sql(self):
+        with connection.execute_wrapper(self.execute_wrapper):
+            yield
+
+    @asynccontextmanager
+    async def acapture_sql(self):
+        # The async ORM runs the request's queries on its sync thread, whose
+        # connection is the one to wrap
+        await sync_to_async(lambda: connection.execute_wrappers.append(self.execute_wrapper))()
+        try:
+            yield
+        finally:
+            await sync_to_async(lambda: connection.execute_wrappers.remove(self.execute_wrapper))()
+
+    def report(self):
+        """The ``tracing`` extension: Apollo tracing plus a per-field SQL summary.
+
+        ``sql.byField`` sums the queries of every instance of a field, so an N+1
+        shows up as one field path with a count that grows with the page size.
+        Durations are in nanoseconds.
+        """
+        duration = time.perf_counter_ns() - self.start
+        by_field = {pattern or "(outside resolvers)": totals for pattern, totals in self.sql.items()}
+        return {
+            "version": 1,
+            "startTime": self.started_at.isoformat(),
+            "endTime": timezone.now().isoformat(),
+            "duration": duration,
+            "execution": {"resolvers": self.resolvers},
+            "sql": {
+                "count": sum(totals["count"] for totals in by_field.values()),
+                "duration": sum(totals["duration"] for totals in by_field.values()),
+                "byField": dict(sorted(by_field.items(), key=lambda item: -item[1]["count"])),
+            },
+        }
@@ -0,0 +1,93 @@
+import re
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+EMAIL_PATTERN = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.(com|in|edu|net)")
+PHONE_PATTERN = re.compile(r"(\+\d{1,3})?\s?\(?\d{1,4}\)?[\s.-]?\d{3}[\s.-]?\d{4}")
+
+
+# Row level rules shared by the mutations and the bulk/streaming importers.
+# Each clean_* function returns the cleaned values or raises ValueError with the
+# message to report for the row.
+
+def clean_customer(data):
+    name, email, phone = data.get("name"), data.get("email"), data.get("phone")
+    if not name or not email:
+        raise ValueError("Name and Email are required.")
+    if EMAIL_PATTERN.search(email) is None:
+        raise ValueError(f"Invalid email: {email}")
+    if phone and PHONE_PATTERN.search(phone) is None:
+        raise ValueError(f"Invalid Phone: {phone}")
+    return {"name": name, "email": email, "phone": phone or None}
+
+
+def clean_product(data):
+    name, stock, price = data.get("name"), data.get("stock"), data.get("price")
+    if not name:
+        raise ValueError("Name is required.")
+    if stock in ("", None):
+        stock = None
+    else:
+        try:
+            stock = int(stock)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid stock: {stock}")
+        if stock < 0:
+            raise ValueError("Stock cannot be negative")
+    try:
+        # Go through str() so floats don't carry binary noise into the Decimal
+        price = Decimal(str(price))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Invalid price: {price}")
+    if not price.is_finite():
+        raise ValueError(f"Invalid price: {price}")
+    if price < 0:
+        raise ValueError("Price cannot be negative")
+    return {"name": name, "stock": stock, "price": price}
+
+
+def clean_order(data):
+    """Return the customer id, ``{product_id: quantity}`` and order date of an order.
+
+    Quantities come from ``items`` (``product_id``/``quantity`` pairs) and from
+    ``product_ids``, where a repeated id orders one more unit.
+    """
+    customer_id = data.get("customer_id")
+    product_ids = data.get("product_ids") or []
+    items = data.get("items") or []
+    order_date = data.get("order_date")
+    if not customer_id:
+        raise ValueError("Customer ID is required.")
+    if isinstance(product_ids, str):
+        # CSV rows carry the product ids as "1;2;3"
+        product_ids = [pid for pid in product_ids.split(";") if pid.strip()]
+    try:
+        customer_id = int(customer_id)
+        quantities = Counter(int(pid) for pid in product_ids)
+        lines = [
+            (int(item["product_id"]), 1 if item.get("quantity") is None else int(item["quantity"]))
+            for item in items
+        ]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Customer and product IDs must be integers.")
+    for product_id, quantity in lines:
+        if quantity < 1:
+            raise ValueError("Quantity must be at least 1")
+        quantities[product_id] += quantity
+    if not quantities:
+        raise ValueError("Product IDs list cannot be empty")
+
+    if order_date in ("", None):
+        order_date = timezone.now()
+    elif not isinstance(order_date, datetime):
+        parsed = parse_datetime(str(order_date))
+        if parsed is None:
+            raise ValueError(f"Invalid order date: {order_date}")
+        order_date = parsed
+    if timezone.is_naive(order_date):
+        order_date = timezone.make_aware(order_date)
+    return {"customer_id": customer_id, "quantities": dict(quantities), "order_date": order_date}
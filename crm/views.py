@@ -1,3 +1,553 @@
+import json
+from contextlib import nullcontext
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, transaction
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render
+from django.utils.dateparse import parse_date
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import (
+    ExecutionResult,
+    GraphQLError,
+    OperationType,
+    execute,
+    get_operation_ast,
+    print_schema,
+    specified_rules,
+)
+
+from . import response_cache
+from .cost import CostLimit, QueryCostRule, actual_cost, get_estimate, get_limits
+from .documents import documents, parse_and_validate, schema_version
+from .exporters import CONTENT_TYPES, export_orders, stream_export
+from .importers import FORMATS, IMPORTERS, read_rows, stream_import
+from .loaders import CRMLoaders
+from .persisted import get_persisted_query, load_persisted_document, persisted_queries
+from .tracing import Tracer, atracing_enabled, tracing_enabled
+
+def execute_operation(schema, document, is_mutation, **execute_options):
+    """graphql-core's ``execute`` with graphene-django's ATOMIC_MUTATIONS
+    handling: a mutation runs in a transaction, rolled back when it flagged
+    errors on the context."""
+    if is_mutation and (
+        graphene_settings.ATOMIC_MUTATIONS is True
+        or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+    ):
+        with transaction.atomic():
+            result = execute(schema, document, **execute_options)
+            if getattr(execute_options["context_value"], MUTATION_ERRORS_FLAG, False) is True:
+                transaction.set_rollback(True)
+        return result
+    return execute(schema, document, **execute_options)
+
 
 # Create your views here.
+class CRMGraphQLView(GraphQLView):
+    """GraphQL endpoint that gives every request its own set of DataLoaders.
+
+    Parsing and validation results are cached per query text (see
+    crm.documents), and automatic persisted queries are answered: a request may
+    send only the SHA-256 of a query it registered before, and that query is
+    executed from its cached, already validated document.
+
+    Operations over the cost/depth budget are rejected during validation, and
+    stopped during execution when what they return goes over it (see
+    crm.cost); the estimated and actual cost of the others are reported in the
+    response ``extensions``, next to resolver and SQL timings when tracing is
+    on (see crm.tracing).
+
+    A JSON array of operations is executed as a batch, in order, and answered
+    with an array of results. The operations share one set of DataLoaders, and
+    a query repeated with the same variables is executed once; a mutation
+    clears both so the operations after it see its writes.
+    """
+    validation_rules = (*specified_rules, QueryCostRule)
+
+    def get_context(self, request, is_async=False):
+        # The operations of a batch share the loaders start_batch() set up
+        loaders = getattr(request, "loaders", None)
+        if not self.in_batch(request) or loaders is None or loaders.is_async != is_async:
+            request.loaders = CRMLoaders(is_async=is_async)
+        return request
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.is_batch_request(request):
+            return super().dispatch(request, *args, **kwargs)
+        try:
+            data = self.parse_body(request)
+            self.check_batch_cost(request, data)
+            self.start_batch(request)
+            return self.batch_response([self.get_response(request, entry) for entry in data])
+        except HttpError as e:
+            return self.error_response(request, e)
+
+    def is_batch_request(self, request):
+        return (
+            not self.batch
+            and request.method == "POST"
+            and self.get_content_type(request) == "application/json"
+            and request.body.lstrip()[:1] == b"["
+        )
+
+    def parse_body(self, request):
+        if not self.is_batch_request(request):
+            return super().parse_body(request)
+        try:
+            data = json.loads(request.body.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            raise HttpError(HttpResponseBadRequest("POST body sent invalid JSON."))
+        max_size = getattr(settings, "CRM_GRAPHQL_MAX_BATCH_SIZE", 20)
+        if not data or not all(isinstance(entry, dict) for entry in data):
+            raise HttpError(HttpResponseBadRequest("A batch must be a non-empty list of operations."))
+        if len(data) > max_size:
+            raise HttpError(HttpResponseBadRequest(f"A batch can hold at most {max_size} operations."))
+        return data
+
+    def check_batch_cost(self, request, data):
+        """Reject a batch whose operations are estimated above CRM_QUERY_MAX_COST
+        together, each one alone is held to it during validation. Operations
+        that don't load or validate fail on their own and aren't counted."""
+        max_cost = get_limits()[0]
+        cost = 0
+        for entry in data:
+            query, variables, operation_name, _ = self.get_graphql_params(request, entry)
+            try:
+                loaded = self.load_document(request, entry, query)
+            except GraphQLError:
+                continue
+            if loaded is None or loaded[1]:
+                continue
+            operation = get_operation_ast(loaded[0], operation_name)
+            if operation is not None:
+                cost += get_estimate(self.schema.graphql_schema, loaded[0], operation)[0]
+        if cost > max_cost:
+            raise HttpError(HttpResponseBadRequest(
+                f"The batch has an estimated cost of {cost}, the limit is {max_cost}."
+            ))
+
+    @staticmethod
+    def start_batch(request):
+        request.loaders = None
+        request.batch_results = {}
+
+    @staticmethod
+    def in_batch(request):
+        return getattr(request, "batch_results", None) is not None
+
+    def batch_response(self, responses):
+        result = "[{}]".format(",".join(response for response, _ in responses))
+        status_code = max(status_code for _, status_code in responses)
+        return HttpResponse(status=status_code, content=result, content_type="application/json")
+
+    def error_response(self, request, e):
+        response = e.response
+        response["Content-Type"] = "application/json"
+        response.content = self.json_encode(request, {"errors": [self.format_error(e)]})
+        return response
+
+    @staticmethod
+    def batch_key(document, variables, operation_name):
+        return document, operation_name, json.dumps(variables or {}, sort_keys=True, default=str)
+
+    def end_mutation(self, request):
+        # Later operations of the batch must see what the mutation wrote
+        if self.in_batch(request):
+            request.loaders.clear()
+            request.batch_results.clear()
+
+    def load_document(self, request, data, query):
+        """``(document, errors)`` of the persisted query or query text the request
+        sent, None when it sent neither."""
+        sha256_hash = get_persisted_query(request, data)
+        if sha256_hash is not None:
+            return load_persisted_document(sha256_hash, query, self.parse_and_validate)
+        if query:
+            return self.parse_and_validate(query)
+        return None
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        try:
+            loaded = self.load_document(request, data, query)
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+        if loaded is None:
+            # No query: let graphene-django render GraphiQL or the 400
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+        document, errors = loaded
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+        result = self.execute_document(request, document, variables, operation_name, show_graphiql)
+        return self.add_cost(result, document, operation_name)
+
+    def get_response(self, request, data, show_graphiql=False):
+        """``GraphQLView.get_response``, also sending the result's ``extensions``."""
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.build_response(request, execution_result, id, show_graphiql)
+
+    def build_response(self, request, execution_result, id, show_graphiql=False):
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if not execution_result:
+            return None, status_code
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.errors and any(not getattr(e, "path", None) for e in execution_result.errors):
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+        if execution_result.extensions:
+            response["extensions"] = execution_result.extensions
+        if self.batch or self.in_batch(request):
+            response["id"] = id
+            response["status"] = status_code
+        return self.json_encode(request, response, pretty=show_graphiql), status_code
+
+    def add_cost(self, result, document, operation_name):
+        operation = get_operation_ast(document, operation_name)
+        if result is None or operation is None:
+            return result
+        schema = self.schema.graphql_schema
+        estimated, depth = get_estimate(schema, document, operation)
+        actual = actual_cost(schema, document, operation, result.data) if result.data else 0
+        result.extensions = {
+            **(result.extensions or {}),
+            "cost": {"estimated": estimated, "actual": actual, "limit": get_limits()[0], "depth": depth},
+        }
+        return result
+
+    def parse_and_validate(self, query):
+        return parse_and_validate(
+            self.schema.graphql_schema, query, self.validation_rules, graphene_settings.MAX_VALIDATION_ERRORS
+        )
+
+    def check_method(self, request, operation_ast, show_graphiql=False):
+        """False when the operation can't run over this request's method (GraphiQL
+        then just renders), raises the 405 otherwise."""
+        if request.method.lower() == "get" and operation_ast is not None and operation_ast.operation != OperationType.QUERY:
+            if show_graphiql:
+                return False
+            raise HttpError(HttpResponseNotAllowed(
+                ["POST"], f"Can only perform a {operation_ast.operation.value} operation from a POST request."
+            ))
+        return True
+
+    def get_cached_response(self, document, variables, operation_name):
+        """``(result, cache_key, timeout)``: the cached result of a query when the
+        response cache has one, else the key to store it under (None when it
+        mustn't be cached)."""
+        if not response_cache.is_enabled():
+            return None, None, 0
+        cache_key, timeout = response_cache.response_key(self.schema.graphql_schema, document, operation_name, variables)
+        data = response_cache.get_response(cache_key) if cache_key else None
+        if data is not None:
+            return ExecutionResult(data=data), None, 0
+        return None, cache_key, timeout
+
+    def get_execute_options(self, request, variables, operation_name, tracer=None, is_async=False):
+        # CostLimit holds the actual cost of this execution
+        middleware = [*(self.get_middleware(request) or ()), CostLimit()]
+        if tracer is not None:
+            middleware.append(tracer)
+        execute_options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request, is_async=is_async),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": middleware,
+        }
+        if self.execution_context_class:
+            execute_options["execution_context_class"] = self.execution_context_class
+        return execute_options
+
+    def finish_result(self, result, tracer, cache_key, timeout):
+        if tracer is not None:
+            result.extensions = {**(result.extensions or {}), "tracing": tracer.report()}
+        if cache_key and not result.errors:
+            response_cache.set_response(cache_key, result.data, timeout)
+        return result
+
+    def execute_document(self, request, document, variables, operation_name, show_graphiql=False):
+        """The execution half of ``GraphQLView.execute_graphql_request``, for a
+        document that is already parsed and validated. Queries are answered from
+        the response cache when it is enabled (see crm.response_cache), unless
+        the request is traced."""
+        schema = self.schema.graphql_schema
+        operation_ast = get_operation_ast(document, operation_name)
+        is_mutation = operation_ast is not None and operation_ast.operation == OperationType.MUTATION
+        is_query = operation_ast is not None and operation_ast.operation == OperationType.QUERY
+        if not self.check_method(request, operation_ast, show_graphiql):
+            return None
+
+        batch_key = None
+        if is_query and self.in_batch(request):
+            batch_key = self.batch_key(document, variables, operation_name)
+            if batch_key in request.batch_results:
+                return request.batch_results[batch_key]
+
+        tracer = Tracer() if tracing_enabled(request) else None
+        cache_key, timeout = None, 0
+        if is_query and tracer is None:
+            cached, cache_key, timeout = self.get_cached_response(document, variables, operation_name)
+            if cached is not None:
+                return cached
+
+        execute_options = self.get_execute_options(request, variables, operation_name, tracer)
+        try:
+            with tracer.capture_sql() if tracer else nullcontext():
+                result = execute_operation(schema, document, is_mutation, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        finally:
+            if is_mutation:
+                self.end_mutation(request)
+        if batch_key is not None:
+            request.batch_results[batch_key] = result
+        return self.finish_result(result, tracer, cache_key, timeout)
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """``CRMGraphQLView`` as an async view, for ASGI.
+
+    Queries execute on the event loop: the root connections, ``crmStats`` and
+    the DataLoaders read with the async ORM and return coroutines, which
+    graphql-core awaits together, so sibling fields (and the loaders of every
+    row) resolve concurrently instead of one after the other. Django still runs
+    each request's SQL on one connection, so the gain is in overlapping the
+    waits and in serving more requests per worker, not in parallel queries.
+
+    Mutations keep the sync path in a thread because ``transaction.atomic``
+    can't span awaits; GraphiQL and method errors are handed to the sync view.
+    """
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method.lower() not in ("get", "post") or (self.graphiql and self.request_wants_html(request)):
+            return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+        try:
+            data = self.parse_body(request)
+            if isinstance(data, list):
+                await sync_to_async(self.check_batch_cost)(request, data)
+                self.start_batch(request)
+                return self.batch_response([await self.aget_response(request, entry) for entry in data])
+            result, status_code = await self.aget_response(request, data)
+            return HttpResponse(status=status_code, content=result, content_type="application/json")
+        except HttpError as e:
+            return self.error_response(request, e)
+
+    async def aget_response(self, request, data):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        execution_result = await self.aexecute_graphql_request(request, data, query, variables, operation_name)
+        return self.build_response(request, execution_result, id)
+
+    async def aexecute_graphql_request(self, request, data, query, variables, operation_name):
+        # Parsing and validating a document not cached yet is CPU work, and the
+        # response cache's calls (e.g. to Redis) block: neither runs on the loop
+        try:
+            loaded = await sync_to_async(self.load_document)(request, data, query)
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+        if loaded is None:
+            # No query, graphene-django answers the 400 without touching the database
+            return GraphQLView.execute_graphql_request(self, request, data, query, variables, operation_name)
+        document, errors = loaded
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+        result = await self.aexecute_document(request, document, variables, operation_name)
+        return self.add_cost(result, document, operation_name)
+
+    async def aexecute_document(self, request, document, variables, operation_name):
+        operation_ast = get_operation_ast(document, operation_name)
+        if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+            return await sync_to_async(self.execute_document)(request, document, variables, operation_name)
+
+        batch_key = None
+        if self.in_batch(request):
+            batch_key = self.batch_key(document, variables, operation_name)
+            if batch_key in request.batch_results:
+                return request.batch_results[batch_key]
+
+        tracer = Tracer() if await atracing_enabled(request) else None
+        cache_key, timeout = None, 0
+        if tracer is None and response_cache.is_enabled():
+            cached, cache_key, timeout = await sync_to_async(self.get_cached_response)(
+                document, variables, operation_name
+            )
+            if cached is not None:
+                return cached
+
+        execute_options = self.get_execute_options(request, variables, operation_name, tracer, is_async=True)
+        try:
+            async with tracer.acapture_sql() if tracer else nullcontext():
+                result = execute(self.schema.graphql_schema, document, **execute_options)
+                if isawaitable(result):
+                    result = await result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        if batch_key is not None:
+            request.batch_results[batch_key] = result
+        if cache_key:
+            return await sync_to_async(self.finish_result)(result, tracer, cache_key, timeout)
+        return self.finish_result(result, tracer, cache_key, timeout)
+
+
+IMPORT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+}
+
+
+@csrf_exempt
+@require_POST
+def import_view(request, kind):
+    """Stream a CSV/NDJSON request body into the CRM, for staff or DEBUG.
+
+    The body is read line by line and written in bounded batches; the response
+    is NDJSON with one progress report (totals, rows/s, that batch's errors) per
+    batch, so neither side buffers the whole file.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    if kind not in IMPORTERS:
+        return JsonResponse({"error": f"Unknown import: {kind}"}, status=404)
+    content_type = request.content_type.split(";", 1)[0].lower()
+    fmt = request.GET.get("format") or IMPORT_CONTENT_TYPES.get(content_type)
+    if fmt not in FORMATS:
+        return JsonResponse({"error": "Send text/csv or application/x-ndjson, or pass ?format="}, status=400)
+    try:
+        batch_size = int(request.GET["batch_size"]) if request.GET.get("batch_size") else None
+    except ValueError:
+        return JsonResponse({"error": "batch_size must be an integer"}, status=400)
+
+    def progress():
+        try:
+            for report in stream_import(kind, read_rows(request, fmt), batch_size):
+                yield json.dumps(report) + "\n"
+        except ValueError as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingHttpResponse(streaming_content(request, progress()), content_type="application/x-ndjson")
+
+
+def accepts_gzip(request):
+    """Whether Accept-Encoding allows gzip, ``gzip;q=0`` being a refusal."""
+    qualities = {}
+    for coding in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+    quality = qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0)))
+    return quality > 0
+
+
+async def aiterate(iterator):
+    # Each step runs on the request's sync thread, where its connection and
+    # server-side cursor live
+    iterator = iter(iterator)
+    done = object()
+    while (chunk := await sync_to_async(next)(iterator, done)) is not done:
+        yield chunk
+
+
+def streaming_content(request, iterator):
+    """``iterator`` as a streaming response body.
+
+    Under ASGI Django would read a sync iterator to the end before sending
+    anything, so it gets an async iterator that pulls one chunk at a time.
+    """
+    if isinstance(request, ASGIRequest):
+        return aiterate(iterator)
+    return iterator
+
+
+def export_orders_view(request):
+    """Stream every order of ``?start_date=&end_date=`` (inclusive) as NDJSON
+    (default) or ``?format=csv``, for staff or DEBUG.
+
+    Rows are written as they are read (see crm.exporters), gzip-compressed on
+    the fly when the client accepts it, so the response never sits in memory.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in CONTENT_TYPES:
+        return JsonResponse({"error": f"format must be one of {', '.join(CONTENT_TYPES)}"}, status=400)
+    dates = {}
+    for name in ("start_date", "end_date"):
+        value = request.GET.get(name)
+        try:
+            dates[name] = parse_date(value) if value else None
+        except ValueError:
+            dates[name] = None
+        if value and dates[name] is None:
+            return JsonResponse({"error": f"{name} must be a YYYY-MM-DD date"}, status=400)
+
+    compress = accepts_gzip(request)
+    response = StreamingHttpResponse(
+        streaming_content(request, stream_export(export_orders(**dates), fmt, compress)),
+        content_type=CONTENT_TYPES[fmt],
+    )
+    response["Content-Disposition"] = f'attachment; filename="orders.{fmt}"'
+    response["Vary"] = "Accept-Encoding"
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    return response
+
+
+def document_cache_stats(request):
+    """Hit/miss counters of this process's document caches, for staff or DEBUG."""
+    if not (settings.DEBUG or request.user.is_staff):
+        raise Http404
+    return JsonResponse({
+        "documents": documents.cache_info()._asdict(),
+        "persisted_queries": persisted_queries.cache_info()._asdict(),
+    })
+
+
+def get_schema_etag(request):
+    return schema_version(graphene_settings.SCHEMA.graphql_schema)
+
+
+@require_GET
+@condition(etag_func=get_schema_etag)
+def schema_view(request):
+    """The schema as SDL, its version as the ETag.
+
+    Out-of-process clients keep a copy and revalidate it with If-None-Match
+    (see crm.graphql_client): a 304 when it is current, the new SDL after a
+    deploy changed it, never an introspection query.
+    """
+    sdl = print_schema(graphene_settings.SCHEMA.graphql_schema)
+    return HttpResponse(sdl, content_type="text/plain; charset=utf-8")